@@ -22,15 +22,22 @@ import common.constants as const
 from battle import Battle
 from gacha import GachaManager
 from commands import *
+from common.anilist import update_media_snapshot
+from common.anilist_db import MediaSnapshot
 from common.arg_parsers import trivia_arg_parser
+from common.command_registry import CommandRegistry, CommandSpec
 from common.connections import ApiManager, DatabaseManager
+from common.ddragon import DataDragon
+from common.emotes import EmoteManager
+from common.listing import ListingManager
 from common.mal import MalManager
+from common.outgoing import OutgoingScheduler, HIGH, BULK
 from common.steam import set_steam_user, show_steam_user, steam_user_rand_series
 from common.tcg import display_mtg_card, display_ptcg_card, display_ygo_card
-from common.utils import find_true_name, gen_uhtml_img_code, leaderboard_uhtml, birthday_text
+from common.typing_test import LENGTHS, SentenceCorpus, TypingStats
+from common.utils import find_true_name, gen_uhtml_img_code, leaderboard_uhtml, birthday_text, IMG_DIMS
 from room import Room
-from trivia import check_answer
-from user import User
+from user import User, UserInfoCache
 
 PS_SOCKET = 'ws://sim.smogon.com:8000/showdown/websocket'
 JOINLIST = [const.ANIME_ROOM,
@@ -46,6 +53,8 @@ JOINLIST = [const.ANIME_ROOM,
             const.SMASH_ROOM,
             const.WRESTLING_ROOM]
 WS = None
+# Chat lines that init frames replay from the room's backlog.
+BACKLOG_TYPES = {'c:', 'c', 'chat'}
 
 
 def is_int_str(s):
@@ -103,31 +112,51 @@ class Bot:
         self.friendslist = json.load(open(const.FRIENDFILE))
 
         self.incoming = asyncio.Queue()
-        self.outgoing = asyncio.Queue()
+        self.outgoing = OutgoingScheduler()
 
         self.roomlist = {}
-        self.users = {}
+        self.users = UserInfoCache(self.request_userinfo)
 
         self.battles = {}
         self.allow_laddering = False
 
         self.typers = {}
-        self.wpms = pd.read_csv(const.WPMFILE, converters={'recent_runs': eval}).set_index('user')
-        with open(const.SENTENCEFILE) as f:
-            for i, _ in enumerate(f):
-                pass
-            self.num_typing_sentences = i+1
+        self.sentences = SentenceCorpus()
 
 
         self.roomdata_man = DatabaseManager(const.ROOMDATA_DB)
+        self.emote_man = EmoteManager(self.roomdata_man)
+        self.typing_stats = TypingStats(self.roomdata_man)
+        self.listing_man = ListingManager(self.username)
         self.gachaman = GachaManager()
 
         self.anilist_man = ApiManager(0.7)
         self.jikan_man = ApiManager(1)
         self.mal_man = MalManager(self.roomdata_man)
+        self.media_snapshot = MediaSnapshot()
+        self.ddragon = DataDragon()
+        self.ddragon.load()
 
         self.mal_rooms = [const.ANIME_ROOM, const.PEARY_ROOM]
         self.steam_rooms = [const.VG_ROOM, const.PEARY_ROOM]
+        self.commands = self.register_commands()
+
+        self.handlers = {'queryresponse': self.handle_queryresponse,
+                         'users': self.handle_users,
+                         'J': self.handle_join,
+                         'j': self.handle_join,
+                         'L': self.handle_leave,
+                         'l': self.handle_leave,
+                         'N': self.handle_name,
+                         'n': self.handle_name,
+                         'updatesearch': self.handle_updatesearch,
+                         'updatechallenges': self.handle_updatechallenges,
+                         'challstr': self.handle_challstr,
+                         'updateuser': self.handle_updateuser,
+                         'c:': self.handle_chat,
+                         'pm': self.handle_pm}
+        # msg_type -> [count, total seconds, max seconds]
+        self.handler_stats = {}
 
         self.refresh_igdb_token()
 
@@ -189,8 +218,12 @@ class Bot:
         asyncio.create_task(self.ping_connect(), name='ping-connect')
         asyncio.create_task(self.user_repeater(), name='user-repeat')
         asyncio.create_task(self.prune_anotd(), name='anotd_repeat')
+        asyncio.create_task(self.emote_repeater(), name='emote-repeat')
+        asyncio.create_task(self.media_snapshot_repeater(), name='media-snapshot-repeat')
+        asyncio.create_task(self.ddragon.update(), name='ddragon-update')
+        asyncio.create_task(self.gacha_repeater(), name='gacha-repeat')
 
-        birthday_rooms = self.roomdata_man.execute("SELECT DISTINCT room FROM birthdays")
+        birthday_rooms = await self.roomdata_man.execute("SELECT DISTINCT room FROM birthdays")
         for room in birthday_rooms:
             asyncio.create_task(self.birthday_repeater(room[0]), name=f'{room[0]}-birthdays')
 
@@ -211,7 +244,11 @@ class Bot:
 
         Args:
         '''
-        next_time = await self.roomdata_man.execute(f"SELECT 'day' FROM birthdays WHERE name='next_time' AND room='{ctx}'")[0][0]
+        update_query = "UPDATE birthdays SET day=? WHERE name='next_time' AND room=?"
+
+        next_time = await self.roomdata_man.execute("SELECT day FROM birthdays "
+                                                    "WHERE name='next_time' AND room=?", (ctx,))
+        next_time = float(next_time[0][0]) if next_time else 0
         while True:
             sleep_len = next_time - time.time()
 
@@ -219,76 +256,104 @@ class Bot:
                 sleep_len = 60 * 60 * 6
 
                 new_time = time.time() + sleep_len
-                await self.roomdata_man.execute(f"UPDATE birthdays SET day={new_time} WHERE name='next_time' AND room='{ctx}")
+                await self.roomdata_man.execute(update_query, (new_time, ctx))
 
             await asyncio.sleep(sleep_len)
             text = await birthday_text(self, automatic=True, room=ctx)
-            await self.outgoing.put(f'{ctx}|/adduhtml {text}')
+            if text:
+                await self.outgoing.put(f'{ctx}|/adduhtml {text}')
+
+            next_time = time.time() + 60 * 60 * 6
+            await self.roomdata_man.execute(update_query, (next_time, ctx))
+
+
+    async def emote_repeater(self):
+        '''
+        Repeating process for saving emote usage counts.
+
+        Args:
+        '''
+        while True:
+            await asyncio.sleep(5 * 60)
+            await self.emote_man.flush()
 
-            new_time = time.time() + 60 * 60 * 6
-            await self.roomdata_man.execute(f"UPDATE birthdays SET day={new_time} WHERE name='next_time' AND room='{ctx}")
+
+    async def media_snapshot_repeater(self):
+        '''
+        Repeating process for keeping the local AniList snapshot used
+        by trivia up to date. Trivia queries AniList directly until the
+        first load finishes.
+
+        Args:
+        '''
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.media_snapshot.load)
+        while True:
+            start = time.time()
+            try:
+                written = await update_media_snapshot(self.anilist_man)
+            except (aiohttp.ClientError, KeyError, TypeError) as e:
+                print(f'AniList snapshot update failed: {e}')
+                written = 0
+            print(f'AniList snapshot: {written} series updated in {time.time() - start:.1f}s')
+
+            if written:
+                await loop.run_in_executor(None, self.media_snapshot.load)
+            await asyncio.sleep(6 * 60 * 60)
 
 
     async def gacha_repeater(self):
         '''
         Repeating process for adding gacha currency.
-        Triggers at the top of every hour.
+        Runs at startup, to catch up on hours missed while offline,
+        then a minute past every hour.
 
         Args:
         '''
         while True:
-            now = datetime.datetime.now()
-            next_hour = (now + datetime.timedelta(hours=1)).replace(second=0, minute=1)
-            sleep_len = (next_hour - now).seconds
+            start = time.time()
+            hours, players = await asyncio.to_thread(self.gachaman.grant_hourly, start)
+            print(f'Gacha grant: {hours} hours to {players} players in {time.time() - start:.2f}s')
 
-            await asyncio.sleep(sleep_len)
-            # Potential race condition vs bot startup should
-            # be fine given the above sleep delay.
-            self.gachaman.add_rolls()
+            # Scheduled from the hour itself, so the time spent granting does not drift the next run.
+            next_run = (start // 3600 + 1) * 3600 + 60
+            await asyncio.sleep(max(0, next_run - time.time()))
 
 
     async def get_userinfo(self, true_user):
         '''
-        Gets userinfo from cached dict or queries PS
-        for it if it does not exist.
+        Gets userinfo from the cache or queries PS
+        for it if it is missing or stale.
 
         Args:
             true_user (str): user to get rooms and ranks for
         '''
+        return await self.users.get(true_user)
 
-        if true_user not in self.users:
-            self.users[true_user] = {'group': None,
-                                     'rooms': None,
-                                     'event': asyncio.Event()}
-        else:
-            print(self.users[true_user])
-
-        if not self.users[true_user]['group']:
-            await self.outgoing.put(f'|/cmd userdetails {true_user}')
 
-            await self.users[true_user]['event'].wait()
-            self.users[true_user]['event'].clear()
+    async def request_userinfo(self, true_user, background=False):
+        '''
+        Sends a userdetails query. The response is handled by handle_queryresponse.
+        Commands wait on lookups, so only background refreshes are sent as bulk.
 
-        return self.users[true_user]
+        Args:
+            true_user (str): user to get rooms and ranks for
+            background (bool): whether the query refreshes cached info
+        '''
+        await self.outgoing.put(f'|/cmd userdetails {true_user}', priority=BULK if background else HIGH)
 
 
     async def user_repeater(self):
         '''
-        Repeating process for updating user list.
+        Repeating process for refreshing cached userinfo
+        before it expires.
 
         Args:
         '''
         while True:
-            now = datetime.datetime.now()
-            next_hour = (now + datetime.timedelta(hours=3)).replace(second=0, minute=1)
-            sleep_len = (next_hour - now).seconds
-
-            await asyncio.sleep(sleep_len)
-            # Potential race condition vs bot startup should
-            # be fine given the above sleep delay.
-            for u in self.users:
-                self.users[u]['group'] = None
-                await self.get_userinfo(u)
+            await asyncio.sleep(30 * 60)
+            refreshed = await self.users.refresh()
+            print(f'Refreshed userinfo for {refreshed} of {len(self.users)} users.')
 
 
     async def prune_anotd(self):
@@ -300,33 +365,26 @@ class Bot:
         query = "SELECT medium, mal_id FROM anotd_banlist WHERE expiration < date('now')"
         while True:
             to_delete = await self.roomdata_man.execute(query)
-            for medium, mal_id in to_delete:
-                await self.roomdata_man.execute("DELETE FROM anotd_banlist WHERE "
-                                               f"medium='{medium}' AND mal_id='{mal_id}'")
+            await self.roomdata_man.executemany("DELETE FROM anotd_banlist WHERE medium=? AND mal_id=?",
+                                                to_delete)
 
             await asyncio.sleep(24 * 60 * 60)
 
 
-    async def wpm(self, true_user):
+    async def wpm(self, true_user, length=None):
         '''
         Starts a typing test for a user. Takes from typeracer database.
 
         Args:
             true_user (str): user to run the typing test for
+            length (str): short, medium or long, to pick the sentence's length
         '''
         if true_user in self.typers:
             return
 
         await self.outgoing.put(f'|/w {true_user}, Typing test starting soon...')
 
-        idx = random.randrange(self.num_typing_sentences)
-        sentence = ''
-        with open(const.SENTENCEFILE) as f:
-            for i, l in enumerate(f):
-                if i == idx:
-                    sentence = l[:-1]
-                    break
-
+        sentence = self.sentences.sample(length)
         words = sentence.split(' ')
 
         test_str = ''
@@ -378,241 +436,367 @@ class Bot:
 
     async def message_handler(self, msg):
         '''
-        Acts on websocket messages, depending on their contents.
+        Splits a websocket frame into its protocol lines and dispatches
+        each line to the handler registered for its message type.
 
         Args:
             msg (str): A message from the websocket
         '''
+        lines = msg.split('\n')
 
         curr_room = ''
-        broken = msg.split('\n')
-        if broken[0][0] == '>':
-            curr_room = broken[0][1:]
+        if lines[0].startswith('>'):
+            curr_room = lines[0][1:]
+            lines = lines[1:]
+
+        if curr_room.startswith('battle-'):
+            await self.battle_handler(curr_room, lines)
+
+        # Room init frames replay recent chat, which has already been acted on.
+        is_init = bool(lines) and lines[0].startswith('|init|')
+
+        for line in lines:
+            if not line.startswith('|'):
+                continue
+
+            parts = line.split('|')
+            msg_type = parts[1]
+            if is_init and msg_type in BACKLOG_TYPES:
+                continue
+
+            handler = self.handlers.get(msg_type)
+            if not handler:
+                continue
+
+            start = time.perf_counter()
+            await handler(curr_room, parts)
+            elapsed = time.perf_counter() - start
 
-        parts = msg.split('|')
+            stats = self.handler_stats.setdefault(msg_type, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
 
-        if len(parts) <= 1:
-            print('!!! SEE THIS !!!')
+
+    def handler_stats_text(self):
+        '''
+        Summarizes time spent in each message handler since startup.
+
+        Returns:
+            str: one "type: count, avg ms, max ms" entry per message type
+        '''
+        entries = []
+        for msg_type, (count, total, slowest) in sorted(self.handler_stats.items()):
+            entries.append(f'{msg_type}: {count}, avg {total / count * 1000:.2f}ms, '
+                           f'max {slowest * 1000:.2f}ms')
+
+        return '; '.join(entries) if entries else 'No messages handled yet.'
+
+
+    async def handle_queryresponse(self, curr_room, parts):
+        '''
+        Handler for |queryresponse|QUERYTYPE|JSON lines.
+
+        Args:
+            curr_room (str): Room the line was sent in
+            parts (list): line split on |
+        '''
+        if parts[2] == 'userdetails':
+            self.users.resolve(json.loads('|'.join(parts[3:])))
+        else:
             print(parts)
+
+
+    async def handle_users(self, curr_room, parts):
+        '''
+        Handler for the |users|USERLIST line of a room's init frame.
+
+        Args:
+            curr_room (str): Room the line was sent in
+            parts (list): line split on |
+        '''
+        room = self.roomlist.get(curr_room)
+        if not room:
             return
 
-        # Query Responses
-        if parts[1] == 'queryresponse':
-            if parts[2] == 'userdetails':
-                userinfo = json.loads(parts[3])
-                true_name = userinfo['id']
-                if 'group' in userinfo:
-                    self.users[true_name]['group'] = userinfo['group']
-                if userinfo['rooms']:
-                    self.users[true_name]['rooms'] = userinfo['rooms']
-                self.users[true_name]['event'].set()
-            else:
-                print(parts)
-
-        # Managing room userlists
-        if parts[1] == 'init' and 'chat' in parts[2]:
-            userlist = parts[6].split(',')[1:]
-            for user in userlist:
-                rank = user[0]
-                username = user[1:].split('@')[0]
-                self.roomlist[curr_room].add_user(username, rank)
-
-        if parts[1] == 'J':
-            user = parts[2]
+        for user in parts[2].split(',')[1:]:
             rank = user[0]
             username = user[1:].split('@')[0]
-            self.roomlist[curr_room].add_user(username, rank)
+            room.add_user(username, rank)
 
-        elif parts[1] == 'L':
-            user = parts[2]
-            rank = user[0]
-            username = user[1:].split('@')[0]
-            self.roomlist[curr_room].remove_user(username)
-
-        elif parts[1] == 'N':
-            new_user = parts[2]
-            rank = new_user[0]
-            username = new_user[1:].split('@')[0]
-            old_user = parts[3]
-            self.roomlist[curr_room].remove_user(old_user)
-            self.roomlist[curr_room].add_user(username, rank)
-
-        # Battles
-        if parts[1] == 'updatesearch':
-            await self.update_battles(json.loads(parts[2]))
-        
-        if parts[1] == 'updatechallenges':
-            challenges = json.loads(parts[2])['challengesFrom']
-            for challenge in challenges:
-                await self.respond_challenge(challenge, challenges[challenge])
 
-        if curr_room.startswith('battle-'):
-            await self.battle_handler(msg, curr_room, parts)
+    async def handle_join(self, curr_room, parts):
+        '''
+        Handler for |J|USER and |j|USER lines.
+
+        Args:
+            curr_room (str): Room the line was sent in
+            parts (list): line split on |
+        '''
+        room = self.roomlist.get(curr_room)
+        if not room:
+            return
+
+        user = parts[2]
+        rank = user[0]
+        username = user[1:].split('@')[0]
+        room.add_user(username, rank)
+
+
+    async def handle_leave(self, curr_room, parts):
+        '''
+        Handler for |L|USER and |l|USER lines.
+
+        Args:
+            curr_room (str): Room the line was sent in
+            parts (list): line split on |
+        '''
+        room = self.roomlist.get(curr_room)
+        if not room:
+            return
+
+        username = parts[2][1:].split('@')[0]
+        room.remove_user(username)
+
+
+    async def handle_name(self, curr_room, parts):
+        '''
+        Handler for |N|USER|OLDID and |n|USER|OLDID lines.
+
+        Args:
+            curr_room (str): Room the line was sent in
+            parts (list): line split on |
+        '''
+        room = self.roomlist.get(curr_room)
+        if not room:
+            return
+
+        new_user = parts[2]
+        rank = new_user[0]
+        username = new_user[1:].split('@')[0]
+        room.remove_user(parts[3])
+        room.add_user(username, rank)
+
 
-        # Sanitation
-        if parts[1] == 'c:' or parts[1] == 'pm':
-            chat_msg = '|'.join(parts[4:])
-            if chat_msg.startswith('.motd') and find_true_name(parts[3]) == 'koakuma':
-                chat_msg = chat_msg.replace('.motd', ']topic', 1)
-            parts = parts[0:4] + [chat_msg]
+    async def handle_updatesearch(self, curr_room, parts):
+        await self.update_battles(json.loads(parts[2]))
+
+
+    async def handle_updatechallenges(self, curr_room, parts):
+        challenges = json.loads(parts[2])['challengesFrom']
+        for challenge in challenges:
+            await self.respond_challenge(challenge, challenges[challenge])
+
+
+    async def handle_challstr(self, curr_room, parts):
+        print('Logging in...')
+        await self.login(parts[2] + "|" + parts[3])
+
+
+    async def handle_updateuser(self, curr_room, parts):
+        await self.login_check(parts[2], parts[3])
+
+
+    async def handle_chat(self, curr_room, parts):
+        '''
+        Handler for |c:|TIMESTAMP|USER|MESSAGE lines.
+
+        Args:
+            curr_room (str): Room the line was sent in
+            parts (list): line split on |
+        '''
+        caller = parts[3]
+        chat_msg = self.sanitize_chat('|'.join(parts[4:]), caller)
+        if not chat_msg:
+            return
 
         # Emote calls from chat
-        if parts[1] == 'c:' and parts[4].count(':') >= 2:
-            caller = parts[3]
-            asyncio.create_task(self.emote_center(curr_room, caller, parts[4]))
+        if chat_msg.count(':') >= 2:
+            asyncio.create_task(self.emote_center(curr_room, caller, chat_msg))
+
+        # Function calls from chat
+        if chat_msg[0] == ']':
+            asyncio.create_task(self.command_center(curr_room, caller, chat_msg))
+
+        # Trivia guesses
+        else:
+            await self.trivia_guess(curr_room, caller, chat_msg)
+
+
+    async def handle_pm(self, curr_room, parts):
+        '''
+        Handler for |pm|SENDER|RECEIVER|MESSAGE lines.
+
+        Args:
+            curr_room (str): Room the line was sent in
+            parts (list): line split on |
+        '''
+        caller = parts[2]
+        chat_msg = self.sanitize_chat('|'.join(parts[4:]), caller)
+        if not chat_msg:
+            return
 
         # Friend requests
-        if parts[1] == 'pm' and parts[4].startswith('/raw'):
-            m = re.match(r'/raw <span class="username">(?P<friend>.*)</span> sent you a friend request!', parts[4])
+        if chat_msg.startswith('/raw'):
+            m = re.match(r'/raw <span class="username">(?P<friend>.*)</span> sent you a friend request!', chat_msg)
             if m:
                 await self.friend_center(m.group('friend'))
                 return
 
-        # Login
-        if parts[1] == 'challstr':
-            print('Logging in...')
-            await self.login(parts[2] + "|" + parts[3])
-        elif parts[1] == 'updateuser':
-            await self.login_check(parts[2], parts[3])
-
         # Typing test responses
-        elif parts[1] == 'pm' and find_true_name(parts[2]) in self.typers:
-            true_caller = find_true_name(parts[2])
-            sec_elapsed = time.time() - self.typers[true_caller][0]
-            answer_key = self.typers[true_caller][1]
-            typing_wc = len(answer_key)
-            del self.typers[true_caller]
-
-            words = parts[4].split(' ')
-            if len(words) < (0.85*typing_wc):
-                await self.outgoing.put(f'|/w {true_caller}, Too inaccurate for a reasonable measurement.')
-                return
+        if find_true_name(caller) in self.typers:
+            await self.typing_result(find_true_name(caller), chat_msg)
 
-            correct_words = []
-            for w in words:
-                try:
-                    idx = answer_key.index(w)
-                except ValueError:
-                    continue
-                correct_words.append(answer_key.pop(idx))
+        # Function calls from chat
+        elif chat_msg[0] == ']':
+            asyncio.create_task(self.command_center(curr_room, caller, chat_msg, pm=True))
 
-            if len(correct_words) < (0.85*typing_wc):
-                await self.outgoing.put(f'|/w {true_caller}, Too inaccurate for a reasonable measurement.')
-                return
 
-            speed = round(len(correct_words) / (sec_elapsed / 60), 1)
-            acc = len(correct_words) / typing_wc * 100
-            msg = f'You typed at {speed} WPM with {acc:0.1f}% accuracy. '
+    def sanitize_chat(self, chat_msg, user):
+        '''
+        Rewrites chat messages that other bots send to stand in for commands,
+        and unwraps messages sent through /botmsg, such as listing page buttons.
 
-            if speed >= 160:
-                msg += 'Sending results for manual review.'
-                await self.outgoing.put(f'|/w {true_caller}, {msg}')
-                await self.outgoing.put(f'|/w {const.OWNER}, {true_caller} had {speed} WPM with {acc:0.1f}% accuracy.')
-                await self.outgoing.put(f'|/w {const.OWNER}, They typed: {parts[4]}')
+        Args:
+            chat_msg (str): chat message, possibly containing |
+            user (str): user given in the message's third field
 
-                return
+        Returns:
+            str: the message to act on
+        '''
+        if chat_msg.startswith('.motd') and find_true_name(user) == 'koakuma':
+            chat_msg = chat_msg.replace('.motd', ']topic', 1)
+        if chat_msg.startswith('/botmsg '):
+            chat_msg = chat_msg[len('/botmsg '):]
+        return chat_msg
 
+
+    async def typing_result(self, true_caller, typed):
+        '''
+        Scores a typing test response.
+
+        Args:
+            true_caller (str): user who took the typing test
+            typed (str): the user's response
+        '''
+        sec_elapsed = time.time() - self.typers[true_caller][0]
+        answer_key = self.typers[true_caller][1]
+        typing_wc = len(answer_key)
+        del self.typers[true_caller]
+
+        words = typed.split(' ')
+        if len(words) < (0.85*typing_wc):
+            await self.outgoing.put(f'|/w {true_caller}, Too inaccurate for a reasonable measurement.')
+            return
+
+        correct_words = []
+        for w in words:
             try:
-                wpminfo = self.wpms.loc[true_caller]
-            except KeyError:
-                wpminfo = pd.DataFrame([[true_caller, speed, speed, [speed]]],
-                                       columns=['user', 'top_wpm', 'avg_wpm', 'recent_runs'])
-                wpminfo = wpminfo.set_index('user')
-                self.wpms = self.wpms.append(wpminfo)
-                msg += 'Set a new record!'
-            else:
-                current_best = wpminfo['top_wpm']
-                if speed > current_best:
-                    self.wpms.at[true_caller, 'top_wpm'] = speed
-                    msg += 'Set a new record! '
-                else:
-                    msg += f'Current best: {current_best} WPM. '
+                idx = answer_key.index(w)
+            except ValueError:
+                continue
+            correct_words.append(answer_key.pop(idx))
 
-                old_runs = wpminfo['recent_runs']
-                new_runs = old_runs + [speed]
-                if len(new_runs) > 5:
-                    new_runs = new_runs[1:]
-                new_avg = round(sum(new_runs) / len(new_runs), 1)
-                msg += f'Average of past {len(new_runs)} runs: {new_avg} WPM.'
+        if len(correct_words) < (0.85*typing_wc):
+            await self.outgoing.put(f'|/w {true_caller}, Too inaccurate for a reasonable measurement.')
+            return
 
-                self.wpms.at[true_caller, 'avg_wpm'] = new_avg
-                self.wpms.at[true_caller, 'recent_runs'] = new_runs
+        speed = round(len(correct_words) / (sec_elapsed / 60), 1)
+        acc = len(correct_words) / typing_wc * 100
+        msg = f'You typed at {speed} WPM with {acc:0.1f}% accuracy. '
 
-            self.wpms.to_csv(const.WPMFILE)
+        if speed >= 160:
+            msg += 'Sending results for manual review.'
             await self.outgoing.put(f'|/w {true_caller}, {msg}')
+            await self.outgoing.put(f'|/w {const.OWNER}, {true_caller} had {speed} WPM with {acc:0.1f}% accuracy.')
+            await self.outgoing.put(f'|/w {const.OWNER}, They typed: {typed}')
 
-        # Function calls from chat
-        elif (parts[1] == 'c:' or parts[1] == 'pm') and parts[4][0] == ']':
-            is_pm = False
-            caller = parts[3]
-            if parts[1] == 'pm':
-                is_pm = True
-                caller = parts[2]
-            asyncio.create_task(self.command_center(curr_room, caller, parts[4], pm=is_pm))
+            return
 
-        # Trivia guesses
-        elif parts[1] == 'c:':
+        current_best = await self.typing_stats.record(true_caller, speed)
+        if current_best is None:
+            msg += 'Set a new record!'
+        else:
+            if speed > current_best:
+                msg += 'Set a new record! '
+            else:
+                msg += f'Current best: {current_best} WPM. '
+
+            _, new_avg, run_count = await self.typing_stats.get(true_caller)
+            msg += f'Average of past {run_count} runs: {new_avg} WPM.'
+
+        await self.outgoing.put(f'|/w {true_caller}, {msg}')
+
+
+    async def trivia_guess(self, curr_room, caller, guess):
+        '''
+        Checks a chat message against the room's running trivia question.
+
+        Args:
+            curr_room (str): Room the guess was sent in
+            caller (str): User who sent the guess, with rank
+            guess (str): The chat message
+        '''
+        t_active = False
+        try:
+            t_active = self.roomlist[curr_room].trivia.active
+        except (AttributeError, KeyError):
+            pass
+
+        # The bot's own messages include the questions and answers it sends.
+        if find_true_name(caller) == find_true_name(self.username):
             t_active = False
-            try:
-                t_active = self.roomlist[curr_room].trivia.active
-            except AttributeError:
-                pass
-
-            if t_active:
-                msg = ''
-                answer_check = ''
-                trivia_game = self.roomlist[curr_room].trivia
-                # Anime/manga/video game titles have a lot of different colloquial names.
-                # Those rooms are more flexible in accepting answers.
-                is_exact = False if curr_room in [const.ANIME_ROOM, const.VG_ROOM, const.SCHOL_ROOM] else True
-                is_exact = True if self.roomlist[curr_room].trivia.anagrams else is_exact
-                answer_check = check_answer(parts[4], trivia_game.answers, exact=is_exact)
-
-                if answer_check:
-                    msg = f'{parts[3]} wins.'
-                    if find_true_name(parts[3]) == self.username:
-                        if '/uhtml' in ''.join(parts[4]):
-                            return
-                        msg = 'Question skipped.'
-                    else:
-                        trivia_game.update_scores(find_true_name(parts[3]))
 
-                    msg += f' The answer was {answer_check}.'
+        if t_active:
+            msg = ''
+            answer_check = ''
+            trivia_game = self.roomlist[curr_room].trivia
+            # Anime/manga/video game titles have a lot of different colloquial names.
+            # Those rooms are more flexible in accepting answers.
+            is_exact = False if curr_room in [const.ANIME_ROOM, const.VG_ROOM, const.SCHOL_ROOM] else True
+            is_exact = True if self.roomlist[curr_room].trivia.anagrams else is_exact
+            answer_check = trivia_game.compiled_answers.match(guess, exact=is_exact)
+
+            if answer_check:
+                trivia_game.update_scores(find_true_name(caller))
+                msg = f'{caller} wins. The answer was {answer_check}.'
 
-                    trivia_game.correct.set()
-                    trivia_game.answers = []
+                trivia_game.resolve()
 
-                if msg:
-                    await self.outgoing.put(f'{curr_room}|{msg}')
+            if msg:
+                await self.outgoing.put(f'{curr_room}|{msg}', priority=HIGH)
 
 
-    async def battle_handler(self, msg, curr_room, parts):
+    async def battle_handler(self, curr_room, lines):
         '''
         Handler for battle-specific messages.
 
         Args:
-            msg (str): The raw message in its entirety
             curr_room (str): Room (well, battle) name
-            parts (str): msg split on |
+            lines (list): The frame's protocol lines, without the room line
         '''
-        if curr_room in self.battles:
-            # Action required
-            if parts[1] == 'request':
-                await self.act_in_battle(curr_room)
-
-            elif parts[1] == 'error' and 'more choices than unfainted' in parts[2]:
-                await self.act_in_battle(curr_room, one_poke=True)
-            else:
-                # Otherwise is just battle information
-                battle_info = msg.split('\n')[1:]
-                for line in battle_info:
+        for line in lines:
+            parts = line.split('|')
+            if len(parts) < 2:
+                continue
+
+            if curr_room in self.battles:
+                # Action required
+                if parts[1] == 'request':
+                    await self.act_in_battle(curr_room)
+
+                elif parts[1] == 'error' and 'more choices than unfainted' in parts[2]:
+                    await self.act_in_battle(curr_room, one_poke=True)
+                else:
+                    # Otherwise is just battle information
                     self.battles[curr_room].update_info(line)
 
-        # Somehow a battle has slipped through the cracks?
-        elif parts[1] == 'inactive' and parts[2].startswith(self.username):
-            # Refreshes updatesearch
-            await self.outgoing.put('|/cancelsearch')
-            await self.act_in_battle(curr_room)
+            # Somehow a battle has slipped through the cracks?
+            elif parts[1] == 'inactive' and parts[2].startswith(self.username):
+                # Refreshes updatesearch
+                await self.outgoing.put('|/cancelsearch')
+                await self.act_in_battle(curr_room)
+                return
 
 
     async def respond_challenge(self, challenger, battle_format):
@@ -698,26 +882,19 @@ class Bot:
         if not User.compare_ranks(caller[0], '+'):
             return
 
-        emote_list = await self.roomdata_man.execute("SELECT name, url, times_used FROM emotes "
-                                                        f"WHERE room='{room}'")
+        emote_dict = await self.emote_man.get_room(room)
 
-        if not emote_list:
+        if not emote_dict:
             return
 
-        emote_dict = {}
-        for name, url, times_used in emote_list:
-            emote_dict[name] = {'url': url, 'times_used': times_used}
-
         # Find emote
         possible_emotes = line.split(':')
         for pe in possible_emotes[1:-1]:
             emote = pe.lower()
             if emote in emote_dict:
-                await self.roomdata_man.execute("UPDATE emotes SET "
-                                                f"times_used={emote_dict[emote]['times_used']+1} "
-                                                f"WHERE room='{room}' AND name='{emote}'")
+                self.emote_man.record_use(room, emote)
 
-                uhtml = gen_uhtml_img_code(emote_dict[emote]['url'], height_resize=50, alt=emote)
+                uhtml = await gen_uhtml_img_code(emote_dict[emote], height_resize=50, alt=emote)
                 await self.outgoing.put(f'{room}|/adduhtml hippo-{emote}, {uhtml}')
 
 
@@ -781,7 +958,7 @@ class Bot:
         await self.outgoing.put(f'|/friend accept {new_friend}')
 
 
-    def birthday_chars_to_uhtml(self, characters):
+    async def birthday_chars_to_uhtml(self, characters):
         '''
         Generates table-rows-html, given a list of characters and their info.
 
@@ -793,11 +970,14 @@ class Bot:
         if num_chars % 3 == 0 and (num_chars / 3) < 4:
             display_len = 3
 
+        # Resolve all the images at once instead of one after another.
+        img_uhtmls = await asyncio.gather(*[gen_uhtml_img_code(char[1] if char[1] else const.IMG_NOT_FOUND,
+                                                               height_resize=64, width_resize=64)
+                                            for char in characters])
+
         char_uhtml = '<tr>'
         for i, char in enumerate(characters):
-            img_uhtml = gen_uhtml_img_code(const.IMG_NOT_FOUND, height_resize=64, width_resize=64)
-            if char[1]:
-                img_uhtml = gen_uhtml_img_code(char[1], height_resize=64, width_resize=64)
+            img_uhtml = img_uhtmls[i]
 
             char_url = ''
             if len(char) == 3:
@@ -889,6 +1069,99 @@ class Bot:
         await self.outgoing.put(f'{ctx}|{uhtml}')
 
 
+    def register_commands(self):
+        '''
+        Builds the registry of chat commands.
+
+        Args:
+        '''
+        registry = CommandRegistry()
+
+        for name in ['help', 'dab', 'owo', 'google', 'joogle', 'bing', 'jing', 'wpm_reset', 'wpm']:
+            registry.register(CommandSpec(name, SimpleCommand,
+                                          aliases=['commands'] if name == 'help' else []))
+        registry.register(CommandSpec('jibun', SimpleCommand, allowed_rooms=[const.ANIME_ROOM], room_only=True))
+        registry.register(CommandSpec('mal_add', SimpleCommand, aliases=['mal_set'], min_args=1,
+                                      allowed_rooms=[const.ANIME_ROOM], usage='MAL_USERNAME'))
+
+        uhtml_rooms = {'anime': [const.ANIME_ROOM],
+                       'manga': [const.ANIME_ROOM],
+                       'randanime': [const.ANIME_ROOM],
+                       'randmanga': [const.ANIME_ROOM],
+                       'mal': [const.ANIME_ROOM, const.PEARY_ROOM]}
+        for name in ['plebs', 'calendar', 'birthday', 'wpm_top', 'anime', 'manga', 'randanime', 'randmanga']:
+            registry.register(CommandSpec(name, UhtmlCommand, req_rank='+', pm_response=False,
+                                          allowed_rooms=uhtml_rooms.get(name),
+                                          min_args=1 if name in ['anime', 'manga'] else 0))
+        registry.register(CommandSpec('mal', UhtmlCommand, req_rank='+', pm_response=False,
+                                      allowed_rooms=uhtml_rooms['mal'], is_anotd=False))
+        registry.register(CommandSpec('anotd', UhtmlCommand, req_rank='+', pm_response=False,
+                                      allowed_rooms=uhtml_rooms['mal'], is_anotd=True,
+                                      rewrite=lambda command: ['mal'] + command[1:] + ['-r'],
+                                      help_text='Rolls an anime or manga of the day from a MAL list.'))
+
+        registry.register(CommandSpec('topic', TopicCommand, file=const.TOPICFILE, needs_userinfo=True))
+        for name, rank in [('topic_list', '+'), ('topic_rm', '%')]:
+            registry.register(CommandSpec(name, TopicCommand, req_rank=rank, file=const.TOPICFILE))
+
+        for name in ['bl_add', 'bl_list', 'bl_rm']:
+            registry.register(CommandSpec(name, BanlistCommand, req_rank='%', allowed_rooms=[const.ANIME_ROOM]))
+
+        for name, rank in [('emote_add', '#'), ('emote_list', ' '), ('emote_rm', '#'), ('emote_stats', ' ')]:
+            registry.register(CommandSpec(name, EmoteCommand, usage_msg=f']{name} [ROOM] ',
+                                          aliases=['emote_set'] if name == 'emote_add' else [],
+                                          needs_userinfo=rank != ' '))
+
+        for name in ['song_add', 'song_rm']:
+            registry.register(CommandSpec(name, SongCommand, req_rank='%'))
+        registry.register(CommandSpec('song_list', SongCommand, req_rank='+', req_rank_pm=' '))
+        registry.register(CommandSpec('randsong', SongCommand, aliases=['rand_song'], req_rank='+', req_rank_pm=' '))
+
+        for name in ['birthday_add', 'birthday_rm']:
+            registry.register(CommandSpec(name, BirthdayCommand, req_rank='%'))
+
+        tcg = {'allowed_rooms': [const.TCG_ROOM], 'room_only': True, 'req_rank': '+', 'usage': 'CARD_NAME'}
+        registry.register(CommandSpec('typing_test', self.cmd_typing_test, max_args=1,
+                                      usage='[short|medium|long]'))
+        registry.register(CommandSpec('mtg', self.cmd_mtg, **tcg))
+        registry.register(CommandSpec('ptcg', self.cmd_ptcg, **tcg))
+        registry.register(CommandSpec('ygo', self.cmd_ygo, **tcg))
+        registry.register(CommandSpec('addsteam', self.cmd_addsteam, allowed_rooms=self.steam_rooms,
+                                      usage='STEAM_ID'))
+        registry.register(CommandSpec('steam', self.cmd_steam, allowed_rooms=self.steam_rooms,
+                                      usage='[-r] [USERNAME]'))
+        registry.register(CommandSpec('vg', self.cmd_vg, allowed_rooms=self.steam_rooms,
+                                      req_rank='+', req_rank_pm=' ', usage='GAME'))
+        registry.register(CommandSpec('suck', self.cmd_suck, usage='[top]'))
+
+        trivia = {'room_only': True, 'min_args': 1, 'usage': 'SUBCOMMAND'}
+        registry.register(CommandSpec('trivia', self.cmd_trivia, **trivia))
+        registry.register(CommandSpec('anagrams', self.cmd_trivia, **trivia))
+        registry.register(CommandSpec('skip', self.cmd_trivia, room_only=True,
+                                      rewrite=lambda command: ['trivia'] + command,
+                                      help_text='Skips the current trivia question.'))
+
+        gacha = {'allowed_rooms': [const.GACHA_ROOM]}
+        registry.register(CommandSpec('gacha_join', self.cmd_gacha_join, **gacha))
+        registry.register(CommandSpec('gacha_box', self.cmd_gacha_box, aliases=['box'], **gacha))
+        registry.register(CommandSpec('gprofile', self.cmd_gprofile, room_only=True, **gacha))
+        registry.register(CommandSpec('gacha_roll', self.cmd_gacha_roll, aliases=['roll'], room_only=True,
+                                      usage='GACHA [NUM_ROLLS]', **gacha))
+        registry.register(CommandSpec('fav', self.cmd_fav, pm_only=True, min_args=1, usage='IDS'))
+        registry.register(CommandSpec('unfav', self.cmd_unfav, pm_only=True, min_args=1, usage='IDS'))
+        registry.register(CommandSpec('showcase', self.cmd_showcase, pm_only=True, min_args=2, usage='ID SLOT'))
+        registry.register(CommandSpec('unshowcase', self.cmd_unshowcase, pm_only=True, min_args=1, usage='ID'))
+        registry.register(CommandSpec('merge', self.cmd_merge, pm_only=True, usage='[IDS]'))
+        registry.register(CommandSpec('unit', self.cmd_unit, room_only=True, min_args=2, usage='GACHA UNIT_NAME'))
+        registry.register(CommandSpec('listing', self.cmd_listing, pm_only=True, min_args=2, max_args=2,
+                                      usage='KEY PAGE'))
+
+        for name in ['ladder_toggle', 'exec', 'roomexec', 'handler_stats', 'test']:
+            registry.register(CommandSpec(name, getattr(self, f'cmd_{name}'), owner_only=True))
+
+        return registry
+
+
     async def command_center(self, room, caller, command, pm=False):
         '''
         Handles command messages targeted at the bot.
@@ -899,8 +1172,6 @@ class Bot:
             command (str): The entire message sent by the user
             pm (bool): Whether or not the command came via PM
         '''
-
-        msg = ''
         true_caller = find_true_name(caller)
 
         if not command:
@@ -909,495 +1180,595 @@ class Bot:
             return
 
         command = command[1:].split()
+        spec = self.commands.get(command[0])
+        if not spec:
+            return
 
-        # Aliases
-        if command[0] == 'rand_song':
-            command[0] = 'randsong'
-        if command[0] == 'commands':
-            command[0] = 'help'
+        if spec.rewrite:
+            command = spec.rewrite(command)
+        else:
+            command[0] = spec.name
+
+        if spec.is_class:
+            userinfo = None
+            if spec.needs_userinfo:
+                userinfo = await self.get_userinfo(true_caller)
+
+            cmd_kwargs = {'bot': self,
+                          'full_command': command,
+                          'room': room,
+                          'caller': caller,
+                          'true_caller': true_caller,
+                          'caller_info': userinfo,
+                          'is_pm': pm,
+                          'pm_only': spec.pm_only,
+                          'room_only': spec.room_only,
+                          'pm_response': pm,
+                          'min_args': spec.min_args,
+                          'max_args': spec.max_args,
+                          'usage_msg': f']{command[0]} ',
+                          'req_rank': spec.req_rank,
+                          'allowed_rooms': spec.allowed_rooms}
+            if spec.req_rank_pm != spec.req_rank:
+                cmd_kwargs['req_rank_pm'] = spec.req_rank_pm
+            cmd_kwargs.update(spec.kwargs)
+
+            cmd_obj = spec.handler(**cmd_kwargs)
+            msg = await cmd_obj.evaluate()
+            if not msg:
+                return
 
-        is_anotd = False
-        if command[0] == 'anotd':
-            is_anotd = True
-            command[0] = 'mal'
-            command.append('-r')
+            if cmd_obj.pm_response:
+                msg = '|/w {}, '.format(true_caller) + msg
+            else:
+                msg = f'{cmd_obj.room}|{msg}'
 
-        userinfo = await self.get_userinfo(true_caller)
+            await self.outgoing.put(msg)
+            return
 
-        cmd_kwargs = {'bot': self,
-                      'full_command': command,
-                      'room': room,
-                      'caller': caller,
-                      'true_caller': true_caller,
-                      'caller_info': userinfo,
-                      'is_pm': pm,
-                      'pm_only': False,
-                      'room_only': False,
-                      'pm_response': pm,
-                      'min_args': 0,
-                      'max_args': 9999,
-                      'usage_msg': f']{command[0]} ',
-                      'req_rank': ' ',
-                      'allowed_rooms': list(self.roomlist)}
+        if not spec.allows(room, caller, true_caller, pm, len(command) - 1):
+            return
 
-        cmd_obj = None  # Remove when all commands are refactored
+        msg = await spec.handler(room, caller, true_caller, command, pm)
+        if not msg:
+            return
 
-        if command[0] in const.SIMPLE_COMMANDS:
-            if command[0] in ['mal_add', 'mal_set']:
-                cmd_kwargs['allowed_rooms'] = [const.ANIME_ROOM]
-                cmd_kwargs['min_args'] = 1
+        if pm:
+            msg = '/w {}, '.format(true_caller) + msg
 
-            cmd_obj = SimpleCommand(**cmd_kwargs)
+        await self.outgoing.put(room + '|' + msg)
 
-        elif command[0] in const.UHTML_COMMANDS:
-            cmd_kwargs['req_rank'] = '+'
-            cmd_kwargs['pm_response'] = False
 
-            if command[0] in ['anime', 'manga', 'randanime', 'randmanga']:
-                cmd_kwargs['allowed_rooms'] = [const.ANIME_ROOM]
+    async def cmd_typing_test(self, room, caller, true_caller, command, pm):
+        '''
+        Starts a typing test in PMs.
+        '''
+        length = command[1].lower() if len(command) > 1 else None
+        if length is not None and length not in LENGTHS:
+            return f'Length must be one of: {", ".join(LENGTHS)}.'
 
-            if command[0] in ['mal']:
-                cmd_kwargs['allowed_rooms'] = [const.ANIME_ROOM, const.PEARY_ROOM]
-                cmd_kwargs['is_anotd'] = is_anotd
+        asyncio.create_task(self.wpm(true_caller, length), name='wpm-{}'.format(true_caller))
 
-            if command[0] in ['anime', 'manga']:
-                cmd_kwargs['min_args'] = 1
 
-            cmd_obj = UhtmlCommand(**cmd_kwargs)
+    async def cmd_mtg(self, room, caller, true_caller, command, pm):
+        '''
+        Shows a Magic: The Gathering card.
+        '''
+        query = ' '.join(command[1:])
+        asyncio.create_task(display_mtg_card(self.outgoing.put, query))
 
-        elif command[0] in ['topic', 'topic_list', 'topic_rm']:
-            cmd_kwargs['file'] = const.TOPICFILE
-            cmd_obj = TopicCommand(**cmd_kwargs)
 
-        elif command[0] in ['bl_add', 'bl_list', 'bl_rm']:
-            cmd_kwargs['req_rank'] = '%'
-            cmd_kwargs['allowed_rooms'] = [const.ANIME_ROOM]
-            cmd_obj = BanlistCommand(**cmd_kwargs)
+    async def cmd_ptcg(self, room, caller, true_caller, command, pm):
+        '''
+        Shows a Pokemon TCG card.
+        '''
+        query = ' '.join(command[1:])
+        asyncio.create_task(display_ptcg_card(self.outgoing.put, query))
 
-        elif command[0] in ['emote_add', 'emote_set', 'emote_list', 'emote_rm', 'emote_stats']:
-            if command[0] == 'emote_set':
-                cmd_kwargs['full_command'][0] = 'emote_add'
 
-            cmd_kwargs['usage_msg'] += '[ROOM] '
-            cmd_obj = EmoteCommand(**cmd_kwargs)
+    async def cmd_ygo(self, room, caller, true_caller, command, pm):
+        '''
+        Shows a Yu-Gi-Oh! card.
+        '''
+        query = ' '.join(command[1:])
+        asyncio.create_task(display_ygo_card(self.outgoing.put, query))
 
-        elif command[0] in ['song_add', 'song_rm', 'song_list', 'randsong']:
-            cmd_kwargs['req_rank'] = '%'
 
-            if command[0] in ['randsong', 'song_list']:
-                cmd_kwargs['req_rank'] = '+'
-                cmd_kwargs['req_rank_pm'] = ' '
+    async def cmd_addsteam(self, room, caller, true_caller, command, pm):
+        '''
+        Links a Steam account, by the ID in its URL.
+        '''
+        msg = ''
 
-            cmd_obj = SongCommand(**cmd_kwargs)
+        if len(command) > 1:
+            ctx = room
+            if pm:
+                ctx = 'pm'
+            asyncio.create_task(set_steam_user(self.outgoing.put, true_caller, command[1], ctx),
+                                name='setsteam-{}'.format(true_caller))
+        else:
+            msg = 'Please enter a Steam ID (from the URL).'
 
-        elif command[0] in ['birthday_add', 'birthday_rm']:
-            cmd_kwargs['req_rank'] = '%'
+        return msg
 
-            cmd_obj = BirthdayCommand(**cmd_kwargs)
 
+    async def cmd_steam(self, room, caller, true_caller, command, pm):
+        '''
+        Shows a user's Steam profile, or rolls one of their games with -r.
+        '''
+        msg = ''
 
-        if cmd_obj: # Remove when all commands are refactored
-            msg = await cmd_obj.evaluate()
+        args = None
 
-            if cmd_obj.pm_response:
-                msg = '|/w {}, '.format(true_caller) + msg
-            else:
-                msg = f'{cmd_obj.room}|{msg}'
+        to_parse = ''
+        if len(command) > 1:
+            to_parse = ' '.join(command[1:])
+        args = steam_arg_parser(to_parse, true_caller)
 
-            if msg:
-                await self.outgoing.put(msg)
+        if args:
+            args.username = find_true_name(' '.join(args.username))
+        else:
+            await self.outgoing.put(room + '| Incorrect formatting.')
             return
 
-        # Typing test
-        if command[0] == 'typing_test':
-            asyncio.create_task(self.wpm(true_caller), name='wpm-{}'.format(true_caller))
-            return
+        steam_list = pd.read_csv(const.STEAMFILE)
+        existing_user = steam_list[steam_list['user'] == args.username]
+        if not (User.compare_ranks(caller[0], '+')):
+            ctx = 'pm'
+        if existing_user.empty:
+            msg = 'This user does not have a Steam set. Please use ]addsteam to set a valid account. Make sure to use the URL ID and not the Steam username.'
+        else:
+            ctx = room
+            if pm:
+                ctx = 'pm'
+            steam_user = existing_user.iloc[0]['steam']
 
-        # tcg commands
-        elif command[0] == 'mtg' and room == const.TCG_ROOM and User.compare_ranks(caller[0], '+'):
-            query = ' '.join(command[1:])
-            asyncio.create_task(display_mtg_card(self.outgoing.put, query))
+            if args.roll:
+                asyncio.create_task(steam_user_rand_series(self.outgoing.put, steam_user,
+                                                           args.username, caller, ctx),
+                                    name='randsteam-{}'.format(args.username))
+            else:
+                asyncio.create_task(show_steam_user(self.outgoing.put, steam_user, true_caller, ctx),
+                                    name='showsteam-{}'.format(args.username))
 
-        elif command[0] == 'ptcg' and room == const.TCG_ROOM and User.compare_ranks(caller[0], '+'):
-            query = ' '.join(command[1:])
-            asyncio.create_task(display_ptcg_card(self.outgoing.put, query))
+        return msg
 
-        elif command[0] == 'ygo' and room == const.TCG_ROOM and User.compare_ranks(caller[0], '+'):
-            query = ' '.join(command[1:])
-            asyncio.create_task(display_ygo_card(self.outgoing.put, query))
 
-        # Steam
-        elif command[0] == 'addsteam' and (room in self.steam_rooms or pm):
-            if len(command) > 1:
-                ctx = room
-                if pm:
-                    ctx = 'pm'
-                asyncio.create_task(set_steam_user(self.outgoing.put, true_caller, command[1], ctx),
-                                    name='setsteam-{}'.format(true_caller))
+    async def cmd_vg(self, room, caller, true_caller, command, pm):
+        '''
+        Searches IGDB for a game.
+        '''
+        msg = ''
+
+        ctx = 'pm' if pm else room
+        if len(command) < 2:
+            msg = 'Please specify a game to search for.'
+        else:
+            search = ' '.join(command[1:])
+            self.check_igdb_token()
+
+            headers = {'Client-ID': os.getenv('TWITCH_ID'),
+                    'Authorization': f'Bearer {self.igdb_token}'}
+            data = (f'search "{search}"; fields cover.url, name, '
+                     'release_dates.*, platforms.*, summary, url; '
+                     'where themes != (42);')
+
+            async with aiohttp.ClientSession(headers=headers) as session:
+                r = await session.post(const.IGDB_API + 'games', data=data)
+
+                resp = await r.text()
+                if r.status != 200:
+                    print(f'IGDB query failed on {data}: code {r.status}')
+                    msg = 'Game not found.'
+                else:
+                    game_list = json.loads(resp)
+                    print(game_list)
+                    if not game_list:
+                        msg = 'Game not found.'
+                    else:
+                        game_info = game_list[0]
+                        asyncio.create_task(self.gen_game_uhtml(game_info, headers, true_caller, ctx))
+
+        return msg
+
+
+    async def cmd_suck(self, room, caller, true_caller, command, pm):
+        '''
+        How many times have you sucked? Use in PMs, or ]suck top in rooms.
+        '''
+        msg = ''
+
+        scount = 0
+        suckinfo = self.sucklist[self.sucklist['user'] == true_caller]
+        if len(command) > 1:
+            if command[1] == 'top' and not pm:
+                suckboard = self.sucklist.sort_values('count', ascending=False)
+                suckboard = suckboard[suckboard['user'] != const.TIMER_USER].head(n=5).values.tolist()
+                msg = f"/adduhtml {leaderboard_uhtml(suckboard, 'Suckiest', name='suckboard')}"
+
+                await self.outgoing.put(room + '|' + msg)
+                return
+        elif true_caller == 'hippopotas':
+            scount = 69420
+            msg = '{} has sucked {} times'.format(caller, str(scount))
+        elif true_caller == 'hipposfavorite':
+            scount = -1
+            msg = '{} has sucked {} times. You are the best. Congrats!'.format(caller, str(scount))
+        elif pm:
+            if suckinfo.empty:
+                suckinfo = pd.DataFrame([[true_caller, 0]],
+                                        columns=['user', 'count'])
+                self.sucklist = self.sucklist.append(suckinfo)
+
+            # There's a global cooldown of a random number between
+            # 15 and 90 minutes.
+            end_time = self.sucklist.loc[self.sucklist['user'] == const.TIMER_USER, 'count'][0]
+            if time.time() > end_time:
+                self.sucklist.loc[self.sucklist['user'] == true_caller, 'count'] += 1
+                scount = int(suckinfo['count'].iat[0] + 1)
+                self.sucklist.loc[self.sucklist['user'] == const.TIMER_USER, 'count'] = time.time() + random.randint(60*5, 60*30)
             else:
-                msg = 'Please enter a Steam ID (from the URL).'
+                self.sucklist.loc[self.sucklist['user'] == true_caller, 'count'] = 0
+                scount = 0
 
-        elif command[0] == 'steam' and (room in self.steam_rooms or pm):
-            args = None
+            msg = '{} has sucked {} times.'.format(caller, str(scount))
 
-            to_parse = ''
-            if len(command) > 1:
-                to_parse = ' '.join(command[1:])
-            args = steam_arg_parser(to_parse, true_caller)
+        self.sucklist.to_csv(const.SUCKFILE, index=False)
+
+        return msg
+
+
+    async def cmd_trivia(self, room, caller, true_caller, command, pm):
+        '''
+        Runs trivia games. Subcommands: start [OPTIONS], stop, score [USER], leaderboard [N], skip.
+        '''
+        msg = ''
+
+        trivia_game = self.roomlist[room].trivia
+        trivia_status = trivia_game.active
+
+        if (command[1] == 'start' and not trivia_status and
+                (User.compare_ranks(caller[0], '%') or true_caller == const.OWNER)):
+
+            args = trivia_arg_parser(' '.join(command[2:])) if len(command) > 2 else None
+            if not args:
+                msg = 'Invalid parameters. Trivia not started.'
 
-            if args:
-                args.username = find_true_name(' '.join(args.username))
             else:
-                await self.outgoing.put(room + '| Incorrect formatting.')
+                if args.quizbowl and room == const.LEAGUE_ROOM:
+                    args.quizbowl = None
+                if not args.quizbowl and room == const.SCHOL_ROOM:
+                    args.quizbowl = True
+                anagrams = False
+                if command[0] == 'anagrams':
+                    if args.quizbowl:
+                        args.quizbowl = None
+                    if args.autoskip == 15:
+                        args.autoskip = 45
+                    anagrams = True
+                is_dex = True if 'mangadex' in args.categories else False
+
+                timer_msg = f', with a {args.autoskip} second timer' if args.autoskip else ''
+                msg = (f'Starting a trivia with {args.len} questions{timer_msg}. '
+                        'Type your answers to guess!')
+
+                asyncio.create_task(self.roomlist[room].trivia.run(
+                    n=args.len, diff=args.diff, categories=args.categories,
+                    excludecats=args.excludecats, by_rating=args.byrating,
+                    autoskip=args.autoskip, quizbowl=args.quizbowl,
+                    is_dex=is_dex, anagrams=anagrams), name=f'trivia-{room}')
+
+        elif (command[1] == 'stop' or command[1] =='end') and User.compare_ranks(caller[0], '+'):
+            if trivia_status:
+                await self.roomlist[room].trivia.end()
                 return
+            else:
+                msg = 'No trivia game in progress.'
+        elif command[1] == 'score':
+            user = ''
+            score = 0
 
-            steam_list = pd.read_csv(const.STEAMFILE)
-            existing_user = steam_list[steam_list['user'] == args.username]
-            if not (User.compare_ranks(caller[0], '+')):
-                ctx = 'pm'
-            if existing_user.empty:
-                msg = 'This user does not have a Steam set. Please use ]addsteam to set a valid account. Make sure to use the URL ID and not the Steam username.'
+            if len(command) > 2:
+                user, score = await trivia_game.userscore(find_true_name(''.join(command[2:])))
             else:
-                ctx = room
-                if pm:
-                    ctx = 'pm'
-                steam_user = existing_user.iloc[0]['steam']
-
-                if args.roll:
-                    asyncio.create_task(steam_user_rand_series(self.outgoing.put, steam_user,
-                                                               args.username, caller, ctx),
-                                        name='randsteam-{}'.format(args.username))
-                else:
-                    asyncio.create_task(show_steam_user(self.outgoing.put, steam_user, true_caller, ctx),
-                                        name='showsteam-{}'.format(args.username))
-
-        # Game search
-        elif (command[0] == 'vg' and ((room in self.steam_rooms and User.compare_ranks(caller[0], '+'))
-                                                                or pm)):
-            ctx = 'pm' if pm else room
-            if len(command) < 2:
-                msg = 'Please specify a game to search for.'
+                user, score = await trivia_game.userscore(find_true_name(caller))
+
+            if user is None:
+                msg = 'User not found.'
             else:
-                search = ' '.join(command[1:])
-                self.check_igdb_token()
+                msg = '{} has earned {} points in trivia.'.format(user, score)
+        elif command[1] == 'leaderboard':
+            to_show = 5
+            if len(command) > 2:
+                if is_int_str(command[2]):
+                    to_show = int(command[2])
 
-                headers = {'Client-ID': os.getenv('TWITCH_ID'),
-                        'Authorization': f'Bearer {self.igdb_token}'}
-                data = (f'search "{search}"; fields cover.url, name, '
-                         'release_dates.*, platforms.*, summary, url; '
-                         'where themes != (42);')
+            title = 'Trivia Leaderboard'
+            msg = f'/adduhtml {leaderboard_uhtml(await trivia_game.leaderboard(n=to_show), title)}'
+        elif command[1] == 'skip' and User.compare_ranks(caller[0], '+'):
+            if trivia_game.active and trivia_game.answers:
+                answer = trivia_game.answers[-1]
 
-                async with aiohttp.ClientSession(headers=headers) as session:
-                    r = await session.post(const.IGDB_API + 'games', data=data)
+                trivia_game.resolve()
+                await trivia_game.skip(self.outgoing.put)
 
-                    resp = await r.text()
-                    if r.status != 200:
-                        print(f'IGDB query failed on {data}: code {r.status}')
-                        msg = 'Game not found.'
-                    else:
-                        game_list = json.loads(resp)
-                        print(game_list)
-                        if not game_list:
-                            msg = 'Game not found.'
-                        else:
-                            game_info = game_list[0]
-                            asyncio.create_task(self.gen_game_uhtml(game_info, headers, true_caller, ctx))
-
-        # Suck
-        elif command[0] == 'suck':
-            scount = 0
-            suckinfo = self.sucklist[self.sucklist['user'] == true_caller]
-            if len(command) > 1:
-                if command[1] == 'top' and not pm:
-                    suckboard = self.sucklist.sort_values('count', ascending=False)
-                    suckboard = suckboard[suckboard['user'] != const.TIMER_USER].head(n=5).values.tolist()
-                    msg = f"/adduhtml {leaderboard_uhtml(suckboard, 'Suckiest', name='suckboard')}"
-
-                    await self.outgoing.put(room + '|' + msg)
-                    return
-            elif true_caller == 'hippopotas':
-                scount = 69420
-                msg = '{} has sucked {} times'.format(caller, str(scount))
-            elif true_caller == 'hipposfavorite':
-                scount = -1
-                msg = '{} has sucked {} times. You are the best. Congrats!'.format(caller, str(scount))
-            elif pm:
-                if suckinfo.empty:
-                    suckinfo = pd.DataFrame([[true_caller, 0]],
-                                            columns=['user', 'count'])
-                    self.sucklist = self.sucklist.append(suckinfo)
-
-                # There's a global cooldown of a random number between
-                # 15 and 90 minutes.
-                end_time = self.sucklist.loc[self.sucklist['user'] == const.TIMER_USER, 'count'][0]
-                if time.time() > end_time:
-                    self.sucklist.loc[self.sucklist['user'] == true_caller, 'count'] += 1
-                    scount = int(suckinfo['count'].iat[0] + 1)
-                    self.sucklist.loc[self.sucklist['user'] == const.TIMER_USER, 'count'] = time.time() + random.randint(60*5, 60*30)
-                else:
-                    self.sucklist.loc[self.sucklist['user'] == true_caller, 'count'] = 0
-                    scount = 0
+                msg = 'Skipping question. A correct answer would have been {}.'.format(answer)
 
-                msg = '{} has sucked {} times.'.format(caller, str(scount))
+        return msg
 
-            self.sucklist.to_csv(const.SUCKFILE, index=False)
 
+    async def cmd_gacha_join(self, room, caller, true_caller, command, pm):
+        '''
+        Creates a gacha account.
+        '''
+        if self.gachaman.player_check(true_caller):
+            msg = f'{caller} is already playing!'
+        else:
+            self.gachaman.player_add(true_caller)
+            msg = f'{caller} can now use gacha commands.'
 
-        # Trivia
+        return msg
 
-        elif (command[0] == 'trivia' or command[0] == 'anagrams') and not pm:
-            if len(command) < 2:
-                return
 
-            trivia_game = self.roomlist[room].trivia
-            trivia_status = trivia_game.active
+    async def cmd_gacha_box(self, room, caller, true_caller, command, pm):
+        '''
+        Lists the units in your gacha box.
+        '''
+        if not self.gachaman.player_check(true_caller):
+            return 'You don\'t have an account! Use ]gacha_join first'
+
+        header, lines = self.gachaman.player_box(true_caller)
+        title = f'{caller[1:]}\'s box'
+        name = f'{true_caller}-box'
+        gacha_room = self.roomlist.get(const.GACHA_ROOM)
+
+        if self.listing_man.fits(header, lines):
+            if not pm:
+                return self.listing_man.render(title, header, lines, name, room)
+            if gacha_room is not None and gacha_room.get_user(caller):
+                uhtml = self.listing_man.render(title, header, lines, name, const.GACHA_ROOM, viewer=true_caller)
+                await self.outgoing.put(f'{const.GACHA_ROOM}|{uhtml}')
+                return
 
-            if (command[1] == 'start' and not trivia_status and
-                    (User.compare_ranks(caller[0], '%') or true_caller == const.OWNER)):
+        url = await self.listing_man.paste(header, lines)
+        return url if url else 'Could not generate box. Please try again later.'
 
-                args = trivia_arg_parser(' '.join(command[2:])) if len(command) > 2 else None
-                if not args:
-                    msg = 'Invalid parameters. Trivia not started.'
 
-                else:
-                    if args.quizbowl and room == const.LEAGUE_ROOM:
-                        args.quizbowl = None
-                    if not args.quizbowl and room == const.SCHOL_ROOM:
-                        args.quizbowl = True
-                    anagrams = False
-                    if command[0] == 'anagrams':
-                        if args.quizbowl:
-                            args.quizbowl = None
-                        if args.autoskip == 15:
-                            args.autoskip = 45
-                        anagrams = True
-                    is_dex = True if 'mangadex' in args.categories else False
-
-                    timer_msg = f', with a {args.autoskip} second timer' if args.autoskip else ''
-                    msg = (f'Starting a trivia with {args.len} questions{timer_msg}. '
-                            'Type your answers to guess!')
-
-                    asyncio.create_task(self.roomlist[room].trivia.run(
-                        n=args.len, diff=args.diff, categories=args.categories,
-                        excludecats=args.excludecats, by_rating=args.byrating,
-                        autoskip=args.autoskip, quizbowl=args.quizbowl,
-                        is_dex=is_dex, anagrams=anagrams), name=f'trivia-{room}')
-
-            elif (command[1] == 'stop' or command[1] =='end') and User.compare_ranks(caller[0], '+'):
-                if trivia_status:
-                    await self.roomlist[room].trivia.end()
-                    return
-                else:
-                    msg = 'No trivia game in progress.'
-            elif command[1] == 'score':
-                user = ''
-                score = 0
+    async def cmd_listing(self, room, caller, true_caller, command, pm):
+        '''
+        Shows another page of a listing. Sent by the listing's page buttons.
+        '''
+        listing = self.listing_man.get(command[1])
+        if listing is None:
+            return 'This listing has expired. Please use the command again.'
 
-                if len(command) > 2:
-                    user, score = trivia_game.userscore(find_true_name(''.join(command[2:])))
-                else:
-                    user, score = trivia_game.userscore(find_true_name(caller))
+        # Pages are only shown to users who could see the listing.
+        viewer = self.roomlist[listing.room].get_user(caller) if listing.room in self.roomlist else None
+        if viewer is None or (listing.rank and not User.compare_ranks(viewer.rank, listing.rank)):
+            return
 
-                if user is None:
-                    msg = 'User not found.'
-                else:
-                    msg = '{} has earned {} points in trivia.'.format(user, score)
-            elif command[1] == 'leaderboard':
-                to_show = 5
-                if len(command) > 2:
-                    if is_int_str(command[2]):
-                        to_show = int(command[2])
-
-                title = 'Trivia Leaderboard'
-                msg = f'/adduhtml {leaderboard_uhtml(trivia_game.leaderboard(n=to_show), title)}'
-            elif command[1] == 'skip' and User.compare_ranks(caller[0], '+'):
-                if trivia_game.active and trivia_game.answers:
-                    answer = trivia_game.answers[-1]
-
-                    trivia_game.correct.set()
-                    trivia_game.answers = []
-                    await trivia_game.skip(self.outgoing.put)
-
-                    msg = 'Skipping question. A correct answer would have been {}.'.format(answer)
-
-        elif command[0] == 'skip' and not pm:      # Trivia skip alias
-            new_command = ']trivia ' + ' '.join(command)
-            await self.command_center(room, caller, new_command)
+        try:
+            page = int(command[2])
+        except ValueError:
             return
 
-        # Gachas
-        elif command[0] == 'gacha_join' and (pm or room == const.GACHA_ROOM):
-            if self.gachaman.player_check(true_caller):
-                msg = f'{caller} is already playing!'
-            else:
-                self.gachaman.player_add(true_caller)
-                msg = f'{caller} can now use gacha commands.'
+        await self.outgoing.put(self.listing_man.page(command[1], page, true_caller))
 
-        elif ((command[0] == 'gacha_box' or command[0] == 'box')
-                and (room == const.GACHA_ROOM or pm)):
-            if not self.gachaman.player_check(true_caller):
-                msg = 'You don\'t have an account! Use ]gacha_join first'
-            else:
-                msg = self.gachaman.player_box(true_caller)
 
-        elif command[0] == 'gprofile' and room == const.GACHA_ROOM:
-            if not self.gachaman.player_check(true_caller):
-                msg = 'You don\'t have an account! Use ]gacha_join first'
-            else:
-                pass
-                msg = self.gachaman.profile(true_caller)
-
-        elif ((command[0] == 'gacha_roll' or command[0] == 'roll')
-                and room == const.GACHA_ROOM):
-            gachas_str = '; '.join(const.GACHAS)
-
-            if len(command) < 2 or len(command) > 3:
-                msg = ('Please roll using ]gacha_roll GACHA [num_rolls]. '
-                      f'The current list of GACHAs is: {gachas_str}')
-            elif command[1] not in const.GACHAS:
-                msg = f'Invalid gacha. The current list of gachas is: {gachas_str}'
-            elif len(command) == 3 and not command[2].isnumeric():
-                msg = f'Please enter a valid number (integer from 1-10).'
-            elif len(command) == 3 and (int(command[2]) < 1 or int(command[2]) > 10):
-                msg = f'Please enter a valid number (integer from 1-10).'
-            elif not self.gachaman.player_check(true_caller):
-                msg = 'You don\'t have an account! Use ]gacha_join first.'  
+    async def cmd_gprofile(self, room, caller, true_caller, command, pm):
+        '''
+        Shows your gacha profile.
+        '''
+        if not self.gachaman.player_check(true_caller):
+            msg = 'You don\'t have an account! Use ]gacha_join first'
+        else:
+            msg = await self.gachaman.profile(true_caller)
 
-            else:
-                num_rolls = 1
-                if len(command) == 3:
-                    num_rolls = int(command[2])
-
-                pulls = self.gachaman.roll(true_caller, command[1], num_rolls=num_rolls)
-                if not pulls:
-                    user_rolls = self.gachaman.player_info(true_caller).roll_currency
-                    msg = f'Not enough rolls in your account: {caller} has {user_rolls} rolls.'
-                else:
-                    msg = f'/adduhtml {true_caller}-rolls, {pulls}'
+        return msg
 
-        elif command[0] == 'fav' and pm:
-            if len(command) < 2:
-                return
-            if not self.gachaman.player_check(true_caller):
-                msg = 'You don\'t have an account! Use ]gacha_join first.'
-            cmd_args = ''.join(command[1:])
-            try:
-                unit_ids = [int(x) for x in cmd_args.split(',')]
-            except ValueError:
-                msg = 'All IDs must be whole numbers.'
-            else:
-                num_updates = self.gachaman.favorite(true_caller, unit_ids)
-                msg = f'Favorited {num_updates} units.'
 
-        elif command[0] == 'unfav' and pm:
-            if len(command) < 2:
-                return
-            if not self.gachaman.player_check(true_caller):
-                msg = 'You don\'t have an account! Use ]gacha_join first.'
-            cmd_args = ''.join(command[1:])
-            try:
-                unit_ids = [int(x) for x in cmd_args.split(',')]
-            except ValueError:
-                msg = 'All IDs must be whole numbers.'
-            else:
-                num_updates = self.gachaman.unfavorite(true_caller, unit_ids)
-                msg = f'Unfavorited {num_updates} units.'
+    async def cmd_gacha_roll(self, room, caller, true_caller, command, pm):
+        '''
+        Rolls a gacha.
+        '''
+        msg = ''
 
-        elif command[0] == 'showcase' and pm:
-            if len(command) < 3:
-                return
-            if not self.gachaman.player_check(true_caller):
-                msg = 'You don\'t have an account! Use ]gacha_join first.'
+        gachas_str = '; '.join(const.GACHAS)
 
-            try:
-                uid = int(re.sub('[^0-9]', '', command[1]))
-                place = int(re.sub('[^0-9]', '', command[2]))
-                if 0 > place or place > 5:
-                    raise Exception
-            except ValueError:
-                msg = 'Please enter whole number values as arguments.'
-            except Exception:
-                msg = 'Showcase slot must be somewhere from 1-5.'
+        if len(command) < 2 or len(command) > 3:
+            msg = ('Please roll using ]gacha_roll GACHA [num_rolls]. '
+                  f'The current list of GACHAs is: {gachas_str}')
+        elif command[1] not in const.GACHAS:
+            msg = f'Invalid gacha. The current list of gachas is: {gachas_str}'
+        elif len(command) == 3 and not command[2].isnumeric():
+            msg = f'Please enter a valid number (integer from 1-10).'
+        elif len(command) == 3 and (int(command[2]) < 1 or int(command[2]) > 10):
+            msg = f'Please enter a valid number (integer from 1-10).'
+        elif not self.gachaman.player_check(true_caller):
+            msg = 'You don\'t have an account! Use ]gacha_join first.'  
+
+        else:
+            num_rolls = 1
+            if len(command) == 3:
+                num_rolls = int(command[2])
+
+            pulls = await self.gachaman.roll(true_caller, command[1], num_rolls=num_rolls)
+            if not pulls:
+                user_rolls = self.gachaman.player_info(true_caller).roll_currency
+                msg = f'Not enough rolls in your account: {caller} has {user_rolls} rolls.'
             else:
-                updated = self.gachaman.showcase(true_caller, uid, place)
-                msg = f'Set unit {uid} to slot {place}.' if updated else 'Nothing happened.'
+                msg = f'/adduhtml {true_caller}-rolls, {pulls}'
 
-        elif command[0] == 'unshowcase' and pm:
-            if len(command) < 2:
-                return
-            if not self.gachaman.player_check(true_caller):
-                msg = 'You don\'t have an account! Use ]gacha_join first.'
+        return msg
 
-            try:
-                uid = int(re.sub('[^0-9]', '', command[1]))
-            except ValueError:
-                msg = 'Please enter whole number values as arguments.'
-            else:
-                updated = self.gachaman.unshowcase(true_caller, uid)
-                msg = f'Removed {uid} from showcase.' if updated else 'Nothing happened.'
 
-        elif command[0] == 'merge' and pm:
-            if not self.gachaman.player_check(true_caller):
-                msg = 'You don\'t have an account! Use ]gacha_join first.'
+    async def cmd_fav(self, room, caller, true_caller, command, pm):
+        '''
+        Favorites units, by comma separated IDs.
+        '''
+        msg = ''
 
-            try:
-                ids = None
-                if len(command) > 1:
-                    cmd_args = ''.join(command[1:])
-                    ids = [int(x) for x in cmd_args.split(',')]
-            except ValueError:
-                msg = 'Please enter whole number values as arguments.'
-            else:
-                num_merged = self.gachaman.merge(true_caller, ids)
-                msg = f'{num_merged} units merged.'
+        if not self.gachaman.player_check(true_caller):
+            msg = 'You don\'t have an account! Use ]gacha_join first.'
+        cmd_args = ''.join(command[1:])
+        try:
+            unit_ids = [int(x) for x in cmd_args.split(',')]
+        except ValueError:
+            msg = 'All IDs must be whole numbers.'
+        else:
+            num_updates = self.gachaman.favorite(true_caller, unit_ids)
+            msg = f'Favorited {num_updates} units.'
 
-        elif command[0] == 'unit' and not pm:
-            if len(command) < 3:
-                return
+        return msg
 
-            msg = self.gachaman.show_unit_info(command[1], ' '.join(command[2:]))
 
-            if not msg:
-                msg = 'Usage: ]unit GACHA UNIT_NAME'
-            else:
-                msg = f'/adduhtml hippo-{command[2]}, {msg}'
+    async def cmd_unfav(self, room, caller, true_caller, command, pm):
+        '''
+        Unfavorites units, by comma separated IDs.
+        '''
+        msg = ''
 
-        # Self maintenance
-        elif command[0] == 'ladder_toggle' and true_caller == const.OWNER:
-            self.allow_laddering = not self.allow_laddering
-            # Refreshes updatesearch as well.
-            await self.outgoing.put('|/cancelsearch')
+        if not self.gachaman.player_check(true_caller):
+            msg = 'You don\'t have an account! Use ]gacha_join first.'
+        cmd_args = ''.join(command[1:])
+        try:
+            unit_ids = [int(x) for x in cmd_args.split(',')]
+        except ValueError:
+            msg = 'All IDs must be whole numbers.'
+        else:
+            num_updates = self.gachaman.unfavorite(true_caller, unit_ids)
+            msg = f'Unfavorited {num_updates} units.'
 
-            msg = f'Laddering is now {self.allow_laddering}.'
+        return msg
 
-        elif command[0] == 'exec' and true_caller == const.OWNER:
-            to_exec = ' '.join(command[1:])
-            await self.outgoing.put(f'|{to_exec}')
-            return
 
-        elif command[0] == 'roomexec' and true_caller == const.OWNER:
-            to_exec = ' '.join(command[2:])
-            await self.outgoing.put(f'{command[1]}|{to_exec}')
-            return
+    async def cmd_showcase(self, room, caller, true_caller, command, pm):
+        '''
+        Puts a unit in one of your showcase slots.
+        '''
+        msg = ''
 
-        elif command[0] == 'test' and true_caller == const.OWNER:
-            await self.outgoing.put('|/friend')
-            return
+        if not self.gachaman.player_check(true_caller):
+            msg = 'You don\'t have an account! Use ]gacha_join first.'
+
+        try:
+            uid = int(re.sub('[^0-9]', '', command[1]))
+            place = int(re.sub('[^0-9]', '', command[2]))
+            if 0 > place or place > 5:
+                raise Exception
+        except ValueError:
+            msg = 'Please enter whole number values as arguments.'
+        except Exception:
+            msg = 'Showcase slot must be somewhere from 1-5.'
+        else:
+            updated = self.gachaman.showcase(true_caller, uid, place)
+            msg = f'Set unit {uid} to slot {place}.' if updated else 'Nothing happened.'
+
+        return msg
+
+
+    async def cmd_unshowcase(self, room, caller, true_caller, command, pm):
+        '''
+        Removes a unit from your showcase.
+        '''
+        msg = ''
+
+        if not self.gachaman.player_check(true_caller):
+            msg = 'You don\'t have an account! Use ]gacha_join first.'
+
+        try:
+            uid = int(re.sub('[^0-9]', '', command[1]))
+        except ValueError:
+            msg = 'Please enter whole number values as arguments.'
+        else:
+            updated = self.gachaman.unshowcase(true_caller, uid)
+            msg = f'Removed {uid} from showcase.' if updated else 'Nothing happened.'
+
+        return msg
+
+
+    async def cmd_merge(self, room, caller, true_caller, command, pm):
+        '''
+        Merges duplicate units, optionally only those with the given IDs.
+        '''
+        msg = ''
+
+        if not self.gachaman.player_check(true_caller):
+            msg = 'You don\'t have an account! Use ]gacha_join first.'
+
+        try:
+            ids = None
+            if len(command) > 1:
+                cmd_args = ''.join(command[1:])
+                ids = [int(x) for x in cmd_args.split(',')]
+        except ValueError:
+            msg = 'Please enter whole number values as arguments.'
+        else:
+            num_merged = self.gachaman.merge(true_caller, ids)
+            msg = f'{num_merged} units merged.'
+
+        return msg
+
+
+    async def cmd_unit(self, room, caller, true_caller, command, pm):
+        '''
+        Shows a gacha unit's info.
+        '''
+        msg = await self.gachaman.show_unit_info(command[1], ' '.join(command[2:]))
 
         if not msg:
-            return
+            msg = 'Usage: ]unit GACHA UNIT_NAME'
+        else:
+            msg = f'/adduhtml hippo-{command[2]}, {msg}'
 
-        if pm:
-            msg = '/w {}, '.format(true_caller) + msg
+        return msg
 
-        await self.outgoing.put(room + '|' + msg)
 
+    async def cmd_ladder_toggle(self, room, caller, true_caller, command, pm):
+        '''
+        Toggles laddering while idle.
+        '''
+        self.allow_laddering = not self.allow_laddering
+        # Refreshes updatesearch as well.
+        await self.outgoing.put('|/cancelsearch')
 
-    async def sender(self):
+        return f'Laddering is now {self.allow_laddering}.'
+
+
+    async def cmd_exec(self, room, caller, true_caller, command, pm):
+        '''
+        Sends a global command.
         '''
-        Sends messages destined for Showdown.
+        to_exec = ' '.join(command[1:])
+        await self.outgoing.put(f'|{to_exec}')
 
-        Args:
+
+    async def cmd_roomexec(self, room, caller, true_caller, command, pm):
+        '''
+        Sends a command to a room.
+        '''
+        to_exec = ' '.join(command[2:])
+        await self.outgoing.put(f'{command[1]}|{to_exec}')
+
+
+    async def cmd_handler_stats(self, room, caller, true_caller, command, pm):
+        '''
+        Shows time spent handling each websocket message type.
+        '''
+        return self.handler_stats_text()
+
+
+    async def cmd_test(self, room, caller, true_caller, command, pm):
+        '''
+        Sends a test command.
+        '''
+        await self.outgoing.put('|/friend')
+
+
+    async def sender(self):
+        '''
+        Sends messages destined for Showdown, in the order and at the rate
+        chosen by the outgoing scheduler.
         '''
         try:
             while True:
@@ -1407,13 +1778,12 @@ class Bot:
                 if not msg.startswith('|') and random.random() < 0.0001:
                     room = msg.split('|')[0]
                     url = 'https://i.imgur.com/z4nlXPW.png'
-                    uhtml = gen_uhtml_img_code(url, height_resize=50, alt='worryclown')
+                    uhtml = await gen_uhtml_img_code(url, height_resize=50, alt='worryclown')
                     msg = f'{room}|/adduhtml hippo-worryclown, {uhtml}'
 
                 print('Sending: ')
                 print(msg)
                 await WS.send(msg)
-                await asyncio.sleep(0.1)
         except:
             self.reconnect()
 
@@ -1460,6 +1830,10 @@ def start_bot(restart=True, timer=0):
 
     loop.set_debug(True)
     if BOT:
+        BOT.emote_man.flush_nowait()
+        IMG_DIMS.flush()
+        IMG_DIMS.close()
+        BOT.roomdata_man.close()
         BOT = None
     BOT = Bot()
 
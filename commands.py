@@ -2,7 +2,6 @@ import dateutil
 import functools
 import json
 import random
-import requests
 import urllib
 
 import common.constants as const
@@ -27,9 +26,6 @@ class Command():
         self.command = self.full_command[0]
         self.args = self.full_command[1:]
 
-        if not self.room_only:
-            self.allowed_rooms.append('')
-
         self.msg = ''
 
         if 'req_rank_pm' not in kwargs:
@@ -45,10 +41,21 @@ class Command():
         return f'{error} Usage: {self.usage_msg}'
 
 
+    def room_allowed(self):
+        """ PMs are allowed unless the command is room only.
+            allowed_rooms of None allows any room the bot is in.
+        """
+        if not self.room:
+            return not self.room_only
+        if self.allowed_rooms is None:
+            return self.room in self.bot.roomlist
+        return self.room in self.allowed_rooms
+
+
     def check_eligible(self):
         """ Returns 0 if is eligible.
         """
-        if self.room not in self.allowed_rooms:
+        if not self.room_allowed():
             self.msg = f'{self.room} is not a legal room for this command.'
             return 1
 
@@ -77,6 +84,11 @@ class Command():
     def find_rank(self):
         if self.true_caller == 'hippopotas':
             self.caller_rank = '~'
+        # Commands that aren't rank gated skip the userdetails lookup.
+        # The rank the message was sent with is close enough.
+        if self.caller_info is None:
+            self.caller_rank = self.caller[0]
+            return
         self.caller_rank = self.caller_info['group']
         if self.room:
             for r in self.caller_info['rooms']:
@@ -91,6 +103,25 @@ class Command():
             await self.bot.outgoing.put(f'|/w {self.true_caller}, {message}')
 
 
+    async def listing(self, title, header, lines, name, rank=None):
+        """ Returns the message that shows a listing in self.room, privately
+            to the caller when used in PMs. Falls back to a pastie link when
+            the caller is not in the room or the listing is too long.
+        """
+        listing_man = self.bot.listing_man
+        room = self.bot.roomlist.get(self.room)
+        in_room = room is not None and (not self.is_pm or room.get_user(self.caller))
+
+        if in_room and listing_man.fits(header, lines):
+            if self.is_pm:
+                self.pm_response = False
+                return listing_man.render(title, header, lines, name, self.room,
+                                          viewer=self.true_caller, rank=rank)
+            return listing_man.render(title, header, lines, name, self.room, rank=rank)
+
+        return await listing_man.paste(header, lines)
+
+
 class SimpleCommand(Command):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -112,7 +143,13 @@ class SimpleCommand(Command):
             return ''
 
         if self.command == 'help':
-            self.msg = 'o3o [[README <https://github.com/Hippopotas/hippobotas/blob/master/README.md>]] o3o'
+            if not self.args:
+                self.msg = 'o3o [[README <https://github.com/Hippopotas/hippobotas/blob/master/README.md>]] o3o'
+            elif self.args[0] == 'list':
+                self.msg = f'!code Commands: {self.bot.commands.help_index()}'
+            else:
+                spec = self.bot.commands.get(self.args[0].lstrip(']'))
+                self.msg = spec.help_line() if spec else f'No command called {self.args[0]}.'
         elif self.command == 'dab':
             self.msg = '/me dabs'
         elif self.command == 'owo':
@@ -133,13 +170,7 @@ class SimpleCommand(Command):
             self.msg += await self.bot.mal_man.set_user(self.true_caller, mal_user, self.bot.jikan_man)
 
         elif self.command == 'wpm_reset':
-            try:
-                self.bot.wpms.loc[self.true_caller]
-            except KeyError:
-                pass
-            else:
-                self.bot.wpms.loc[self.true_caller, ['top_wpm', 'avg_wpm', 'recent_runs']] = 0, 0, []
-                self.bot.wpms.to_csv(const.WPMFILE)
+            await self.bot.typing_stats.reset(self.true_caller)
             self.msg = f'Reset {self.caller}\'s typing speed record to 0 WPM.'
 
         elif self.command == 'wpm':
@@ -149,14 +180,11 @@ class SimpleCommand(Command):
                 wpm_user = ' '.join(self.args)
                 true_wpm_user = find_true_name(wpm_user)
 
-            try:
-                wpminfo = self.bot.wpms.loc[true_wpm_user]
-            except KeyError:
+            wpminfo = await self.bot.typing_stats.get(true_wpm_user)
+            if wpminfo is None:
                 self.msg = f'{wpm_user} has not taken a typing test.'
             else:
-                top_wpm = wpminfo['top_wpm']
-                avg_wpm = wpminfo['avg_wpm']
-                run_count = len(wpminfo['recent_runs'])
+                top_wpm, avg_wpm, run_count = wpminfo
                 self.msg = f'{wpm_user} - Top speed: {top_wpm} WPM. Average of past {run_count} runs: {avg_wpm} WPM.'
 
 
@@ -215,7 +243,7 @@ class UhtmlCommand(Command):
             self.msg = f'/sendprivateuhtml {self.true_caller}, '
 
         if self.command == 'plebs':
-            uhtml = gen_uhtml_img_code(const.PLEB_URL, height_resize=250)
+            uhtml = await gen_uhtml_img_code(const.PLEB_URL, height_resize=250)
             self.msg += f'hippo-pleb, {uhtml}'
 
         elif self.command == 'calendar':
@@ -229,20 +257,14 @@ class UhtmlCommand(Command):
                 return 'No images found for this date.'
 
             date_imgs = calendar[self.room][curr_day_str]
-            uhtml = gen_uhtml_img_code(random.choice(date_imgs), height_resize=200)
+            uhtml = await gen_uhtml_img_code(random.choice(date_imgs), height_resize=200)
             self.msg += f'hippo-calendar, {uhtml}'
 
         elif self.command == 'wpm_top':
-            metric = 'avg_wpm'
-            metric_title = '(Last 5 Runs Avg.)'
-            if '-s' in self.args or '--single' in self.args:
-                metric = 'top_wpm'
-                metric_title = '(Single Run)'
+            single = '-s' in self.args or '--single' in self.args
+            metric_title = '(Single Run)' if single else '(Last 5 Runs Avg.)'
 
-            wpmboard = self.bot.wpms.sort_values(metric, ascending=False)
-            if metric == 'avg_wpm':
-                wpmboard = wpmboard[wpmboard['recent_runs'].map(len) >= 5]
-            wpmboard = wpmboard.reset_index().head(n=5)[['user', metric]].values.tolist()
+            wpmboard = await self.bot.typing_stats.leaderboard(single=single, n=5)
 
             self.msg += leaderboard_uhtml(wpmboard, f'Fastest WPM {metric_title}', name='wpmboard', metric='WPM')
 
@@ -439,7 +461,12 @@ class BanlistCommand(DatabaseCommand):
 
         if len(self.args) > 1:
             if self.banlist in ['anime', 'manga']:
-                self.bl_value = self.args[1]
+                try:
+                    self.bl_value = int(self.args[1])
+                except ValueError:
+                    await self.pm_msg(f'{self.args[1]} is not a valid MAL ID.')
+                    return ''
+                self.bl_value2 = self.banlist
             elif self.banlist == 'anotd':
                 try:
                     self.bl_value2, self.bl_value = mal_url_info(self.args[1])
@@ -447,36 +474,33 @@ class BanlistCommand(DatabaseCommand):
                     await self.pm_msg(f'{self.args[1]} is not a valid MAL url.')
                     return ''
 
-            self.where_clause = f"WHERE {self.bl_key}={self.bl_value}"
-            if self.banlist in ['anime', 'manga']:
-                self.where_clause += f" AND medium='{self.banlist}'"
-                self.check_query = (f"SELECT * FROM mal_banlist {self.where_clause}")
-            elif self.banlist == 'anotd':
-                self.where_clause += f" AND medium='{self.bl_value2}'"
-                self.check_query = (f"SELECT * FROM {self.banlist}_banlist {self.where_clause}")
+            bl_table = 'mal_banlist' if self.banlist in ['anime', 'manga'] else f'{self.banlist}_banlist'
+            self.check_query = f"SELECT * FROM {bl_table} WHERE {self.bl_key}=? AND medium=?"
+            self.check_params = (self.bl_value, self.bl_value2)
 
         if self.command == 'bl_add':
-            entry_exists = await self.db_man.execute(self.check_query)
+            entry_exists = await self.db_man.execute(self.check_query, self.check_params)
             if entry_exists:
                 await self.pm_msg(f'{self.bl_value} already in {self.banlist} banlist.')
                 return ''
 
             if self.banlist in ['anime', 'manga']:
-                await self.db_man.execute(f"INSERT INTO mal_banlist (medium, mal_id, manual) "
-                                                f"VALUES ('{self.banlist}', {self.bl_value}, 1)")
+                await self.db_man.execute("INSERT INTO mal_banlist (medium, mal_id, manual) "
+                                          "VALUES (?, ?, 1)", (self.banlist, self.bl_value))
             elif self.banlist == 'anotd':
                 await add_anotd_bl(self.bl_value2, self.bl_value, self.bot.anilist_man, self.db_man)
 
             self.msg = f'{self.args[1]} added to {self.banlist} banlist.'
 
         elif self.command == 'bl_rm':
-            entry_exists = await self.db_man.execute(self.check_query)
+            entry_exists = await self.db_man.execute(self.check_query, self.check_params)
             if not entry_exists:
                 await self.pm_msg(f'{self.bl_value} not in {self.banlist} banlist.')
                 return ''
 
             if self.banlist in ['anime', 'manga']:
-                await self.db_man.execute(f"DELETE FROM mal_banlist WHERE medium='{self.banlist}' AND mal_id={self.bl_value} AND manual=1")
+                await self.db_man.execute("DELETE FROM mal_banlist WHERE medium=? AND mal_id=? AND manual=1",
+                                          (self.banlist, self.bl_value))
             elif self.banlist == 'anotd':
                 await rm_anotd_bl(self.bl_value2, self.bl_value, self.bot.anilist_man, self.db_man)
 
@@ -488,28 +512,24 @@ class BanlistCommand(DatabaseCommand):
                 header_text = monospace_table_row([('Franchise/Title', 30)])            
             header_text += '\n' + '-'*30
 
-            box_text = ''
+            lines = []
             if self.banlist in ['anime', 'manga']:
                 mal_ids = await self.db_man.execute("SELECT mal_id FROM mal_banlist "
-                                                        f"WHERE medium='{self.banlist}' AND manual=1")
+                                                    "WHERE medium=? AND manual=1", (self.banlist,))
                 for mid in list(sum(mal_ids, ())):
-                    box_text += monospace_table_row([(mid, 20)])
-                    box_text += '\n'
-            
+                    lines.append(monospace_table_row([(mid, 20)]))
+
             elif self.banlist == 'anotd':
                 names = await self.db_man.execute("SELECT name FROM anotd_banlist")
                 for name in list(sum(names, ())):
                     fixed_name = name.encode('ascii', 'ignore').decode()
-                    box_text += monospace_table_row([(fixed_name, 30)])
-                    box_text += '\n'
+                    lines.append(monospace_table_row([(fixed_name, 30)]))
 
-            r = requests.post(const.PASTIE_API, data=f'{header_text}\n{box_text}')
-            if r.status_code == 200:
-                self.msg = f"""https://pastie.io/raw/{r.json()['key']}"""
-            else:
+            self.msg = await self.listing(f'{self.banlist} banlist', header_text, lines,
+                                          f'hippo-{self.banlist}bl', rank='%')
+            if not self.msg:
                 self.msg = 'Cannot generate banlist info at this time.'
-
-            if not self.is_pm:
+            elif not self.is_pm and self.msg.startswith('https://'):
                 self.msg = (f'/addrankuhtml %, hippo-{self.banlist}bl, '
                             f'<center>{self.banlist} banlist: {self.msg}</center><br>')
 
@@ -551,36 +571,38 @@ class EmoteCommand(DatabaseCommand):
                 await self.pm_msg('Discord URLs do not work as emotes.')
                 return
 
-            emote_exists = await self.db_man.execute("SELECT * FROM emotes WHERE "
-                                                        f"room='{self.room} AND name={emote}'")
+            emote_exists = await self.db_man.execute("SELECT * FROM emotes WHERE room=? AND name=?",
+                                                     (self.room, emote))
             if emote_exists:
-                await self.db_man.execute(f"UPDATE emotes SET url='{emote_url}' "
-                                            f"WHERE room='{self.room}' AND name='{emote}'")
+                await self.db_man.execute("UPDATE emotes SET url=? WHERE room=? AND name=?",
+                                          (emote_url, self.room, emote))
             else:
-                await self.db_man.execute("INSERT INTO emotes (room, name, url) "
-                                            f"VALUES ('{self.room}', '{emote}', '{emote_url}')")
+                await self.db_man.execute("INSERT INTO emotes (room, name, url) VALUES (?, ?, ?)",
+                                          (self.room, emote, emote_url))
+            self.bot.emote_man.invalidate(self.room)
 
             self.msg = f'Set :{emote}: to show {emote_url}.'
         
         elif self.command == 'emote_rm':
             emote = find_true_name(self.args[arg_offset])
 
-            emote_exists = await self.db_man.execute("SELECT * FROM emotes WHERE "
-                                                        f"room='{self.room}' AND name='{emote}'")
+            emote_exists = await self.db_man.execute("SELECT * FROM emotes WHERE room=? AND name=?",
+                                                     (self.room, emote))
 
             if not emote_exists:
                 await self.pm_msg(f'{self.room} does not have emote {emote}.')
                 return
 
-            await self.db_man.execute("DELETE FROM emotes WHERE "
-                                        f"room='{self.room}' AND name='{emote}'")
+            await self.db_man.execute("DELETE FROM emotes WHERE room=? AND name=?",
+                                      (self.room, emote))
+            self.bot.emote_man.invalidate(self.room)
             self.msg = f'Removed {emote} from {self.room}.'
 
         elif self.command == 'emote_list':
             self.msg = 'No emotes found.'
 
-            emote_list = await self.db_man.execute("SELECT name FROM emotes "
-                                                        f"WHERE room='{self.room}'")
+            emote_list = await self.db_man.execute("SELECT name FROM emotes WHERE room=?",
+                                                   (self.room,))
 
             if emote_list:
                 # Flatten
@@ -590,22 +612,19 @@ class EmoteCommand(DatabaseCommand):
         elif self.command == 'emote_stats':
             self.msg = f'No emotes found for {self.room}.'
 
-            emote_list = await self.db_man.execute("SELECT name, times_used FROM emotes "
-                                                    f"WHERE room='{self.room}'")
+            await self.bot.emote_man.flush()
+            emote_list = await self.db_man.execute("SELECT name, times_used FROM emotes WHERE room=?",
+                                                   (self.room,))
 
             if emote_list:
                 header_text = monospace_table_row([('Emote', 30), ('Times Used', 12)])
                 header_text += '\n' + '-'*44
-                box_text = ''
-                for e in sorted(emote_list, key=lambda x: x[1], reverse=True):
-                    box_text += monospace_table_row([(e[0], 30), (e[1], 12)])
-                    box_text += '\n'
-
-                r = requests.post(const.PASTIE_API, data=f'{header_text}\n{box_text}')
+                lines = [monospace_table_row([(e[0], 30), (e[1], 12)])
+                         for e in sorted(emote_list, key=lambda x: x[1], reverse=True)]
 
-                if r.status_code == 200:
-                    self.msg = f"""https://pastie.io/raw/{r.json()['key']}"""
-                else:
+                self.msg = await self.listing(f'{self.room} emote stats', header_text, lines,
+                                              f'hippo-emotestats-{self.room}')
+                if not self.msg:
                     self.msg = 'Unable to generate emote stats at this time.'
 
         return self.msg
@@ -647,38 +666,34 @@ class SongCommand(DatabaseCommand):
             title = ' '.join(self.args[arg_offset:-1])
             url = self.args[-1]
 
-            song_exists = await self.db_man.execute("SELECT * FROM songs WHERE "
-                                                        f"room='{self.room}' AND url='{url}'")
+            song_exists = await self.db_man.execute("SELECT * FROM songs WHERE room=? AND url=?",
+                                                    (self.room, url))
 
             if song_exists:
                 self.msg = f'This url already exists in the song pool for {self.room}.'
             else:
-                # Sqlite escape
-                title = title.replace("'", "''")
-                await self.db_man.execute("INSERT INTO songs (room, title, url) "
-                                            f"VALUES ('{self.room}', '{title}', '{url}')")
+                await self.db_man.execute("INSERT INTO songs (room, title, url) VALUES (?, ?, ?)",
+                                          (self.room, title, url))
                 self.msg = f'Added {title} to {self.room} song pool.'
 
         elif self.command == 'song_rm':
             title = ' '.join(self.args[arg_offset:])
             self.msg = f'{title} not found in song pool.'
 
-            room_songs = await self.db_man.execute("SELECT title FROM songs "
-                                                    f"WHERE room='{self.room}'")
+            room_songs = await self.db_man.execute("SELECT title FROM songs WHERE room=?",
+                                                   (self.room,))
 
-            for s in list(sum(room_songs, ())):
-                if find_true_name(s) == find_true_name(title):
-                    escaped_s = s.replace("'", "''")
-                    await self.db_man.execute("DELETE FROM songs WHERE "
-                                                f"room='{self.room}' AND title='{escaped_s}'")
+            to_delete = [(self.room, s) for s in list(sum(room_songs, ()))
+                         if find_true_name(s) == find_true_name(title)]
+            await self.db_man.executemany("DELETE FROM songs WHERE room=? AND title=?", to_delete)
 
             self.msg = f'Deleted all songs called {title} from song pool.'
 
         elif self.command == 'song_list':
             self.msg = f'No songs found for {self.room}.'
 
-            song_exists = await self.db_man.execute("SELECT title, url FROM songs "
-                                                    f"WHERE room='{self.room}'")
+            song_exists = await self.db_man.execute("SELECT title, url FROM songs WHERE room=?",
+                                                    (self.room,))
 
             if song_exists:
                 room_songs = {}
@@ -688,22 +703,17 @@ class SongCommand(DatabaseCommand):
                 header_text = monospace_table_row([('Song Title', 100),
                                                    ('Link', 25)])
                 header_text += '\n' + '-'*146
-                box_text = ''
-                for s in sorted(room_songs.keys()):
-                    box_text += monospace_table_row([(s, 100),
-                                                     (room_songs[s], 25)])
-                    box_text += '\n'
+                lines = [monospace_table_row([(s, 100), (room_songs[s], 25)])
+                         for s in sorted(room_songs.keys())]
 
-                r = requests.post(const.PASTIE_API, data=f'{header_text}\n{box_text}'.encode('utf-8'))
-
-                if r.status_code == 200:
-                    self.msg = f"""https://pastie.io/raw/{r.json()['key']}"""
-                else:
+                self.msg = await self.listing(f'{self.room} songs', header_text, lines,
+                                              f'hippo-songs-{self.room}')
+                if not self.msg:
                     self.msg = 'Unable to generate song list at this time.'
 
         elif self.command == 'randsong':
-            song_exists = await self.db_man.execute("SELECT title, url FROM songs "
-                                                    f"WHERE room='{self.room}'")
+            song_exists = await self.db_man.execute("SELECT title, url FROM songs WHERE room=?",
+                                                    (self.room,))
 
             if not song_exists:
                 self.msg = f'There are no songs for {self.room}!'
@@ -758,29 +768,25 @@ class BirthdayCommand(DatabaseCommand):
             day = dateutil.parser.parse(self.args[-1]).strftime('%B %#d')
 
             char_exists = await self.db_man.execute("SELECT * FROM birthdays WHERE "
-                                                        f"room='{self.room}' AND name='{name}' AND day='{day}'")
+                                                    "room=? AND name=? AND day=?", (self.room, name, day))
 
             if char_exists:
                 self.msg = f'This character is already in the birthdays for {self.room}.'
             else:
-                # Sqlite escape
-                name = name.replace("'", "''")
                 await self.db_man.execute("INSERT INTO birthdays (name, room, day, image, link) "
-                                            f"VALUES ('{name}', '{self.room}', '{day}', '{image}', '{link}')")
+                                          "VALUES (?, ?, ?, ?, ?)", (name, self.room, day, image, link))
                 self.msg = f'Added {name} to {self.room} birthdays.'
 
         elif self.command == 'birthday_rm':
             name = ' '.join(self.args[arg_offset:])
             self.msg = f'{name} not found in birthdays.'
 
-            room_bdays = await self.db_man.execute("SELECT name FROM birthdays "
-                                                    f"WHERE room='{self.room}'")
+            room_bdays = await self.db_man.execute("SELECT name FROM birthdays WHERE room=?",
+                                                   (self.room,))
 
-            for n in list(sum(room_bdays, ())):
-                if find_true_name(n) == find_true_name(name):
-                    escaped_n = n.replace("'", "''")
-                    await self.db_man.execute("DELETE FROM birthdays WHERE "
-                                                f"room='{self.room}' AND name='{escaped_n}'")
+            to_delete = [(self.room, n) for n in list(sum(room_bdays, ()))
+                         if find_true_name(n) == find_true_name(name)]
+            await self.db_man.executemany("DELETE FROM birthdays WHERE room=? AND name=?", to_delete)
 
             self.msg = f'Deleted all birthdays of {name} in {self.room}.'
 
@@ -3,8 +3,11 @@ import datetime
 import json
 import random
 
+from peewee import fn
+
 import common.constants as const
 
+from common.anilist_db import ANILIST_DB, MediaTable
 from common.uhtml import ItemInfo
 from common.utils import gen_uhtml_img_code
 
@@ -73,7 +76,7 @@ async def anilist_search(medium, search, anilist_man):
                 series_data = series_list[0]
 
     mal_url = f'https://myanimelist.net/{medium}/{series_data["idMal"]}'
-    img_uhtml = gen_uhtml_img_code(series_data['coverImage']['extraLarge'], dims=(65, 100))
+    img_uhtml = await gen_uhtml_img_code(series_data['coverImage']['extraLarge'], dims=(65, 100))
     title = series_data['title']['english']
     if not title:
         title = series_data['title']['romaji']
@@ -158,7 +161,7 @@ async def anilist_rand_series(medium, anilist_man, genres=[], tags=[]):
                 series_data = resp['data']['Page']['media'][0]
 
     mal_url = f'https://myanimelist.net/{medium}/{series_data["idMal"]}'
-    img_uhtml = gen_uhtml_img_code(series_data['coverImage']['extraLarge'], dims=(65, 100))
+    img_uhtml = await gen_uhtml_img_code(series_data['coverImage']['extraLarge'], dims=(65, 100))
     title = series_data['title']['english']
     if not title:
         title = series_data['title']['userPreferred']
@@ -232,20 +235,142 @@ async def add_anotd_bl(medium, series, anilist_man, db_man):
     expiration = str(datetime.datetime.now() + datetime.timedelta(days=365))
 
     await db_man.execute("INSERT INTO anotd_banlist (medium, mal_id, name, expiration) "
-                            f"VALUES ('{medium}', {series}, '{title}', '{expiration}')")
-
-    for s in related_series:
-        exists = await db_man.execute(f"SELECT * FROM mal_banlist WHERE medium='{s[0]}' AND mal_id={s[1]}")
+                         "VALUES (?, ?, ?, ?)", (medium, series, title, expiration))
 
-        if not exists:
-            await db_man.execute("INSERT INTO mal_banlist (medium, mal_id, anotd_source) "
-                                    f"VALUES ('{s[0]}', {s[1]}, 1)")
+    # Only adds the series that are not already banned.
+    await db_man.executemany("INSERT INTO mal_banlist (medium, mal_id, anotd_source) "
+                             "SELECT ?1, ?2, 1 WHERE NOT EXISTS "
+                             "(SELECT 1 FROM mal_banlist WHERE medium=?1 AND mal_id=?2)",
+                             [s for s in related_series if s[1]])
 
 
 async def rm_anotd_bl(medium, series, anilist_man, db_man):
     related_series, _ = await get_related_series(medium, series, anilist_man)
 
-    for s in related_series:
-        await db_man.execute(f"DELETE FROM mal_banlist WHERE medium='{s[0]}' AND mal_id={s[1]} AND anotd_source=1")
+    await db_man.executemany("DELETE FROM mal_banlist WHERE medium=? AND mal_id=? AND anotd_source=1",
+                             related_series)
+
+    await db_man.execute("DELETE FROM anotd_banlist WHERE medium=? AND mal_id=?", (medium, series))
+
+
+SNAPSHOT_QUERY = '''
+query ($page: Int, $idGreater: Int, $sort: [MediaSort]) {
+    Page (page: $page, perPage: 50) {
+        pageInfo {
+            hasNextPage
+        }
+        media (id_greater: $idGreater, isAdult: false, sort: $sort) {
+            id
+            idMal
+            type
+            format
+            description
+            popularity
+            averageScore
+            updatedAt
+            genres
+            tags {
+                name
+                rank
+            }
+            title {
+                english
+                userPreferred
+                romaji
+            }
+            coverImage {
+                large
+            }
+        }
+    }
+}
+'''
+
+
+def media_row(media):
+    return {'id': media['id'],
+            'id_mal': media['idMal'],
+            'type': media['type'],
+            'format': media['format'],
+            'title_english': media['title']['english'],
+            'title_preferred': media['title']['userPreferred'],
+            'title_romaji': media['title']['romaji'],
+            'cover_url': media['coverImage']['large'],
+            'description': media['description'],
+            'popularity': media['popularity'] or 0,
+            'average_score': media['averageScore'] or 0,
+            'genres': json.dumps(media['genres']),
+            # Same cutoff as the minimumTagRank used by live trivia queries
+            'tags': json.dumps([t['name'] for t in media['tags'] if t['rank'] >= 50]),
+            'updated_at': media['updatedAt'] or 0}
+
+
+async def update_media_snapshot(anilist_man):
+    '''
+    Brings the local media snapshot up to date with AniList.
+
+    Series newer than the snapshot are fetched in id order, which also resumes
+    an interrupted first download. Then, unless the snapshot was empty, recently
+    updated series are refetched until reaching the last stored update.
+
+    Returns:
+        int: number of rows written
+    '''
+    MediaTable.create_table(safe=True)
+    last_updated = MediaTable.select(fn.MAX(MediaTable.updated_at)).scalar() or 0
+    last_id = MediaTable.select(fn.MAX(MediaTable.id)).scalar() or 0
 
-    await db_man.execute(f"DELETE FROM anotd_banlist WHERE medium='{medium}' AND mal_id={series}")
+    # Everything but the lazily fetched nsfw flag is overwritten on conflict
+    to_update = [f for f in MediaTable._meta.sorted_fields if f.name not in ('id', 'nsfw')]
+
+    written = 0
+    async with aiohttp.ClientSession() as session:
+        async def fetch_page(query_vars):
+            async with anilist_man.lock():
+                async with session.post(const.ANILIST_API, json={'query': SNAPSHOT_QUERY, 'variables': query_vars}) as r:
+                    resp = await r.json()
+
+                    if r.status != 200:
+                        print(f'AniList snapshot update failed with status {r.status}')
+                        return
+
+            return resp['data']['Page']
+
+        def store(media):
+            rows = [media_row(m) for m in media]
+            with ANILIST_DB.atomic():
+                (MediaTable.insert_many(rows)
+                           .on_conflict(conflict_target=[MediaTable.id], preserve=to_update)
+                           .execute())
+            return len(rows)
+
+        has_next = True
+        while has_next:
+            page = await fetch_page({'page': 1, 'idGreater': last_id, 'sort': ['ID']})
+            if not page or not page['media']:
+                break
+
+            written += store(page['media'])
+            last_id = page['media'][-1]['id']
+            has_next = page['pageInfo']['hasNextPage']
+
+        if not last_updated:
+            return written
+
+        page_num = 1
+        has_next = True
+        while has_next:
+            page = await fetch_page({'page': page_num, 'idGreater': 0, 'sort': ['UPDATED_AT_DESC']})
+            if not page:
+                break
+
+            updated = [m for m in page['media'] if (m['updatedAt'] or 0) > last_updated]
+            if updated:
+                written += store(updated)
+            if len(updated) < len(page['media']):
+                break
+
+            page_num += 1
+            has_next = page['pageInfo']['hasNextPage']
+
+    return written
@@ -0,0 +1,99 @@
+import json
+
+from peewee import *
+
+import common.constants as const
+
+
+ANILIST_DB = SqliteDatabase(const.ANILIST_DB, pragmas={'journal_mode': 'wal'})
+
+class MediaTable(Model):
+    id = IntegerField(primary_key=True)
+    id_mal = IntegerField(null=True)
+    type = CharField()
+    format = CharField(null=True)
+    title_english = CharField(null=True)
+    title_preferred = CharField(null=True)
+    title_romaji = CharField(null=True)
+    cover_url = CharField(null=True)
+    description = TextField(null=True)
+    popularity = IntegerField(default=0)
+    average_score = IntegerField(default=0)
+    genres = TextField(default='[]')
+    tags = TextField(default='[]')
+    # Checked against MAL the first time the series is picked for trivia.
+    nsfw = BooleanField(null=True)
+    updated_at = IntegerField(default=0, index=True)
+
+    class Meta:
+        database = ANILIST_DB
+        table_name = 'media'
+
+
+class MediaSnapshot():
+    """ In-memory copy of the media table, kept sorted by popularity and by score
+        so trivia can sample series by rank without querying AniList.
+    """
+    def __init__(self):
+        self.by_popularity = []
+        self.by_score = []
+        self.pools = {}
+
+
+    @property
+    def ready(self):
+        return bool(self.by_popularity)
+
+
+    def load(self):
+        """ (Re)loads the snapshot from the database. Blocking. """
+        MediaTable.create_table(safe=True)
+
+        media = []
+        for row in MediaTable.select().dicts():
+            row['genres'] = frozenset(json.loads(row['genres']))
+            row['tags'] = frozenset(json.loads(row['tags']))
+            media.append(row)
+
+        self.by_score = sorted(media, key=lambda m: m['average_score'], reverse=True)
+        self.by_popularity = sorted(media, key=lambda m: m['popularity'], reverse=True)
+        self.pools = {}
+
+
+    def ranked(self, include, exclude, by_rating=False):
+        """ Returns the media matching the category filters, best ranked first.
+
+            include and exclude are (formats, genres, tags) tuples. Like the
+            AniList filters, an entry matches a non-empty group if it has any
+            of the group's values.
+        """
+        key = (include, exclude, by_rating)
+        if key not in self.pools:
+            media = self.by_score if by_rating else self.by_popularity
+            self.pools[key] = [m for m in media if self.matches(m, include, exclude)]
+
+        return self.pools[key]
+
+
+    @staticmethod
+    def matches(media, include, exclude):
+        formats, genres, tags = include
+        if formats and media['format'] not in formats:
+            return False
+        if genres and media['genres'].isdisjoint(genres):
+            return False
+        if tags and media['tags'].isdisjoint(tags):
+            return False
+
+        formats, genres, tags = exclude
+        if media['format'] in formats:
+            return False
+        if not media['genres'].isdisjoint(genres) or not media['tags'].isdisjoint(tags):
+            return False
+
+        return True
+
+
+    def set_nsfw(self, media, nsfw):
+        media['nsfw'] = nsfw
+        MediaTable.update(nsfw=nsfw).where(MediaTable.id == media['id']).execute()
@@ -55,6 +55,8 @@ def trivia_arg_parser(s):
     args = None
     try:
         args = parser.parse_args(shlex.split(s))
+        if args.diff < 1:
+            return
 
         all_categories = ['all', 'mangadex'] + const.ANILIST_GENRES + const.ANILIST_MEDIA + \
                          list(const.ANILIST_TAGS.keys()) + const.LEAGUE_CATS
@@ -0,0 +1,148 @@
+import inspect
+
+import common.constants as const
+
+from user import User
+
+
+class CommandSpec():
+    '''
+    Declares a chat command: how it is invoked and who may invoke it.
+
+    Args:
+        name (str): canonical command name, without the ]
+        handler: either a Command subclass, or a coroutine function called as
+                 handler(room, caller, true_caller, command, pm) that returns
+                 the message to send back
+        aliases (tuple): other names that invoke the command
+        rewrite (function): maps the split invocation to the one handled,
+                            e.g. to fill in arguments implied by an alias
+        req_rank (str): minimum rank needed to use the command
+        req_rank_pm (str): minimum rank needed in PMs, defaults to req_rank
+        allowed_rooms (list): rooms the command works in. None means any room.
+        pm_only (bool): only works in PMs
+        room_only (bool): only works in rooms
+        owner_only (bool): only works for the bot owner
+        min_args (int): fewest arguments accepted
+        max_args (int): most arguments accepted
+        usage (str): argument summary shown in help
+        help_text (str): description shown in help, defaults to the handler's docstring
+        needs_userinfo (bool): whether the caller's global and room ranks must be
+                               looked up first. Defaults to whether the command is rank gated.
+        kwargs: extra keyword arguments passed to Command subclasses
+    '''
+    def __init__(self, name, handler, aliases=(), rewrite=None, req_rank=' ', req_rank_pm=None,
+                 allowed_rooms=None, pm_only=False, room_only=False, owner_only=False,
+                 min_args=0, max_args=9999, usage='', help_text='', needs_userinfo=None, **kwargs):
+        self.name = name
+        self.handler = handler
+        self.aliases = tuple(aliases)
+        self.rewrite = rewrite
+        self.req_rank = req_rank
+        self.req_rank_pm = req_rank if req_rank_pm is None else req_rank_pm
+        self.allowed_rooms = allowed_rooms
+        self.pm_only = pm_only
+        self.room_only = room_only
+        self.owner_only = owner_only
+        self.min_args = min_args
+        self.max_args = max_args
+        self.usage = usage
+        self.help_text = help_text or inspect.getdoc(handler) or ''
+        self.kwargs = kwargs
+
+        self.is_class = inspect.isclass(handler)
+        if needs_userinfo is None:
+            needs_userinfo = req_rank != ' ' or self.req_rank_pm != ' '
+        self.needs_userinfo = needs_userinfo
+
+
+    def allows(self, room, caller, true_caller, pm, num_args):
+        '''
+        Checks a coroutine-handled invocation against the spec.
+        Command subclasses do their own checks, with error messages.
+
+        Args:
+            room (str): room the command was used in
+            caller (str): username, prefixed by the rank it was sent with
+            true_caller (str): caller's userid
+            pm (bool): whether the command came via PM
+            num_args (int): number of arguments given
+
+        Returns:
+            bool: True if the command should run
+        '''
+        if self.owner_only and true_caller != const.OWNER:
+            return False
+
+        if pm:
+            if self.room_only or not User.compare_ranks(caller[0], self.req_rank_pm):
+                return False
+        else:
+            if self.pm_only or not User.compare_ranks(caller[0], self.req_rank):
+                return False
+            if self.allowed_rooms is not None and room not in self.allowed_rooms:
+                return False
+
+        return self.min_args <= num_args <= self.max_args
+
+
+    def help_line(self):
+        '''
+        Generates a one line summary of the command for ]help.
+        '''
+        line = f']{self.name} {self.usage}'.rstrip()
+        if self.help_text:
+            line += f': {self.help_text}'
+
+        notes = []
+        if self.aliases:
+            notes.append('aliases: ' + ', '.join(f']{a}' for a in self.aliases))
+        if self.owner_only:
+            notes.append('owner only')
+        elif self.req_rank != ' ':
+            notes.append(f'rank {self.req_rank} and up')
+        if self.pm_only:
+            notes.append('PMs only')
+        elif self.room_only:
+            notes.append('rooms only')
+        if self.allowed_rooms is not None:
+            notes.append('rooms: ' + ', '.join(self.allowed_rooms))
+
+        if notes:
+            line += f' ({"; ".join(notes)})'
+        return line
+
+
+class CommandRegistry():
+    '''
+    Maps command names and aliases to their CommandSpecs.
+    '''
+    def __init__(self):
+        self.specs = {}
+        self.lookup = {}
+
+
+    def register(self, spec):
+        for name in (spec.name,) + spec.aliases:
+            if name in self.lookup:
+                raise ValueError(f']{name} is already registered.')
+            self.lookup[name] = spec
+        self.specs[spec.name] = spec
+
+
+    def get(self, name):
+        return self.lookup.get(name)
+
+
+    def help_index(self, include_owner=False):
+        '''
+        Lists every registered command name.
+
+        Args:
+            include_owner (bool): whether to list owner-only commands
+
+        Returns:
+            str: comma separated command names
+        '''
+        names = [n for n, s in sorted(self.specs.items()) if include_owner or not s.owner_only]
+        return ', '.join(f']{n}' for n in names)
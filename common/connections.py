@@ -1,7 +1,10 @@
 import aiohttp
 import asyncio
+import queue
 import sqlite3
+import threading
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from common.utils import find_true_name
 
@@ -23,29 +26,134 @@ class ApiManager():
 
 
 class DatabaseManager():
-    def __init__(self, db_file):
-        self.db_lock = asyncio.Lock()
+    """ Keeps long-lived sqlite connections to db_file in WAL mode.
+        Reads run on a small thread pool, each thread with its own
+        connection. Everything else goes through a single writer thread,
+        in the order it was queued.
+
+        Queries should pass values as params (? placeholders) so each
+        connection can reuse its prepared statements.
+
+        After close(), writes fail with RuntimeError instead of waiting
+        on a writer that is gone.
+    """
+    STATEMENT_CACHE = 256
+
+    def __init__(self, db_file, readers=4):
         self.db = db_file
 
+        self.local = threading.local()
+        # Every reader thread's connection, so close() can close them.
+        self.read_connections = []
+        self.read_pool = ThreadPoolExecutor(max_workers=readers,
+                                            thread_name_prefix='db-read')
 
-    async def execute(self, query):
-        if 'droptable' in find_true_name(query):
-            print(f'SOMEONE TRIED TO DROP TABLES WITH: {query}')
-            return
-        await self.db_lock.acquire()
+        self.closed = False
+        self.close_lock = threading.Lock()
+        self.write_queue = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, name='db-write', daemon=True)
+        self.writer.start()
+
+
+    def connect(self, check_same_thread=True):
+        connection = sqlite3.connect(self.db, timeout=30, check_same_thread=check_same_thread,
+                                     cached_statements=self.STATEMENT_CACHE)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
 
-        rows = []
 
-        connection = sqlite3.connect(self.db)
+    def read_connection(self):
+        if not hasattr(self.local, 'connection'):
+            # Closed from the thread calling close(), once the pool has stopped.
+            self.local.connection = self.connect(check_same_thread=False)
+            self.local.connection.execute('PRAGMA query_only=1')
+            with self.close_lock:
+                self.read_connections.append(self.local.connection)
+        return self.local.connection
 
+
+    def run(self, connection, query, params=(), many=False):
+        rows = []
         try:
             with connection:
-                rows = connection.execute(query).fetchall()
+                if many:
+                    connection.executemany(query, params)
+                else:
+                    rows = connection.execute(query, params).fetchall()
         except Exception as e:
             print(f'{query} failed on {self.db}: {e}')
-        finally:
-            connection.close()
-
-        self.db_lock.release()
 
         return rows
+
+
+    def write_loop(self):
+        connection = self.connect()
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+
+            query, params, many, future = item
+            if future.set_running_or_notify_cancel():
+                future.set_result(self.run(connection, query, params, many))
+
+        connection.close()
+
+
+    def submit(self, query, params=(), many=False):
+        """ Queues a write without waiting for it. Returns a
+            concurrent.futures.Future with the resulting rows.
+        """
+        future = Future()
+        with self.close_lock:
+            if self.closed:
+                future.set_exception(RuntimeError(f'{self.db} is closed'))
+            else:
+                self.write_queue.put((query, params, many, future))
+        return future
+
+
+    async def execute(self, query, params=()):
+        if 'droptable' in find_true_name(query):
+            print(f'SOMEONE TRIED TO DROP TABLES WITH: {query}')
+            return
+
+        if query.lstrip().lower().startswith('select'):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.read_pool,
+                                              lambda: self.run(self.read_connection(), query, params))
+
+        return await asyncio.wrap_future(self.submit(query, params))
+
+
+    async def executemany(self, query, params_seq):
+        """ Runs one write statement for every set of params, in a single transaction. """
+        params_seq = list(params_seq)
+        if not params_seq:
+            return []
+
+        return await asyncio.wrap_future(self.submit(query, params_seq, many=True))
+
+
+    async def insert_many(self, table, columns, rows, or_ignore=False):
+        """ Batch inserts rows (tuples ordered like columns) into table. """
+        conflict = ' OR IGNORE' if or_ignore else ''
+        placeholders = ', '.join(['?'] * len(columns))
+        return await self.executemany(f"INSERT{conflict} INTO {table} ({', '.join(columns)}) "
+                                      f"VALUES ({placeholders})", rows)
+
+
+    def close(self):
+        """ Finishes all queued writes and running reads, then shuts down. """
+        with self.close_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.write_queue.put(None)
+        self.writer.join()
+
+        self.read_pool.shutdown(wait=True)
+        for connection in self.read_connections:
+            connection.close()
+        self.read_connections = []
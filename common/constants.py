@@ -19,19 +19,15 @@ WRESTLING_ROOM = 'prowrestling'
 
 MAX_FRIENDS = 100
 
-SIMPLE_COMMANDS = ['help', 'dab', 'owo', 'google', 'joogle', 'bing', 'jing', 'jibun',
-                   'mal_add', 'mal_set', 'wpm_reset', 'wpm']
-UHTML_COMMANDS = ['plebs', 'calendar', 'birthday', 'wpm_top',
-                  'anime', 'manga', 'randanime', 'randmanga', 'mal']
-
 TIMER_USER = 'T*'
 
 JIKAN_API = 'https://api.jikan.moe/v4/'
 MAL_API = 'https://api.myanimelist.net/v2/'
 DEX_API = 'https://api.mangadex.org/'
 ANILIST_API = 'https://graphql.anilist.co/'
-DDRAGON_API = 'http://ddragon.leagueoflegends.com/cdn/11.14.1/data/en_US/'
-DDRAGON_IMG = 'http://ddragon.leagueoflegends.com/cdn/11.14.1/img/'
+DDRAGON_VERSION = '11.14.1'
+DDRAGON_API = f'http://ddragon.leagueoflegends.com/cdn/{DDRAGON_VERSION}/data/en_US/'
+DDRAGON_IMG = f'http://ddragon.leagueoflegends.com/cdn/{DDRAGON_VERSION}/img/'
 DDRAGON_SPL = 'http://ddragon.leagueoflegends.com/cdn/img/champion/loading/'
 STEAM_API = 'http://api.steampowered.com/'
 IGDB_API = 'https://api.igdb.com/v4/'
@@ -45,13 +41,17 @@ YGO_API = 'https://db.ygoprodeck.com/api/v7/cardinfo.php?fname='
 BANLISTFILE = os.path.join(BASE_DIR, 'data/banlist.json')
 BIRTHDAYFILE = os.path.join(BASE_DIR, 'data/birthdays.json')
 CALENDARFILE = os.path.join(BASE_DIR, 'data/calendar.json')
+DDRAGONFILE = os.path.join(BASE_DIR, 'data/ddragon.json')
 FRIENDFILE = os.path.join(BASE_DIR, 'data/friends.json')
+IMGDIMSFILE = os.path.join(BASE_DIR, 'data/img_dims.json')
 SENTENCEFILE = os.path.join(BASE_DIR, 'data/sentences.txt')
 SUCKFILE = os.path.join(BASE_DIR, 'data/suck.txt')
 TOPICFILE = os.path.join(BASE_DIR, 'data/topics.json')
+VGTRIVIAFILE = os.path.join(BASE_DIR, 'data/vg_trivia.json')
 WPMFILE = os.path.join(BASE_DIR, 'data/wpm.txt')
 
 ROOMDATA_DB = os.path.join(BASE_DIR, 'data/roomdata.db')
+ANILIST_DB = os.path.join(BASE_DIR, 'data/anilist.db')
 
 STEAMFILE = os.path.join(BASE_DIR, 'data/steam.txt')
 
@@ -0,0 +1,130 @@
+import aiohttp
+import asyncio
+import json
+
+import common.constants as const
+
+from common.utils import ImgDimsCache
+
+# Max number of Data Dragon requests in flight while building the cache.
+BUILD_CONCURRENCY = 10
+
+
+class DataDragon():
+    """ Local copy of the Data Dragon data used by League trivia: champions
+        with their skins and spells, items, and the resolved URL and size
+        of every image. Stored in DDRAGONFILE and rebuilt when
+        DDRAGON_VERSION changes.
+    """
+    def __init__(self, cache_file=const.DDRAGONFILE):
+        self.cache_file = cache_file
+        self.version = None
+        self.champs = {}
+        self.items = {}
+        self.building = None
+
+
+    @property
+    def ready(self):
+        return self.version == const.DDRAGON_VERSION
+
+
+    def load(self):
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        if cache.get('version') == const.DDRAGON_VERSION:
+            self.version = cache['version']
+            self.champs = cache['champs']
+            self.items = cache['items']
+
+
+    def save(self):
+        with open(self.cache_file, 'w') as f:
+            json.dump({'version': self.version, 'champs': self.champs, 'items': self.items}, f)
+
+
+    async def update(self):
+        """ Builds the cache if it is missing or out of date.
+            Concurrent callers share one build.
+
+            Returns True if the cache is usable afterwards.
+        """
+        if self.ready:
+            return True
+
+        if not self.building:
+            self.building = asyncio.create_task(self.build())
+            self.building.add_done_callback(self.build_done)
+
+        await asyncio.wait([self.building])
+        return self.ready
+
+
+    def build_done(self, task):
+        self.building = None
+        if not task.cancelled() and task.exception():
+            print(f'Data Dragon cache build failed: {task.exception()}')
+
+
+    async def build(self):
+        sem = asyncio.Semaphore(BUILD_CONCURRENCY)
+        # The sizes end up in the cache file, so probing the few thousand
+        # images goes through a cache of its own instead of the shared one.
+        img_dims = ImgDimsCache(None)
+
+        async def get_json(session, url):
+            async with sem:
+                async with session.get(url) as r:
+                    return json.loads(await r.text())
+
+        async def resolve_img(url):
+            """ Data Dragon serves some images as jpg under a png name. """
+            async with sem:
+                dims = await img_dims.resolve(url)
+                if not all(dims) and url.endswith('.png'):
+                    url = url[:-3] + 'jpg'
+                    dims = await img_dims.resolve(url)
+            return {'url': url, 'dims': dims}
+
+        async def champ_info(session, champ):
+            resp = await get_json(session, const.DDRAGON_API + f'champion/{champ}.json')
+            champ_data = resp['data'][champ]
+            spells = [champ_data['passive']] + champ_data['spells']
+            spell_urls = [const.DDRAGON_IMG + f'passive/{spells[0]["image"]["full"]}']
+            spell_urls += [const.DDRAGON_IMG + f'spell/{s["image"]["full"]}' for s in spells[1:]]
+            skin_urls = [const.DDRAGON_SPL + f'{champ}_{s["num"]}.png' for s in champ_data['skins']]
+
+            imgs = await asyncio.gather(*[resolve_img(url) for url in spell_urls + skin_urls])
+            spell_imgs, skin_imgs = imgs[:len(spells)], imgs[len(spells):]
+
+            return {'name': champ_data['name'],
+                    # Index 0 is the passive
+                    'spells': [{'name': s['name'], 'img': img} for s, img in zip(spells, spell_imgs)],
+                    'skins': [{'num': s['num'], 'name': s['name'], 'img': img}
+                              for s, img in zip(champ_data['skins'], skin_imgs)]}
+
+        async def item_info(item, item_data):
+            img = await resolve_img(const.DDRAGON_IMG + f'item/{item}.png')
+            return {'name': item_data['name'], 'img': img}
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                all_champs = (await get_json(session, const.DDRAGON_API + 'champion.json'))['data']
+                all_items = (await get_json(session, const.DDRAGON_API + 'item.json'))['data']
+
+                champ_infos = await asyncio.gather(*[champ_info(session, c) for c in all_champs])
+                item_infos = await asyncio.gather(*[item_info(i, d) for i, d in all_items.items()])
+        finally:
+            if img_dims.session:
+                await img_dims.session.close()
+
+        self.champs = dict(zip(all_champs, champ_infos))
+        self.items = dict(zip(all_items, item_infos))
+        self.version = const.DDRAGON_VERSION
+        self.save()
+        print(f'Built Data Dragon cache for {self.version}: '
+              f'{len(self.champs)} champions, {len(self.items)} items')
@@ -0,0 +1,48 @@
+class EmoteManager():
+    """ In-memory index of each room's emotes, loaded on first use.
+        Usage counts are accumulated in memory and written back to
+        the emotes table by flush().
+    """
+    FLUSH_QUERY = "UPDATE emotes SET times_used=times_used+? WHERE room=? AND name=?"
+
+    def __init__(self, db_man):
+        self.db_man = db_man
+        self.rooms = {}
+        self.usage = {}
+
+
+    async def get_room(self, room):
+        """ Returns a dict of emote name -> url for room. """
+        if room not in self.rooms:
+            emote_list = await self.db_man.execute("SELECT name, url FROM emotes WHERE room=?", (room,))
+            self.rooms[room] = dict(emote_list) if emote_list else {}
+
+        return self.rooms[room]
+
+
+    def invalidate(self, room):
+        """ Drops the cached emotes of room, e.g. after one is added or removed. """
+        self.rooms.pop(room, None)
+
+
+    def record_use(self, room, emote):
+        key = (room, emote)
+        self.usage[key] = self.usage.get(key, 0) + 1
+
+
+    def pop_usage(self):
+        usage = self.usage
+        self.usage = {}
+        return [(count, room, emote) for (room, emote), count in usage.items()]
+
+
+    async def flush(self):
+        """ Writes the pending usage counts to the database. """
+        await self.db_man.executemany(self.FLUSH_QUERY, self.pop_usage())
+
+
+    def flush_nowait(self):
+        """ Queues the pending usage counts without waiting, for shutdown. """
+        usage = self.pop_usage()
+        if usage:
+            self.db_man.submit(self.FLUSH_QUERY, usage, many=True)
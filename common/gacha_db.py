@@ -44,7 +44,10 @@ class PlayerAccInfoTable(Model):
         table_name = 'metadata'
 
 
-class PlayerBoxTable(Model):
+class PlayerUnitTable(Model):
+    """ Every player's units. id numbers a unit within its owner's box. """
+    username = CharField()
+    id = IntegerField()
     gacha = CharField()
     unit_id = FloatField()
     name = CharField()
@@ -57,6 +60,36 @@ class PlayerBoxTable(Model):
 
     class Meta:
         database = GACHA_DB
+        table_name = 'player_units'
+        primary_key = CompositeKey('username', 'id')
+        indexes = (
+            (('username', 'gacha', 'unit_id'), False),
+            (('username', 'showcase'), False),
+            (('gacha', 'unit_id'), False),
+        )
+
+
+class GrantTable(Model):
+    """ When each scheduled currency grant was last applied, as a unix timestamp. """
+    name = CharField(primary_key=True)
+    last_grant = IntegerField()
+
+    class Meta:
+        database = GACHA_DB
+        table_name = 'grants'
+
+
+def insert_units(username, units):
+    """ Adds units, as dicts of PlayerUnitTable fields, to the end of a player's box. """
+    with GACHA_DB.atomic():
+        last_id = (PlayerUnitTable.select(fn.MAX(PlayerUnitTable.id))
+                                  .where(PlayerUnitTable.username == username)
+                                  .scalar()) or 0
+        rows = [dict(u, username=username, id=last_id + i) for i, u in enumerate(units, 1)]
+        for batch in chunked(rows, 100):
+            PlayerUnitTable.insert_many(batch).execute()
+
+    return len(rows)
 
 
 class AllGachasTable(Model):
@@ -97,3 +130,33 @@ class PadTable(GachaTable):
 
     class Meta:
         table_name = 'pad'
+
+
+# Migrations
+
+def migrate_player_boxes(drop=False):
+    """ Copies the old per-player box tables, one per username, into player_units. """
+    GACHA_DB.create_tables([PlayerUnitTable], safe=True)
+    columns = ', '.join(f.column_name for f in PlayerUnitTable._meta.sorted_fields if f.name != 'username')
+
+    for player in PlayerAccInfoTable.select():
+        if not GACHA_DB.table_exists(player.username):
+            continue
+
+        with GACHA_DB.atomic():
+            cursor = GACHA_DB.execute_sql(f'INSERT OR IGNORE INTO player_units (username, {columns}) '
+                                          f'SELECT ?, {columns} FROM "{player.username}"', (player.username,))
+            if drop:
+                GACHA_DB.execute_sql(f'DROP TABLE "{player.username}"')
+        print(f'{player.username}: copied {cursor.rowcount} units')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gacha database maintenance.')
+    parser.add_argument('command', choices=['migrate_boxes'])
+    parser.add_argument('--drop', action='store_true',
+                        help='drop each per-player table once its units are copied')
+    args = parser.parse_args()
+
+    if args.command == 'migrate_boxes':
+        migrate_player_boxes(drop=args.drop)
@@ -0,0 +1,132 @@
+import aiohttp
+import asyncio
+import html
+import time
+from collections import OrderedDict
+
+import common.constants as const
+
+PAGE_LINES = 20
+# Listings with more text than this are uploaded to pastie instead of shown inline.
+INLINE_LIMIT = 50000
+MAX_LISTINGS = 200
+LISTING_TTL = 60 * 60
+
+
+class Listing():
+    def __init__(self, title, header, lines, name, room, rank=None):
+        self.title = title
+        self.header = header
+        self.lines = lines
+        self.name = name
+        self.room = room
+        self.rank = rank
+        self.pages = max(1, -(-len(lines) // PAGE_LINES))
+        self.created = time.monotonic()
+
+
+class ListingManager():
+    """ Shows long tables, like gacha boxes and song lists, as uhtml boxes
+        with page buttons. The buttons message the bot with ]listing, which
+        serves the page from memory. Listings that cannot be shown in a room,
+        or are too long to show inline, are uploaded to pastie instead.
+    """
+    def __init__(self, bot_username, max_listings=MAX_LISTINGS, ttl=LISTING_TTL):
+        self.bot_username = bot_username
+        self.max_listings = max_listings
+        self.ttl = ttl
+
+        self.listings = OrderedDict()
+        self.next_key = 0
+        self.session = None
+
+
+    def add(self, listing):
+        key = f'{self.next_key:x}'
+        self.next_key += 1
+
+        self.listings[key] = listing
+        while len(self.listings) > self.max_listings:
+            self.listings.popitem(last=False)
+        return key
+
+
+    def get(self, key):
+        """ Returns the listing under key, or None if it expired. """
+        listing = self.listings.get(key)
+        if listing is None or time.monotonic() - listing.created > self.ttl:
+            self.listings.pop(key, None)
+            return None
+        return listing
+
+
+    def page_button(self, key, page, label):
+        return (f'<button class="button" name="send" '
+                f'value="/botmsg {self.bot_username}, ]listing {key} {page}">{label}</button>')
+
+
+    def page_uhtml(self, key, listing, page):
+        start = (page - 1) * PAGE_LINES
+        # Line breaks are tags, since a newline would split the message.
+        shown = listing.header.split('\n') + listing.lines[start:start + PAGE_LINES]
+        text = '<br>'.join(html.escape(l) for l in shown)
+
+        nav = f'Page {page}/{listing.pages}'
+        if page > 1:
+            nav = f'{self.page_button(key, page - 1, "&lt;")} {nav}'
+        if page < listing.pages:
+            nav = f'{nav} {self.page_button(key, page + 1, "&gt;")}'
+
+        return (f'<b>{html.escape(listing.title)}</b>'
+                f'<div style="overflow-x: auto"><pre style="margin: 2px 0">{text}</pre></div>'
+                f'<center>{nav}</center>')
+
+
+    def fits(self, header, lines):
+        """ Whether a listing is short enough to show inline. """
+        return len(header) + sum(len(l) + 1 for l in lines) <= INLINE_LIMIT
+
+
+    async def paste(self, header, lines):
+        """ Uploads a listing to pastie. Returns the raw url, or None if it failed. """
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=4),
+                                                 timeout=aiohttp.ClientTimeout(total=15))
+
+        text = '\n'.join([header] + lines)
+        try:
+            async with self.session.post(const.PASTIE_API, data=text.encode('utf-8')) as r:
+                if r.status != 200:
+                    return None
+                key = (await r.json(content_type=None))['key']
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+            print(f'Pastie upload failed: {e}')
+            return None
+
+        return f'https://pastie.io/raw/{key}'
+
+
+    def render(self, title, header, lines, name, room, viewer=None, rank=None):
+        """ Returns the message that shows the first page of a listing in room:
+            to viewer alone if given, otherwise to users of rank and up, or to everyone.
+        """
+        listing = Listing(title, header, lines, name, room, rank=rank)
+        uhtml = self.page_uhtml(self.add(listing), listing, 1)
+        if viewer:
+            return f'/sendprivateuhtml {viewer}, {name}, {uhtml}'
+        if rank:
+            return f'/addrankuhtml {rank}, {name}, {uhtml}'
+        return f'/adduhtml {name}, {uhtml}'
+
+
+    def page(self, key, page, viewer):
+        """ Returns the message that shows page of a listing to viewer,
+            or None if the listing expired.
+        """
+        listing = self.get(key)
+        if listing is None:
+            return None
+
+        page = min(max(page, 1), listing.pages)
+        uhtml = self.page_uhtml(key, listing, page)
+        return f'{listing.room}|/sendprivateuhtml {viewer}, {listing.name}, {uhtml}'
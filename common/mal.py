@@ -46,22 +46,34 @@ class MalManager(ApiManager):
 
 
     async def mal_of_ps(self, ps_user):
-        mal_user = await self.db_man.execute("SELECT mal_username FROM mal_users "
-                                            f"WHERE ps_username='{ps_user}'")
+        mal_user = await self.db_man.execute("SELECT mal_username FROM mal_users WHERE ps_username=?",
+                                             (ps_user,))
         if mal_user:
             return mal_user[0][0]
         else:
             return
 
 
+    async def nsfw_rating(self, medium, series_id):
+        """ Returns whether MAL rates a series as nsfw, or None if that is unknown
+            because the series has no MAL id or the request failed.
+        """
+        if series_id is None:
+            return None
+        try:
+            series_data = await self.api_request(f'{const.MAL_API}{medium}/{series_id}', params={'fields': 'nsfw'})
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+        if not isinstance(series_data, dict) or 'nsfw' not in series_data:
+            return None
+        return series_data['nsfw'] != 'white'
+
+
     async def is_nsfw(self, medium, series_id):
-        series_data = await self.api_request(f'{const.MAL_API}{medium}/{series_id}', params={'fields': 'nsfw'})
-        if 'nsfw' not in series_data:
-            return True
-        elif series_data['nsfw'] == 'white':
-            return False
-        else:
+        is_nsfw = await self.nsfw_rating(medium, series_id)
+        if is_nsfw is None:
             return True
+        return is_nsfw
 
 
     async def animelist(self, ps_user):
@@ -105,15 +117,15 @@ class MalManager(ApiManager):
         table_name = f'mal_list_{find_true_name(mal_user)}'
 
         table_exists = await self.db_man.execute("SELECT name FROM sqlite_master "
-                                                f"WHERE type='table' AND name='{table_name}'")
+                                                 "WHERE type='table' AND name=?", (table_name,))
         if not table_exists:
             await self.db_man.execute(f"CREATE TABLE {table_name} (medium VARCHAR NOT NULL, "
                                                                   "mal_id INTEGER NOT NULL, "
                                                                   "PRIMARY KEY (medium, mal_id))")
 
         # Do not update if cache is younger than 1 day
-        last_updated = await self.db_man.execute("SELECT last_updated FROM mal_users "
-                                                f"WHERE mal_username='{mal_user}'")
+        last_updated = await self.db_man.execute("SELECT last_updated FROM mal_users WHERE mal_username=?",
+                                                 (mal_user,))
         update_time = datetime.datetime.strptime(last_updated[0][0], '%Y-%m-%d %H:%M:%S')
         if datetime.datetime.now() - update_time < datetime.timedelta(days=1) and not force:
             return
@@ -121,16 +133,13 @@ class MalManager(ApiManager):
         animelist = await self.animelist(ps_user)
         mangalist = await self.mangalist(ps_user)
 
-        values = [f"('anime', '{mal_id}')" for mal_id in animelist]
-        values += [f"('manga', '{mal_id}')" for mal_id in mangalist]
+        values = [('anime', mal_id) for mal_id in animelist]
+        values += [('manga', mal_id) for mal_id in mangalist]
 
-        if values:
-            await self.db_man.execute(f"INSERT OR IGNORE INTO {table_name} (medium, mal_id) "
-                                      f"VALUES {', '.join(values)}")
+        await self.db_man.insert_many(table_name, ('medium', 'mal_id'), values, or_ignore=True)
 
-        escaped_mal_user = mal_user.replace("'", "''")
-        await self.db_man.execute("UPDATE mal_users SET last_updated=CURRENT_TIMESTAMP "
-                                 f"WHERE mal_username='{escaped_mal_user}'")
+        await self.db_man.execute("UPDATE mal_users SET last_updated=CURRENT_TIMESTAMP WHERE mal_username=?",
+                                  (mal_user,))
 
 
     async def user_rand_series(self, ps_user, media, anotd=False):
@@ -142,9 +151,11 @@ class MalManager(ApiManager):
         table_name = f'mal_list_{find_true_name(mal_user)}'
 
         db_query = f"SELECT * FROM {table_name}"
+        db_params = ()
         if len(media) == 1:
-            db_query += f" WHERE medium='{media[0]}'"
-        all_series = await self.db_man.execute(db_query)
+            db_query += " WHERE medium=?"
+            db_params = (media[0],)
+        all_series = await self.db_man.execute(db_query, db_params)
 
         series = None
         is_nsfw = True
@@ -158,7 +169,8 @@ class MalManager(ApiManager):
             # Take out if anotd
             if anotd:
                 bl = await self.db_man.execute("SELECT * FROM mal_banlist "
-                                              f"WHERE medium='{temp_series[0]}' AND mal_id={temp_series[1]} AND anotd_source=1")
+                                               "WHERE medium=? AND mal_id=? AND anotd_source=1",
+                                               (temp_series[0], temp_series[1]))
                 if bl:
                     is_nsfw = True
 
@@ -176,9 +188,6 @@ class MalManager(ApiManager):
 
 
     async def set_user(self, ps_user, mal_user, jikan_man):
-        # Sqlite escape
-        escaped_mal_user = mal_user.replace("'", "''")
-
         try:
             await jikan_user_info(mal_user, jikan_man)
         except:
@@ -189,17 +198,17 @@ class MalManager(ApiManager):
             return f"{ps_user}'s MAL is already set to {mal_user}."
         # Can change to actual UPSERT when sqlite3 gets updated to have it
         elif current_user:
-            await self.db_man.execute(f"UPDATE mal_users SET mal_username='{escaped_mal_user}', "
+            await self.db_man.execute("UPDATE mal_users SET mal_username=?, "
                                                             "last_updated=CURRENT_TIMESTAMP "
-                                      f"WHERE ps_username='{ps_user}'")
+                                      "WHERE ps_username=?", (mal_user, ps_user))
 
-            cu_rows = await self.db_man.execute("SELECT COUNT(*) FROM mal_users "
-                                               f"WHERE mal_username='{current_user}'")
+            cu_rows = await self.db_man.execute("SELECT COUNT(*) FROM mal_users WHERE mal_username=?",
+                                                (current_user,))
             if cu_rows[0][0] == 0:
                 await self.db_man.execute(f"DROP TABLE mal_{current_user}")
         else:
-            await self.db_man.execute("INSERT INTO mal_users (ps_username, mal_username) "
-                                     f"VALUES ('{ps_user}', '{escaped_mal_user}')")
+            await self.db_man.execute("INSERT INTO mal_users (ps_username, mal_username) VALUES (?, ?)",
+                                      (ps_user, mal_user))
 
         asyncio.create_task(self.update_user(ps_user, force=True))
 
@@ -217,7 +226,7 @@ class MalManager(ApiManager):
         img_url = const.IMG_NOT_FOUND
         if user_data['images']:
             img_url = user_data['images']['jpg']['image_url']
-        img_uhtml = gen_uhtml_img_code(img_url, height_resize=100, width_resize=125)
+        img_uhtml = await gen_uhtml_img_code(img_url, height_resize=100, width_resize=125)
 
         # Set favorite series
         top_series_uhtml = {'anime': (), 'manga': ()}
@@ -239,7 +248,7 @@ class MalManager(ApiManager):
                     break
 
             top_series_uhtml[medium] = (top_series, top_series_url,
-                                        gen_uhtml_img_code(top_series_img, height_resize=64))
+                                        await gen_uhtml_img_code(top_series_img, height_resize=64))
 
         user_info = UserInfo(user_data['username'], user_data['url'], 'mal')
         kwargs = {'profile_pic': img_uhtml,
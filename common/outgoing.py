@@ -0,0 +1,210 @@
+import asyncio
+import time
+from collections import deque, OrderedDict
+
+URGENT = 0
+HIGH = 1
+NORMAL = 2
+BULK = 3
+
+# Showdown processes one chat message per throttle interval per connection
+# (100ms for trusted users, which the bot is) and drops messages once more
+# than 6 are buffered server side, so the burst stays under that.
+THROTTLE_INTERVAL = 0.1
+THROTTLE_BURST = 5
+
+# Commands for the same room are packed into one frame of newline separated
+# lines, within Showdown's multiline limit and its maximum message size.
+FRAME_MAX_LINES = 3
+FRAME_MAX_BYTES = 100000
+# Commands that Showdown lets span several lines, which would swallow the lines after them.
+MULTILINE_COMMANDS = ('/adduhtml', '/changeuhtml', '/addhtmlbox', '/addrankhtmlbox', '/htmlbox', '!htmlbox',
+                      '/sendprivateuhtml', '/pmuhtml', '/code', '!code')
+
+UHTML_VERBS = ('/adduhtml ', '/changeuhtml ')
+BULK_COMMANDS = ('/join ', '/leave ', '/friend ', '/unfriend ', '/avatar ')
+BATTLE_COMMANDS = ('/join battle-', '/leave battle-')
+
+
+def queue_room(msg):
+    """ Returns the room whose queue a message waits in. Joining or leaving
+        a battle waits in the battle's queue, so it stays in order with the
+        messages sent to the battle.
+    """
+    room, _, text = msg.partition('|')
+    if not room and text.startswith(BATTLE_COMMANDS):
+        return text.partition(' ')[2].strip()
+    return room
+
+
+def classify(msg):
+    """ Picks the default priority of a message from its room and command. """
+    room, _, text = msg.partition('|')
+    if queue_room(msg).startswith('battle-'):
+        return URGENT
+    if not room and text.startswith(BULK_COMMANDS):
+        return BULK
+    return NORMAL
+
+
+def packable(text):
+    """ Whether a message's text can share a frame with others. """
+    return '\n' not in text and not text.startswith(MULTILINE_COMMANDS)
+
+
+def frame_lines(text):
+    """ How many messages Showdown counts a frame's text as for throttling. """
+    if text.startswith(MULTILINE_COMMANDS):
+        return 1
+    return text.count('\n') + 1
+
+
+def uhtml_key(msg):
+    """ Returns (room, verb, uhtml name) for a room uhtml message, or None. """
+    room, _, text = msg.partition('|')
+    for verb in UHTML_VERBS:
+        if text.startswith(verb):
+            name, sep, _ = text[len(verb):].partition(',')
+            if sep:
+                return room, verb, name.strip()
+    return None
+
+
+class OutgoingScheduler():
+    """ Queue of messages for Showdown, drained by Bot.sender.
+        Messages are served by priority class, round robin between rooms
+        within a class, and throttled by a token bucket matching Showdown's
+        flood limits. Messages to one room keep their order within a class.
+        A queued /adduhtml or /changeuhtml absorbs a later /changeuhtml to
+        the same uhtml name in the same room. A later /adduhtml is queued
+        behind it, so every box still gets shown.
+    """
+    def __init__(self, interval=THROTTLE_INTERVAL, burst=THROTTLE_BURST):
+        self.interval = interval
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+
+        # classes[priority] maps room -> deque of entries, in round robin order
+        self.classes = [OrderedDict() for _ in range(BULK + 1)]
+        self.uhtml_pending = {}
+        self.size = 0
+        self.nonempty = asyncio.Event()
+
+
+    def qsize(self):
+        return self.size
+
+
+    def empty(self):
+        return self.size == 0
+
+
+    def put_nowait(self, msg, priority=None):
+        key = uhtml_key(msg)
+        if key is not None:
+            room, verb, name = key
+            pending = self.uhtml_pending.get((room, name))
+            if pending is not None and verb == '/changeuhtml ':
+                # A box that has not been sent yet still has to be created,
+                # so an update to it keeps the /adduhtml.
+                if pending[0].startswith(f'{room}|/adduhtml '):
+                    msg = f'{room}|/adduhtml {msg[len(room) + 1 + len(verb):]}'
+                pending[0] = msg
+                return
+
+        if priority is None:
+            priority = classify(msg)
+
+        entry = [msg, None]
+        if key is not None:
+            entry[1] = (key[0], key[2])
+            self.uhtml_pending[entry[1]] = entry
+
+        self.classes[priority].setdefault(queue_room(msg), deque()).append(entry)
+        self.size += 1
+        self.nonempty.set()
+
+
+    async def put(self, msg, priority=None):
+        self.put_nowait(msg, priority)
+
+
+    def pop_entry(self, rooms, room):
+        entries = rooms[room]
+        entry = entries.popleft()
+        if entries:
+            rooms.move_to_end(room)
+        else:
+            del rooms[room]
+
+        if entry[1] is not None and self.uhtml_pending.get(entry[1]) is entry:
+            del self.uhtml_pending[entry[1]]
+        self.size -= 1
+        if not self.size:
+            self.nonempty.clear()
+        return entry[0]
+
+
+    def pop(self, max_lines=FRAME_MAX_LINES):
+        """ Removes the next frame to send. Returns (frame, lines), where lines
+            is how many messages Showdown throttles it as, or (None, 0) if there
+            is nothing to send. Following messages to the same room are packed
+            into the frame while it stays within max_lines and the size limit.
+        """
+        for rooms in self.classes:
+            if not rooms:
+                continue
+
+            queue = next(iter(rooms))
+            msg = self.pop_entry(rooms, queue)
+            room, _, text = msg.partition('|')
+            if not packable(text):
+                return msg, frame_lines(text)
+
+            lines = frame_lines(text)
+            size = len(msg.encode())
+            while lines < min(max_lines, FRAME_MAX_LINES) and queue in rooms:
+                next_room, _, text = rooms[queue][0][0].partition('|')
+                if (next_room != room or not packable(text)
+                        or size + 1 + len(text.encode()) > FRAME_MAX_BYTES):
+                    break
+                self.pop_entry(rooms, queue)
+                msg += '\n' + text
+                lines += 1
+                size += 1 + len(text.encode())
+
+            return msg, lines
+
+        return None, 0
+
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) / self.interval)
+        self.last_refill = now
+
+
+    async def acquire(self):
+        """ Waits until the token bucket has a token for another message. """
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                return
+            await asyncio.sleep((1 - self.tokens) * self.interval)
+
+
+    async def get(self):
+        """ Waits for a message and for the throttle, then returns the next frame.
+            Showdown throttles every line of a frame, so a frame is only packed
+            with as many lines as there are tokens, and takes a token per line.
+        """
+        while True:
+            await self.nonempty.wait()
+            await self.acquire()
+            msg, lines = self.pop(int(self.tokens))
+            if msg is not None:
+                # A frame that is several lines by itself can overdraw the
+                # bucket, which the following waits pay back.
+                self.tokens -= lines
+                return msg
@@ -1,3 +1,5 @@
+import random
+
 from peewee import *
 from playhouse.migrate import *
 
@@ -15,3 +17,49 @@ class QuestionTable(Model):
     class Meta:
         database = QB_DB
         table_name = 'questions'
+
+
+CHAIN_QUERY = '''
+WITH RECURSIVE chain(qid, question, answer, next_b, depth) AS (
+    SELECT qid, question, answer, next_b, 0 FROM questions WHERE qid = ?
+    UNION ALL
+    SELECT q.qid, q.question, q.answer, q.next_b, chain.depth + 1
+    FROM questions q JOIN chain ON q.qid = chain.next_b
+)
+SELECT qid, question, answer FROM chain ORDER BY depth
+'''
+
+class QuestionIndex():
+    """ Head qids of every tossup and bonus chain, grouped by question_type,
+        so questions can be sampled without scanning the table.
+        Loaded on first use.
+    """
+    def __init__(self):
+        self.heads = {}
+
+    def load(self):
+        heads = {}
+        query = (QuestionTable.select(QuestionTable.qid, QuestionTable.question_type)
+                              .where(QuestionTable.prev_b.is_null())
+                              .tuples())
+        for qid, q_type in query:
+            heads.setdefault(q_type, []).append(qid)
+        self.heads = heads
+
+    def count(self, q_type):
+        """ Number of tossups, or of whole bonuses, of q_type. """
+        if not self.heads:
+            self.load()
+        return len(self.heads.get(q_type, []))
+
+    def sample(self, q_type):
+        if not self.heads:
+            self.load()
+        return random.choice(self.heads[q_type])
+
+    def chain(self, qid):
+        """ Returns (qid, question, answer) for qid and every question after it in its bonus. """
+        return QB_DB.execute_sql(CHAIN_QUERY, (qid,)).fetchall()
+
+
+QB_INDEX = QuestionIndex()
@@ -0,0 +1,101 @@
+import csv
+import os
+import time
+from bisect import bisect_left, insort
+
+import common.constants as const
+
+
+class Scoreboard():
+    """ A room's trivia scores, kept in memory as a dict of user -> score
+        and a list of (-score, user) sorted for leaderboards. Every change
+        is written through to the trivia_scores table.
+
+        Rooms whose scores reset periodically keep the time of the last
+        reset as the score of const.TIMER_USER.
+    """
+    CREATE_QUERY = ("CREATE TABLE IF NOT EXISTS trivia_scores (room VARCHAR NOT NULL, "
+                                                              "user VARCHAR NOT NULL, "
+                                                              "score NUMERIC NOT NULL, "
+                                                              "PRIMARY KEY (room, user))")
+    INCREMENT_QUERY = ("INSERT INTO trivia_scores (room, user, score) VALUES (?, ?, 1) "
+                       "ON CONFLICT (room, user) DO UPDATE SET score=score+1")
+
+    def __init__(self, db_man, room, csv_file=None):
+        self.db_man = db_man
+        self.room = room
+        self.csv_file = csv_file or os.path.join('trivia', f'{room}.txt')
+
+        self.loaded = False
+        self.scores = {}
+        self.ranking = []
+        self.reset_time = None
+
+
+    async def load(self):
+        """ Reads the room's scores, importing its old CSV scoreboard the first time. """
+        if self.loaded:
+            return
+
+        await self.db_man.execute(self.CREATE_QUERY)
+        rows = await self.db_man.execute("SELECT user, score FROM trivia_scores WHERE room=?", (self.room,))
+        if not rows:
+            rows = self.read_csv()
+            await self.db_man.insert_many('trivia_scores', ('room', 'user', 'score'),
+                                          [(self.room, user, score) for user, score in rows],
+                                          or_ignore=True)
+
+        for user, score in rows:
+            if user == const.TIMER_USER:
+                self.reset_time = score
+            else:
+                self.scores[user] = score
+        self.ranking = sorted((-score, user) for user, score in self.scores.items())
+        self.loaded = True
+
+
+    def read_csv(self):
+        try:
+            with open(self.csv_file, newline='') as f:
+                return [(r['user'], float(r['score']) if r['user'] == const.TIMER_USER else int(float(r['score'])))
+                        for r in csv.DictReader(f)]
+        except FileNotFoundError:
+            return []
+
+
+    def increment(self, user):
+        score = self.scores.get(user, 0)
+        if score:
+            del self.ranking[bisect_left(self.ranking, (-score, user))]
+        self.scores[user] = score + 1
+        insort(self.ranking, (-score - 1, user))
+
+        self.db_man.submit(self.INCREMENT_QUERY, (self.room, user))
+
+
+    def top(self, n):
+        """ Returns the n highest [user, score] pairs. """
+        return [[user, -neg_score] for neg_score, user in self.ranking[:n]]
+
+
+    def get(self, user):
+        """ Returns [user, score], or [None, None] for users without points. """
+        if user not in self.scores:
+            return [None, None]
+        return [user, self.scores[user]]
+
+
+    def reset_if_due(self, length):
+        """ Clears the scores of rooms without a reset timer, or whose
+            timer is older than length seconds.
+        """
+        if self.reset_time is not None and time.time() - self.reset_time <= length:
+            return
+
+        self.scores = {}
+        self.ranking = []
+        self.db_man.submit("DELETE FROM trivia_scores WHERE room=? AND user!=?", (self.room, const.TIMER_USER))
+        if self.reset_time is not None:
+            self.reset_time = time.time()
+            self.db_man.submit("UPDATE trivia_scores SET score=? WHERE room=? AND user=?",
+                               (self.reset_time, self.room, const.TIMER_USER))
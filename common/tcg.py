@@ -27,7 +27,7 @@ async def display_mtg_card(putter, card):
                     card_img = card_info['image_uris']['normal']
                 card_link = card_info['scryfall_uri']
 
-                img_uhtml = gen_uhtml_img_code(card_img, height_resize=200, alt=card_name)
+                img_uhtml = await gen_uhtml_img_code(card_img, height_resize=200, alt=card_name)
                 msg = f'/adduhtml hippomtg-{card}, <a href=\'{card_link}\'>{img_uhtml}</a>'
 
     await putter(f'{const.TCG_ROOM}|{msg}')
@@ -51,7 +51,7 @@ async def display_ptcg_card(putter, card):
                 card_name = card_info['name']
                 card_img = card_info['images']['small']
 
-                img_uhtml = gen_uhtml_img_code(card_img, height_resize=200, alt=card_name)
+                img_uhtml = await gen_uhtml_img_code(card_img, height_resize=200, alt=card_name)
                 msg = f'/adduhtml hippoptcg-{card}, {img_uhtml}'
 
     await putter(f'{const.TCG_ROOM}|{msg}')
@@ -72,7 +72,7 @@ async def display_ygo_card(putter, card):
                 card_name = card_info['name']
                 card_img = card_info['card_images'][0]['image_url']
 
-                img_uhtml = gen_uhtml_img_code(card_img, height_resize=200, alt=card_name)
+                img_uhtml = await gen_uhtml_img_code(card_img, height_resize=200, alt=card_name)
                 msg = f'/adduhtml hippoygo-{card}, {img_uhtml}'
 
     await putter(f'{const.TCG_ROOM}|{msg}')
\ No newline at end of file
@@ -0,0 +1,149 @@
+import ast
+import csv
+import json
+import random
+from bisect import bisect_left, insort
+from collections import deque
+
+import common.constants as const
+
+RECENT_RUNS = 5
+LENGTHS = ('short', 'medium', 'long')
+
+
+class SentenceCorpus():
+    """ The typing test sentences, held in memory and split by word count
+        into equally sized short, medium and long buckets.
+    """
+    def __init__(self, sentence_file=const.SENTENCEFILE):
+        with open(sentence_file) as f:
+            self.sentences = [line.rstrip('\n') for line in f if line.strip()]
+
+        by_length = sorted(self.sentences, key=lambda s: len(s.split(' ')))
+        size = len(by_length)
+        self.buckets = {length: by_length[i * size // len(LENGTHS):(i + 1) * size // len(LENGTHS)]
+                        for i, length in enumerate(LENGTHS)}
+
+
+    def sample(self, length=None):
+        """ Returns a random sentence, from the given length bucket if there is one. """
+        return random.choice(self.buckets.get(length) or self.sentences)
+
+
+class TypingStats():
+    """ Typing test results, loaded on first use. Each user's top speed and
+        last RECENT_RUNS runs are kept in memory, with lists of (-wpm, user)
+        kept sorted for the top speed and full recent-run averages.
+        Every change is written through to the typing_stats table.
+    """
+    CREATE_QUERY = ("CREATE TABLE IF NOT EXISTS typing_stats (user VARCHAR PRIMARY KEY, "
+                                                             "top_wpm REAL NOT NULL, "
+                                                             "recent_runs VARCHAR NOT NULL)")
+    SAVE_QUERY = "INSERT OR REPLACE INTO typing_stats (user, top_wpm, recent_runs) VALUES (?, ?, ?)"
+
+    def __init__(self, db_man, wpm_file=const.WPMFILE):
+        self.db_man = db_man
+        self.wpm_file = wpm_file
+
+        self.loaded = False
+        self.top = {}
+        self.runs = {}
+        self.top_index = []
+        self.avg_index = []
+
+
+    async def load(self):
+        """ Reads the stored results, importing the old wpm file the first time. """
+        if self.loaded:
+            return
+
+        await self.db_man.execute(self.CREATE_QUERY)
+        rows = await self.db_man.execute("SELECT user, top_wpm, recent_runs FROM typing_stats")
+        if rows:
+            rows = [(user, top_wpm, json.loads(runs)) for user, top_wpm, runs in rows]
+        else:
+            rows = self.read_wpm_file()
+            await self.db_man.executemany(self.SAVE_QUERY,
+                                          [(user, top_wpm, json.dumps(runs)) for user, top_wpm, runs in rows])
+
+        for user, top_wpm, runs in rows:
+            self.top[user] = top_wpm
+            self.runs[user] = deque(runs, maxlen=RECENT_RUNS)
+        self.top_index = sorted((-top_wpm, user) for user, top_wpm in self.top.items())
+        self.avg_index = sorted((-self.average(user), user) for user in self.runs
+                                if len(self.runs[user]) == RECENT_RUNS)
+        self.loaded = True
+
+
+    def read_wpm_file(self):
+        try:
+            with open(self.wpm_file, newline='') as f:
+                return [(r['user'], float(r['top_wpm']), ast.literal_eval(r['recent_runs']))
+                        for r in csv.DictReader(f)]
+        except FileNotFoundError:
+            return []
+
+
+    def average(self, user):
+        runs = self.runs[user]
+        return round(sum(runs) / len(runs), 1) if runs else 0
+
+
+    def unindex(self, user):
+        if user not in self.top:
+            return
+        del self.top_index[bisect_left(self.top_index, (-self.top[user], user))]
+        if len(self.runs[user]) == RECENT_RUNS:
+            del self.avg_index[bisect_left(self.avg_index, (-self.average(user), user))]
+
+
+    def index(self, user):
+        insort(self.top_index, (-self.top[user], user))
+        if len(self.runs[user]) == RECENT_RUNS:
+            insort(self.avg_index, (-self.average(user), user))
+
+        self.db_man.submit(self.SAVE_QUERY, (user, self.top[user], json.dumps(list(self.runs[user]))))
+
+
+    async def get(self, user):
+        """ Returns (top wpm, recent average, number of recent runs), or None
+            if the user has not taken a typing test.
+        """
+        await self.load()
+        if user not in self.top:
+            return None
+        return self.top[user], self.average(user), len(self.runs[user])
+
+
+    async def record(self, user, speed):
+        """ Adds a run. Returns the user's previous top wpm, or None for a first run. """
+        await self.load()
+        previous = self.top.get(user)
+
+        self.unindex(user)
+        self.top[user] = max(speed, previous or 0)
+        self.runs.setdefault(user, deque(maxlen=RECENT_RUNS)).append(speed)
+        self.index(user)
+
+        return previous
+
+
+    async def reset(self, user):
+        """ Sets a user's top speed to 0 and clears their recent runs. """
+        await self.load()
+        if user not in self.top:
+            return
+
+        self.unindex(user)
+        self.top[user] = 0
+        self.runs[user].clear()
+        self.index(user)
+
+
+    async def leaderboard(self, single=False, n=5):
+        """ Returns the n fastest [user, wpm] pairs, by top speed if single,
+            otherwise by the average of users with RECENT_RUNS recent runs.
+        """
+        await self.load()
+        ranking = self.top_index if single else self.avg_index
+        return [[user, -neg_wpm] for neg_wpm, user in ranking[:n]]
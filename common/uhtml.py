@@ -2,7 +2,7 @@ import json
 
 from airium import Airium
 
-from common.utils import img_dims_from_uri, sanitize_html
+from common.utils import sanitize_html
 
 SHOWCASE_BORDER_1 = 'https://i.imgur.com/auG4Q2a.png'
 
@@ -319,8 +319,8 @@ class ItemInfo(InfoBox):
 
                         if gacha == 'fgo':
                             img_width = (img_height * 512 // 724)
-                        else:
-                            base_img_dims = img_dims_from_uri(img)
+                        elif kwargs.get('img_dims') and kwargs['img_dims'][i][1]:
+                            base_img_dims = kwargs['img_dims'][i]
                             img_width = img_height * base_img_dims[0] // base_img_dims[1]
 
                         with self.html.td(style='padding:5px'):
@@ -1,12 +1,22 @@
+import aiohttp
 import asyncio
 import datetime
+import json
+import math
+import os
+import random
 import re
-import urllib.request
+import time
 
-from io import BytesIO
-from PIL import Image
+from collections import OrderedDict
+from PIL import ImageFile
+from statistics import NormalDist
 
-from common.constants import IMG_NOT_FOUND
+from common.constants import IMGDIMSFILE, IMG_NOT_FOUND
+
+# Bytes read per chunk / at most when probing an image header.
+IMG_HEADER_CHUNK = 1024
+IMG_HEADER_MAX = 256 * 1024
 
 
 def is_uhtml(text):
@@ -19,42 +29,198 @@ def find_true_name(text):
     return re.sub(r'[^a-zA-Z0-9]', '', text).lower()
 
 
-def img_dims_from_uri(uri):
+class ImgDimsCache():
+    """ Persistent URL -> (width, height) cache with TTL and LRU eviction.
+        Misses are resolved by reading only the start of the image.
+        With no cache_file, the cache is kept in memory only.
+    """
+    def __init__(self, cache_file, ttl=60*60*24*30, max_size=5000, save_delay=30):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.max_size = max_size
+        self.save_delay = save_delay
+
+        # url -> (width, height, time fetched), least recently used first.
+        self.dims = OrderedDict()
+        self.pending = {}
+        self.save_handle = None
+        self.session = None
+
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file) as f:
+                for url, entry in json.load(f).items():
+                    self.dims[url] = tuple(entry)
+        except (OSError, ValueError):
+            pass
+
+
+    def get(self, url):
+        entry = self.dims.get(url)
+        if not entry:
+            return None
+
+        if time.time() - entry[2] > self.ttl:
+            del self.dims[url]
+            return None
+
+        self.dims.move_to_end(url)
+        return entry[:2]
+
+
+    def set(self, url, dims):
+        self.dims[url] = (dims[0], dims[1], int(time.time()))
+        self.dims.move_to_end(url)
+        while len(self.dims) > self.max_size:
+            self.dims.popitem(last=False)
+
+        if self.cache_file and not self.save_handle:
+            loop = asyncio.get_running_loop()
+            self.save_handle = loop.call_later(self.save_delay, self.save)
+
+
+    def save(self):
+        self.save_handle = None
+        tmp_file = f'{self.cache_file}.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.dims, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            print(f'Could not save image dims cache: {e}')
+
+
+    def flush(self):
+        """ Saves a pending change right away instead of after save_delay, for shutdown. """
+        if self.save_handle:
+            self.save_handle.cancel()
+            self.save()
+
+
+    def close(self):
+        """ Closes the HTTP session used for probing, for shutdown. """
+        if not self.session or self.session.closed:
+            return
+
+        session, self.session = self.session, None
+        loop = asyncio.get_event_loop()
+        if loop.is_running():
+            loop.create_task(session.close())
+        else:
+            loop.run_until_complete(session.close())
+
+
+    def client(self):
+        if not self.session or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        return self.session
+
+
+    async def resolve(self, url):
+        """ Returns (width, height) of the image at url, or (0, 0).
+            Concurrent lookups of the same url share one request.
+        """
+        dims = self.get(url)
+        if dims:
+            return dims
+
+        task = self.pending.get(url)
+        if not task:
+            task = asyncio.create_task(self.probe(url))
+            self.pending[url] = task
+            task.add_done_callback(lambda _: self.pending.pop(url, None))
+
+        return await asyncio.shield(task)
+
+
+    async def probe(self, url):
+        dims = (0, 0)
+        parser = ImageFile.Parser()
+        # Servers that ignore Range just get their stream cut short.
+        headers = {'Range': f'bytes=0-{IMG_HEADER_MAX - 1}'}
+
+        try:
+            async with self.client().get(url, headers=headers) as r:
+                if r.status not in (200, 206):
+                    raise ValueError(f'{url} returned code {r.status}')
+
+                read = 0
+                async for chunk in r.content.iter_chunked(IMG_HEADER_CHUNK):
+                    parser.feed(chunk)
+                    read += len(chunk)
+                    if parser.image or read >= IMG_HEADER_MAX:
+                        break
+
+            if parser.image:
+                dims = parser.image.size
+        except Exception as e:
+            print(e)
+
+        if dims[0] and dims[1]:
+            self.set(url, dims)
+
+        return dims
+
+
+IMG_DIMS = ImgDimsCache(IMGDIMSFILE)
+
+
+async def img_dims_from_uri(uri):
     """ Gets img dimensions from a URL.
         If it fails, returns (0, 0).
     """
     # Returns width, height
-    dims = (0, 0)
-    try:
-        file = BytesIO(urllib.request.urlopen(uri, timeout=10).read())
-        im = Image.open(file)
-        dims = im.size
-    except Exception as e:
-        print(e)
+    return await IMG_DIMS.resolve(uri)
+
+
+def truncated_gauss(mu, sigma, low, high):
+    """ Samples a normal distribution restricted to [low, high) in one draw,
+        by inverting its CDF over that range. A sigma of 0 or less gives mu,
+        clamped to the range.
+    """
+    if sigma <= 0:
+        return min(max(mu, low), math.nextafter(high, low))
+
+    dist = NormalDist(mu, sigma)
+    p_low, p_high = dist.cdf(low), dist.cdf(high)
+    # Range lies too far out in a tail for float precision
+    if p_high - p_low < 1e-12:
+        return low if mu < low else math.nextafter(high, low)
+
+    p = random.uniform(p_low, p_high)
+    x = dist.inv_cdf(min(max(p, 1e-300), 1 - 1e-16))
+    return min(max(x, low), math.nextafter(high, low))
+
+
+def resize_dims(dims, height_resize=300, width_resize=None):
+    """ Scales (width, height) down to fit the given bounds. """
+    w, h = dims
+    if h > height_resize:
+        w = w * height_resize // h
+        h = height_resize
+
+    if width_resize:
+        if w > width_resize:
+            h = h * width_resize // w
+            w = width_resize
 
-    return dims
+    return w, h
 
 
-def gen_uhtml_img_code(url, height_resize=300, width_resize=None,
-                       dims=None, center=True, **kwargs):
+async def gen_uhtml_img_code(url, height_resize=300, width_resize=None,
+                             dims=None, center=True, **kwargs):
     """ Generates basic HTML code for an img tag from a URL. """
     w, h = (0, 0)
     if dims:
         w, h = dims
     else:
-        w, h = img_dims_from_uri(url)
+        w, h = await img_dims_from_uri(url)
         if not w or not h:
-            w, h = img_dims_from_uri(IMG_NOT_FOUND)
+            w, h = await img_dims_from_uri(IMG_NOT_FOUND)
             url = IMG_NOT_FOUND
 
-        if h > height_resize:
-            w = w * height_resize // h
-            h = height_resize
-        
-        if width_resize:
-            if w > width_resize:
-                h = h * width_resize // w
-                w = width_resize
+        w, h = resize_dims((w, h), height_resize, width_resize)
 
     kwarg_opts = ''
     for k in kwargs:
@@ -136,14 +302,14 @@ async def birthday_text(bot, automatic, room):
     today = datetime.datetime.today().strftime('%B %d').replace(' 0', ' ')
     short_today = datetime.datetime.today().strftime('%b %d').replace(' 0', ' ')
     birthday_chars = await bot.roomdata_man.execute("SELECT name, image, link FROM birthdays "
-                                                    f"WHERE day='{today}' AND room='{room}'")
+                                                    "WHERE day=? AND room=?", (today, room))
 
     if not birthday_chars:
         if not automatic:
             return 'No known birthdays today! Get a staff to add some with ]birthday_add!'
         return
 
-    char_uhtml = bot.birthday_chars_to_uhtml(birthday_chars)
+    char_uhtml = await bot.birthday_chars_to_uhtml(birthday_chars)
 
     tomorrow_uhtml = ''
     curr_year = datetime.datetime.today().year
@@ -155,8 +321,8 @@ async def birthday_text(bot, automatic, room):
     if today == 'February 28' and (curr_year % 4 != 0 or curr_year % 100 == 0):
         tomorrow_uhtml = '<tr><td colspan=10><b><center>(Feb 29)</center></b></td></tr>'
         tomorrow_chars = await bot.roomdata_man.execute("SELECT name, image, link FROM birthdays "
-                                                       f"WHERE day='February 29' AND room='{room}'")
-        tomorrow_uhtml += bot.birthday_chars_to_uhtml(tomorrow_chars)
+                                                        "WHERE day='February 29' AND room=?", (room,))
+        tomorrow_uhtml += await bot.birthday_chars_to_uhtml(tomorrow_chars)
 
     uhtml = (f'<div style=\'{max_scroll}\'>'
                 '<center><table style=\'border:3px solid #0088cc; border-spacing:0px; '
@@ -1,25 +1,26 @@
+import asyncio
+import heapq
 import json
 import peewee
 import random
-import requests
 
 from datetime import datetime
-from peewee import EnclosedNodeList, Tuple, ValuesList
 
 import common.constants as const
 
-from common.gacha_db import PlayerAccInfoTable, PlayerBoxTable
+from common.gacha_db import GACHA_DB, GrantTable, PlayerAccInfoTable, PlayerUnitTable, insert_units
 from common.gacha_db import AllGachasTable, PadTable, FgoTable
 from common.uhtml import ItemInfo, UserInfo
-from common.utils import gen_uhtml_img_code, monospace_table_row
+from common.utils import gen_uhtml_img_code, img_dims_from_uri, monospace_table_row
 
 HOURLY_ROLLS = 3
+HOUR = 60 * 60
 MERGE_COUNT = 2
 
-def unit_uhtml(unit, pm=False):
+async def unit_uhtml(unit, pm=False):
     """ Generates the uhtml for a unit. """
     img_url = json.loads(unit.img_url_pv)[-1]
-    img_uhtml = gen_uhtml_img_code(img_url, height_resize=40, center=False,
+    img_uhtml = await gen_uhtml_img_code(img_url, height_resize=40, center=False,
                                    alt=f'\'{unit.name}\'')
 
     all_uhtml = ('<span style=\'padding: 1px\'>'
@@ -29,11 +30,13 @@ def unit_uhtml(unit, pm=False):
     return all_uhtml
 
 
-def roll_uhtml(user, gacha, pulls, pm=False):
+async def roll_uhtml(user, gacha, pulls, pm=False):
     """ Generates the uhtml for a set of rolls. """
+    unit_uhtmls = await asyncio.gather(*[unit_uhtml(u) for u in pulls])
+
     images_uhtml = ''
-    for i, u in enumerate(pulls):
-        images_uhtml += unit_uhtml(u)
+    for i, u in enumerate(unit_uhtmls):
+        images_uhtml += u
 
         if i > 0 and i % 5 == 4:
             images_uhtml += '<br>'
@@ -45,10 +48,11 @@ def roll_uhtml(user, gacha, pulls, pm=False):
 
 
 def box_output(box):
-    """ Formats a query from PlayerBoxTable that
+    """ Formats a query from PlayerUnitTable that
         represents a user's owned units.
+
+        Returns (header, lines) of a monospace table.
     """
-    box_text = ''
     header_text = monospace_table_row([('ID', 5),
                                        ('Name', 40),
                                        ('Gacha', 5),
@@ -56,31 +60,67 @@ def box_output(box):
                                        ('Fav.', 4),
                                        ('Showcase', 8)])
     header_text += '\n' + '-'*85
+
+    lines = []
     for u in box:
         fav = 'Yes' if u.favorited else 'No'
         showcase = u.showcase if u.showcase else 'No'
 
-        box_text += monospace_table_row([(u.id, 5),
-                                         (u.name, 40),
-                                         (u.gacha.upper(), 5),
-                                         (f'Lvl {u.unit_level}', 7),
-                                         (fav, 4),
-                                         (showcase, 8)])
-        box_text += '\n'
+        lines.append(monospace_table_row([(u.id, 5),
+                                          (u.name, 40),
+                                          (u.gacha.upper(), 5),
+                                          (f'Lvl {u.unit_level}', 7),
+                                          (fav, 4),
+                                          (showcase, 8)]))
 
-    if not box_text:
-        box_text = 'Currently empty...'
+    if not lines:
+        lines = ['Currently empty...']
 
-    all_text = f'{header_text}\n{box_text}'
+    return header_text, lines
 
-    r = requests.post(const.PASTIE_API, data=all_text)
 
-    msg = 'Could not generate box. Please try again later.'
-    if r.status_code == 200:
-        url = json.loads(r.text)['key']
-        msg = f'https://pastie.io/raw/{url}'
+def plan_merge(units, mergeable):
+    """ Plans merges in one pass over units, as (id, gacha, unit_id) tuples.
+        Every MERGE_COUNT copies of a unit merge into its next ascension,
+        and the results can merge again with copies already at that ascension.
 
-    return msg
+        Returns ({gacha: [unit_ids to add]}, [ids to delete]).
+    """
+    owned = {}
+    for uid, gacha, unit_id in units:
+        owned.setdefault((gacha, unit_id), []).append(uid)
+
+    # Lower ascensions are planned first, so merge results are counted
+    # before their own ascension is planned.
+    heap = list(owned)
+    heapq.heapify(heap)
+    queued = set(heap)
+    created = {}
+
+    to_add = {}
+    to_delete = []
+    while heap:
+        gacha, unit_id = key = heapq.heappop(heap)
+        new_units = created.pop(key, 0)
+        box_units = owned.get(key, [])
+
+        merges = (new_units + len(box_units)) // MERGE_COUNT
+        if not merges or not mergeable(gacha, unit_id):
+            merges = 0
+
+        # Merge results are used up first, so they never reach the box.
+        used = merges * MERGE_COUNT
+        to_delete += box_units[:max(0, used - new_units)]
+        to_add.setdefault(gacha, []).extend([unit_id] * max(0, new_units - used))
+
+        if merges:
+            next_key = (gacha, round(unit_id + 0.1, 1))
+            created[next_key] = created.get(next_key, 0) + merges
+            if next_key not in queued:
+                heapq.heappush(heap, next_key)
+                queued.add(next_key)
+
+    return {g: uids for g, uids in to_add.items() if uids}, to_delete
 
 
 class GachaManager:
@@ -93,6 +133,11 @@ class GachaManager:
             print(e)
             pass
 
+        try:
+            GACHA_DB.create_tables([PlayerUnitTable, GrantTable], safe=True)
+        except peewee.OperationalError as e:
+            print(e)
+
         self.gachas = {}
         for g in gachas:
             self.gachas[g] = Gacha(g)
@@ -103,9 +148,6 @@ class GachaManager:
     def player_add(self, username):
         PlayerAccInfoTable.create(username=username)
 
-        player_box = type(username, (PlayerBoxTable,), {})
-        player_box.create_table()
-
 
     def player_check(self, username):
         q = PlayerAccInfoTable.select().where(PlayerAccInfoTable.username == username)
@@ -121,11 +163,13 @@ class GachaManager:
         return q[0]
 
 
-    def profile(self, username):
+    async def profile(self, username):
         player = self.player_info(username)
-        box = type(username, (PlayerBoxTable,), {})
+        pu = PlayerUnitTable
 
-        showcases = box.select().where(box.showcase > 0).order_by(box.showcase.asc())
+        showcases = (pu.select()
+                       .where((pu.username == username) & (pu.showcase > 0))
+                       .order_by(pu.showcase.asc()))
         sc_infos = [(const.BLANK_IMG, '', '', 1)] * 5
         for i, sc in enumerate(showcases):
             sc_infos[i] = (sc.full_img, sc.name, sc.unit_url, sc.gacha)
@@ -139,10 +183,10 @@ class GachaManager:
             img_style = '"border-radius:5px; border: 1px solid #FFD700"'
             if info[3] == 'fgo':
                 img_width = (img_height * 512 // 724)
-                img_uhtml = gen_uhtml_img_code(info[0], dims=(img_width, img_height),
+                img_uhtml = await gen_uhtml_img_code(info[0], dims=(img_width, img_height),
                                                alt=info[1], style=img_style)
             else:
-                img_uhtml = gen_uhtml_img_code(info[0], height_resize=img_height,
+                img_uhtml = await gen_uhtml_img_code(info[0], height_resize=img_height,
                                                alt=info[1], style=img_style)
 
             sc_kwargs = {'is_first': is_first,
@@ -160,144 +204,119 @@ class GachaManager:
 
 
     def player_box(self, username):
-        pb = type(username, (PlayerBoxTable,), {})
-        box = pb.select().order_by(pb.favorited.desc(), pb.unit_level.desc(), pb.unit_id.asc())
+        pu = PlayerUnitTable
+        box = (pu.select()
+                 .where(pu.username == username)
+                 .order_by(pu.favorited.desc(), pu.unit_level.desc(), pu.unit_id.asc()))
         return box_output(box)
 
 
-    def add_rolls(self):
-        q = (PlayerAccInfoTable
-                .update({PlayerAccInfoTable.roll_currency:
-                            PlayerAccInfoTable.roll_currency + HOURLY_ROLLS}))
-        q.execute()
+    def grant_hourly(self, now):
+        """ Gives every player HOURLY_ROLLS for each hour since the last grant,
+            including hours missed while the bot was down. The grant time is
+            saved in the same transaction, so no hour is granted twice.
 
-
-    def roll(self, username, gacha, num_rolls=1):
+            Returns (hours granted, players updated).
+        """
+        hour = int(now) // HOUR * HOUR
+        try:
+            with GACHA_DB.atomic():
+                grant = GrantTable.get_or_none(GrantTable.name == 'hourly')
+                if grant is None:
+                    grant = GrantTable(name='hourly', last_grant=hour - HOUR)
+                    grant.save(force_insert=True)
+
+                hours = (hour - grant.last_grant) // HOUR
+                if hours <= 0:
+                    return 0, 0
+
+                rows = (PlayerAccInfoTable
+                           .update({PlayerAccInfoTable.roll_currency:
+                                       PlayerAccInfoTable.roll_currency + HOURLY_ROLLS * hours})
+                           .execute())
+                grant.last_grant = hour
+                grant.save()
+        except peewee.PeeweeException as e:
+            print(f'Hourly gacha grant failed: {e}')
+            return 0, 0
+
+        return hours, rows
+
+
+    async def roll(self, username, gacha, num_rolls=1):
         pulls = self.gachas[gacha].roll(username, num_rolls=num_rolls)
         if pulls:
-            return roll_uhtml(username, gacha, pulls)
+            return await roll_uhtml(username, gacha, pulls)
         else:
             return
 
 
     def favorite(self, username, ids):
-        pb = type(username, (PlayerBoxTable,), {})
-        return (pb.update(favorited=True)
-                  .where((pb.id << ids) & ~pb.favorited)
+        pu = PlayerUnitTable
+        return (pu.update(favorited=True)
+                  .where((pu.username == username) & (pu.id << ids) & ~pu.favorited)
                   .execute())
 
 
     def unfavorite(self, username, ids):
-        pb = type(username, (PlayerBoxTable,), {})
-        return (pb.update(favorited=False)
-                  .where((pb.id << ids) & pb.favorited)
+        pu = PlayerUnitTable
+        return (pu.update(favorited=False)
+                  .where((pu.username == username) & (pu.id << ids) & pu.favorited)
                   .execute())
 
 
     def showcase(self, username, uid, place):
-        pb = type(username, (PlayerBoxTable,), {})
-        exists = (pb.select()
-                    .where(pb.showcase == place))
+        pu = PlayerUnitTable
+        exists = (pu.select()
+                    .where((pu.username == username) & (pu.showcase == place)))
         if exists:
             if exists[0].id != uid:
                 self.unshowcase(username, exists[0].id)
 
-        return (pb.update(favorited=True, showcase=place)
-                  .where(pb.id == uid)
+        return (pu.update(favorited=True, showcase=place)
+                  .where((pu.username == username) & (pu.id == uid))
                   .execute())
 
 
     def unshowcase(self, username, uid):
-        pb = type(username, (PlayerBoxTable,), {})
-        return (pb.update(showcase=0)
-                  .where((pb.id == uid) & pb.showcase)
+        pu = PlayerUnitTable
+        return (pu.update(showcase=0)
+                  .where((pu.username == username) & (pu.id == uid) & pu.showcase)
                   .execute())
 
 
-    def can_merge(self, username, ids=None):
-        pb = type(username, (PlayerBoxTable,), {})
-
-        unit_id_rows = None
-        if ids:
-            unit_id_rows = (pb.select(pb.gacha, pb.unit_id)
-                              .where(~pb.favorited & (pb.id << ids))
-                              .group_by(pb.gacha, pb.unit_id)
-                              .having(peewee.fn.COUNT(pb.unit_id) >= MERGE_COUNT))
-        else:
-            unit_id_rows = (pb.select(pb.gacha, pb.unit_id)
-                              .where(~pb.favorited)
-                              .group_by(pb.gacha, pb.unit_id)
-                              .having(peewee.fn.COUNT(pb.unit_id) >= MERGE_COUNT))
-
-        valid_units = []
-        for uir in unit_id_rows:
-            if not str(uir.unit_id).endswith('4'):
-                valid_units.append((uir.gacha, uir.unit_id))
-
-        if not valid_units:
-            return
-        vl = ValuesList(valid_units)
-        return EnclosedNodeList([vl])
+    def mergeable(self, gacha, unit_id):
+        """ Whether a unit has a next ascension to merge into. """
+        if gacha not in self.gachas or str(unit_id).endswith('4'):
+            return False
+        return round(unit_id + 0.1, 1) in self.gachas[gacha].pool_units()
 
 
     def merge(self, username, ids=None):
-        pb = type(username, (PlayerBoxTable,), {})
+        pu = PlayerUnitTable
 
-        valid_units = self.can_merge(username, ids)
+        query = pu.select(pu.id, pu.gacha, pu.unit_id).where((pu.username == username) & ~pu.favorited)
+        if ids:
+            query = query.where(pu.id << ids)
+        units = list(query.order_by(pu.unit_id, pu.id).tuples())
 
-        if not valid_units:
+        to_add, to_delete = plan_merge(units, self.mergeable)
+        if not to_delete:
             return 0
 
-        if ids:
-            to_merge = (pb.select()
-                          .where((Tuple(pb.gacha, pb.unit_id).in_(valid_units)) &
-                                 (pb.id << ids))
-                          .order_by(pb.unit_id))
-        else:
-            to_merge = (pb.select()
-                          .where(Tuple(pb.gacha, pb.unit_id).in_(valid_units))
-                          .order_by(pb.unit_id))
-
-        grouped_units = {}
-        curr_unit = []
-        curr_id = None
-        for row in to_merge:
-            if row.gacha not in grouped_units:
-                grouped_units[row.gacha] = {}
-
-            if curr_id != (row.gacha, row.unit_id):
-                if curr_unit:
-                    grouped_units[curr_id[0]][curr_id[1]] = curr_unit
-                curr_unit = []
-                curr_id = (row.gacha, row.unit_id)
-
-            curr_unit.append(row)
-
-        if curr_unit:
-            grouped_units[curr_id[0]][curr_id[1]] = curr_unit
-
-        to_add = {}
-        to_delete = []
-        for gacha in grouped_units:
-            to_add[gacha] = []
-
-            for uid in grouped_units[gacha]:
-                num_merged = len(grouped_units[gacha][uid]) // MERGE_COUNT
-                to_add[gacha] += [round(uid + 0.1, 1)] * num_merged
-                for u in grouped_units[gacha][uid][:(num_merged * MERGE_COUNT)]:
-                    to_delete.append((gacha, u.id))
-        
         add_query = []
         for gacha in to_add:
             add_query += self.gachas[gacha].gen_unit_infos(to_add[gacha])
 
-        delete_query = EnclosedNodeList([ValuesList(to_delete)])
+        with GACHA_DB.atomic():
+            insert_units(username, add_query)
+            for batch in peewee.chunked(to_delete, 500):
+                pu.delete().where((pu.username == username) & (pu.id << batch)).execute()
 
-        pb.insert_many(add_query).execute()
-        return pb.delete().where(Tuple(pb.gacha, pb.id).in_(delete_query)).execute()
+        return len(to_delete)
 
 
-    def show_unit_info(self, gacha, unit_name):
+    async def show_unit_info(self, gacha, unit_name):
         if gacha not in self.gachas:
             return
 
@@ -305,14 +324,57 @@ class GachaManager:
         if not unit:
             return
 
+        img_dims = None
+        if gacha != 'fgo':
+            img_urls = json.loads(unit.img_url_full)
+            img_dims = await asyncio.gather(*[img_dims_from_uri(img) for img in img_urls])
+
         unit_info = ItemInfo(unit.name, unit.unit_url, 'steam')
-        return unit_info.gacha_unit(gacha=gacha, unit=unit)
+        return unit_info.gacha_unit(gacha=gacha, unit=unit, img_dims=img_dims)
 
 
     def change_full_art(self, username, unique_id, art_idx):
-        pb = type(username, (PlayerBoxTable,), {})
+        pu = PlayerUnitTable
+
+        #pu.select().where()
+
+
+class AliasTable:
+    """ Vose's alias method: after an O(n) build, each draw from the
+        weighted items takes one uniform index and one coin flip.
+    """
+    def __init__(self, items, weights):
+        self.items = list(items)
+        n = len(self.items)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] += scaled[s] - 1
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+
 
-        #pb.select().where()
+    def sample(self, k=1):
+        n = len(self.items)
+        pulls = []
+        for _ in range(k):
+            i = random.randrange(n)
+            if random.random() >= self.prob[i]:
+                i = self.alias[i]
+            pulls.append(self.items[i])
+
+        return pulls
 
 
 class Gacha:
@@ -325,6 +387,10 @@ class Gacha:
         elif franchise == 'pad':
             self.table = PadTable
 
+        self.sampler = None
+        self.unit_dicts = {}
+        self.data_version = None
+
 
     def search_units(self, unit_name):
         name_search = self.table.select().where(self.table.name.contains(unit_name))
@@ -355,18 +421,28 @@ class Gacha:
 
 
     def gen_unit_infos(self, unit_ids):
-        to_box = []
-        unit_infos = self.table.select().where(self.table.unit_id << unit_ids)
-        for uid in unit_ids:
-            unit = None
-            for info in unit_infos:
-                if info.unit_id == uid:
-                    unit = info
-                    break
+        unit_dicts = self.pool_units()
+        return [unit_dicts[uid] for uid in unit_ids]
+
+
+    def pool(self):
+        """ Returns the alias table of the gacha's units, rebuilt
+            only when the gacha database has changed.
+        """
+        data_version = GACHA_DB.execute_sql('PRAGMA data_version').fetchone()[0]
+        if self.sampler is None or data_version != self.data_version:
+            units = list(self.table.select())
+            self.sampler = AliasTable(units, [u.base_pull_rate for u in units])
+            self.unit_dicts = {u.unit_id: self.unit_dict(u) for u in units}
+            self.data_version = data_version
+
+        return self.sampler
 
-            to_box.append(self.unit_dict(unit))
-        
-        return to_box
+
+    def pool_units(self):
+        """ Returns the box rows of the gacha's units, by unit_id. """
+        self.pool()
+        return self.unit_dicts
 
 
     def roll(self, username, num_rolls=1):
@@ -376,22 +452,10 @@ class Gacha:
         if user_rolls < num_rolls:
             return
 
-        pool = self.table.select()
-
-        weights = []
-        for u in pool:
-            weights.append(u.base_pull_rate)
-
-        pulls = random.choices(pool, weights=weights, k=num_rolls)
-
-        to_box = []
-        for p in pulls:
-            img_url_pvs = json.loads(p.img_url_pv)
-            img_url_fulls = json.loads(p.img_url_full)
-            to_box.append(self.unit_dict(p))
+        pulls = self.pool().sample(num_rolls)
+        to_box = [self.unit_dicts[p.unit_id] for p in pulls]
 
-        player_box = type(username, (PlayerBoxTable,), {})
-        player_box.insert_many(to_box).execute()
+        insert_units(username, to_box)
 
         new_rolls = user_rolls - num_rolls
         (PlayerAccInfoTable
@@ -399,4 +463,4 @@ class Gacha:
             .where(PlayerAccInfoTable.username == username)
             .execute())
 
-        return pulls
\ No newline at end of file
+        return pulls
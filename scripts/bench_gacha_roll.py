@@ -0,0 +1,67 @@
+"""Compares rebuilding weights for random.choices against gacha.AliasTable on 10-pulls.
+
+Usage: python scripts/bench_gacha_roll.py [-u UNITS] [-n ROLLS]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from gacha import AliasTable
+
+PULLS = 10
+# Rough shape of a gacha pool: many common units and a few rare ones.
+RATES = [(0.4, 40), (0.12, 30), (0.03, 20), (0.01, 10)]
+
+
+class Unit:
+    def __init__(self, unit_id, base_pull_rate):
+        self.unit_id = unit_id
+        self.base_pull_rate = base_pull_rate
+
+
+def gen_pool(n):
+    rates, weights = zip(*RATES)
+    return [Unit(i, random.choices(rates, weights=weights)[0]) for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--units', type=int, default=2000)
+    parser.add_argument('-n', '--rolls', type=int, default=20000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    pool = gen_pool(args.units)
+
+    def roll_old():
+        weights = []
+        for u in pool:
+            weights.append(u.base_pull_rate)
+        return random.choices(pool, weights=weights, k=PULLS)
+
+    build = timeit.timeit(lambda: AliasTable(pool, [u.base_pull_rate for u in pool]), number=10) / 10
+    table = AliasTable(pool, [u.base_pull_rate for u in pool])
+
+    old = timeit.timeit(roll_old, number=args.rolls)
+    new = timeit.timeit(lambda: table.sample(PULLS), number=args.rolls)
+    print(f'{args.units} units, {PULLS}-pulls: random.choices {args.rolls / old:,.0f} rolls/s, '
+          f'AliasTable {args.rolls / new:,.0f} rolls/s ({old / new:.1f}x), '
+          f'table build {build * 1e3:.2f} ms')
+
+    # The sampled distribution should match the pull rates.
+    total = sum(u.base_pull_rate for u in pool)
+    expected = Counter()
+    for u in pool:
+        expected[u.base_pull_rate] += u.base_pull_rate / total
+    counts = Counter(u.base_pull_rate for u in table.sample(args.rolls * PULLS))
+    for rate, share in sorted(expected.items()):
+        print(f'rate {rate}: expected {share:.3f}, sampled {counts[rate] / (args.rolls * PULLS):.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Compares trivia.check_answer against CompiledAnswerSet on a burst of guesses.
+
+Usage: python scripts/bench_trivia_answers.py [-n GUESSES] [-r REPEATS]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from trivia import CompiledAnswerSet, check_answer
+
+ANSWERS = ['Shingeki no Kyojin: The Final Season',
+           'Attack on Titan: Final Season',
+           'Shingeki no Kyojin: The Final Season']
+
+CHAT = ['lol', 'no idea', 'is it snk?', 'attack on titan', 'shingeki',
+        'the final season', 'Mahou Shoujo Madoka Magica', 'aot s4',
+        'this one is hard', 'Shingeki no Kyojin', 'kyojin', 'titan :(',
+        'what is this?', 'bleach', 'Fullmetal Alchemist: Brotherhood']
+
+
+def gen_guesses(n):
+    guesses = [random.choice(CHAT) for _ in range(n)]
+    # A few correct answers show up at the end of the burst.
+    guesses[-1] = 'Attack on Titan'
+    return guesses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--guesses', type=int, default=1000)
+    parser.add_argument('-r', '--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    guesses = gen_guesses(args.guesses)
+
+    for exact in (False, True):
+        compiled = CompiledAnswerSet(ANSWERS)
+        for g in guesses:
+            assert bool(check_answer(g, ANSWERS, exact=exact)) == bool(compiled.match(g, exact=exact))
+
+        def run_old():
+            return [check_answer(g, ANSWERS, exact=exact) for g in guesses]
+
+        def run_new():
+            # Building the set is part of the cost of a question.
+            answer_set = CompiledAnswerSet(ANSWERS)
+            return [answer_set.match(g, exact=exact) for g in guesses]
+
+        old = timeit.timeit(run_old, number=args.repeats)
+        new = timeit.timeit(run_new, number=args.repeats)
+
+        per_old = old / (args.repeats * len(guesses)) * 1e6
+        per_new = new / (args.repeats * len(guesses)) * 1e6
+        print(f'exact={exact}: check_answer {per_old:.2f} us/guess, '
+              f'CompiledAnswerSet {per_new:.2f} us/guess ({old / new:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,24 +2,94 @@ import aiohttp
 import asyncio
 import json
 import math
-import pandas as pd
 import random
 import re
-import requests
 import time
 
-from peewee import fn
-
 import common.constants as const
 
 from common.anilist import anilist_num_entries
-from common.qbowl_db import QuestionTable
-from common.utils import find_true_name, gen_uhtml_img_code, leaderboard_uhtml
+from common.outgoing import HIGH
+from common.qbowl_db import QB_INDEX
+from common.scoreboard import Scoreboard
+from common.utils import find_true_name, gen_uhtml_img_code, leaderboard_uhtml, resize_dims, truncated_gauss
 
 BASE_DIFF = 3
 VG_DIFF_SCALE = 300
+# Ranks drawn before falling back to a uniform pick among unused games.
+VG_MAX_DRAWS = 20
 UHTML_NAME = 'trivia'
 PIC_SIZE = 225
+INTERMISSION = 5
+# Number of questions kept generated ahead of the running game.
+LOOKAHEAD = 3
+# Questions generated concurrently per room. Rooms not listed generate one at a time.
+SOURCE_CONCURRENCY = {const.ANIME_ROOM: 3, const.LEAGUE_ROOM: 2}
+DEX_CONCURRENCY = 2
+
+# Quizbowl questions are revealed at a fixed pace in words, while the box is
+# edited at most once per frame, and less often when outgoing messages back up.
+REVEAL_WORD_TIME = 0.3
+REVEAL_FRAME_TIME = 0.9
+REVEAL_MAX_FRAME_TIME = 3
+CLAUSE_ENDS = ('.', ',', ';', ':')
+
+ALNUM_CHUNKS = re.compile('([a-zA-Z0-9]+)')
+
+
+def reveal_cut(words, shown, target):
+    '''
+    Picks how many words of a quizbowl question to show next.
+
+    Args:
+        words (list): words of the question
+        shown (int): number of words already shown
+        target (int): number of words due by now
+
+    Returns:
+        int: the end of the last clause between shown and target,
+             or target if there is none
+    '''
+    if target >= len(words):
+        return len(words)
+    for i in range(target, shown, -1):
+        if words[i-1].endswith(CLAUSE_ENDS):
+            return i
+    return target
+
+
+def am_category_filters(categories):
+    '''
+    Sorts trivia categories into AniList formats, genres and tags.
+
+    Args:
+        categories (list): category names as typed by the user
+
+    Returns:
+        (list, list, list): matching formats, genres and tags
+    '''
+    media = []
+    genres = []
+    tags = []
+    for c in categories:
+        true_c = find_true_name(c)
+
+        for m in const.ANILIST_MEDIA:
+            if true_c == find_true_name(m):
+                media.append(m)
+                break
+
+        for g in const.ANILIST_GENRES:
+            if true_c == find_true_name(g):
+                genres.append(g)
+                break
+
+        for t in const.ANILIST_TAGS:
+            if true_c == find_true_name(t):
+                tags.append(t)
+                break
+
+    return media, genres, tags
 
 
 CENSOR_WHITELIST = ['the', 'and']
@@ -93,71 +163,137 @@ def check_answer(guess, answers, exact=False):
     return ''
 
 
+class CompiledAnswerSet:
+    '''
+    A question's answers, preprocessed once so that checking a guess only
+    has to normalize the guess. Accepts the same guesses as check_answer.
+    '''
+    def __init__(self, answers):
+        self.answers = answers
+        self.exact = {}
+        self.aliases = {}
+        self.true_answers = []
+
+        for answer in answers:
+            t_answer = find_true_name(answer)
+            self.exact.setdefault(t_answer, answer)
+            self.true_answers.append((t_answer, answer))
+
+            # Same alias heuristic as check_answer.
+            total = ''
+            for part in ALNUM_CHUNKS.findall(answer):
+                total += part.lower()
+                if len(total) >= 8:
+                    self.aliases.setdefault(total, answer)
+
+            if ':' in answer:
+                prefix = answer.split(':')[0]
+                self.aliases.setdefault(find_true_name(prefix), answer)
+
+    def match(self, guess, exact=False):
+        '''
+        Returns an empty string if the guess is incorrect, else the matching
+        answer.
+        '''
+        t_guess = find_true_name(guess)
+
+        if t_guess in self.exact:
+            return self.exact[t_guess]
+        elif exact:
+            return ''
+
+        for t_answer, answer in self.true_answers:
+            if t_answer in t_guess:
+                return answer
+
+        return self.aliases.get(t_guess, '')
+
+
 class TriviaGame:
     def __init__(self, room, bot):
         self.active = False
-        self.q_active = asyncio.Event()
         self.correct = asyncio.Event()
+        self.timer = None
         self.answers = []
 
         self.bot = bot
         self.room = room
         self.questions = QuestionList(self.room, self.bot)
 
-        try:
-            self.scoreboard = pd.read_csv('trivia/{}.txt'.format(self.room))
-        except FileNotFoundError:
-            self.scoreboard = pd.DataFrame(columns=['user', 'score'])
-        self.reset_scoreboard()
+        self.scoreboard = Scoreboard(bot.roomdata_man, room)
+
+    @property
+    def answers(self):
+        return self.compiled_answers.answers
+
+    @answers.setter
+    def answers(self, answers):
+        self.compiled_answers = CompiledAnswerSet(answers)
+
+    def start_timer(self, skip_time):
+        """
+        Skips the current question after skip_time seconds, unless it is resolved first.
+        """
+        self.cancel_timer()
+        if skip_time:
+            loop = asyncio.get_running_loop()
+            self.timer = loop.call_later(skip_time, self.expire, self.compiled_answers)
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def expire(self, compiled_answers):
+        # The question was answered or skipped between the deadline and the callback.
+        if not self.active or self.compiled_answers is not compiled_answers:
+            return
 
-    async def autoskip(self, skip_time):
         answer = self.answers[0]
-        while self.active and self.answers[0] == answer:
-            await self.q_active.wait()
-            self.q_active.clear()
-
-            await asyncio.sleep(skip_time)
-
-            if len(self.answers) == 0:
-                break
-
-            curr_time = int(time.time())
-            await self.bot.incoming.put(f'>{self.room}\n'
-                                        f'|c:|{curr_time}|*hippobotas|{answer}')
+        self.resolve()
+        self.bot.outgoing.put_nowait(f'{self.room}|Question skipped. The answer was {answer}.', priority=HIGH)
+
+    def resolve(self):
+        """
+        Closes the current question, whether answered or skipped, and moves the game on.
+        """
+        self.cancel_timer()
+        self.answers = []
+        self.correct.set()
 
     async def quizbowl_question(self, question, skip_time):
-        answer = self.answers[0]
-        curr_output = []
-        remaining = iter(question.split(' '))
-        done = False
-        while self.active and self.answers[0] == answer:
-            for _ in range(1):
-                try:
-                    word = next(remaining)
-                    curr_output.append(word)
-                    if word.endswith('.') or word.endswith(',') or word.endswith(';'):
-                        break
-                except StopIteration:
-                    done = True
-                    break
-            curr_str = ' '.join(curr_output)
-            await self.bot.outgoing.put(f'{self.room}|/adduhtml {UHTML_NAME}, {curr_str}')
-
-            if done:
-                asyncio.create_task(self.autoskip(skip_time))
+        compiled_answers = self.compiled_answers
+        loop = asyncio.get_running_loop()
+        words = question.split(' ')
+        shown = 0
+        verb = 'adduhtml'
+        start = loop.time()
+        while self.active and self.compiled_answers is compiled_answers:
+            # Back off while the outgoing queue is busy; the reveal pace is kept
+            # by revealing more words per frame.
+            frame_time = min(REVEAL_FRAME_TIME * (1 + self.bot.outgoing.qsize()), REVEAL_MAX_FRAME_TIME)
+
+            target = int((loop.time() - start) / REVEAL_WORD_TIME) + 1
+            cut = reveal_cut(words, shown, target)
+            if cut > shown:
+                shown = cut
+                curr_str = ' '.join(words[:shown])
+                await self.bot.outgoing.put(f'{self.room}|/{verb} {UHTML_NAME}, {curr_str}', priority=HIGH)
+                verb = 'changeuhtml'
+
+            if shown == len(words):
+                self.start_timer(skip_time)
                 return
-            await asyncio.sleep(0.3)
+
+            await asyncio.sleep(frame_time)
+
+    async def load_scoreboard(self):
+        if not self.scoreboard.loaded:
+            await self.scoreboard.load()
+            self.reset_scoreboard()
 
     def reset_scoreboard(self, length=60*60*24*3):
-        timer = self.scoreboard[self.scoreboard['user'] == const.TIMER_USER]
-        # Room that does not support auto-reset
-        if timer.empty:
-            self.scoreboard = pd.DataFrame(columns=['user', 'score'])
-            return
-        
-        if (time.time() - timer['score'].iloc[0]) > length:
-            timer.loc[timer['user'] == const.TIMER_USER, 'score'] = time.time()
-            self.scoreboard = timer
+        self.scoreboard.reset_if_due(length)
 
     async def run(self, n=10, diff=BASE_DIFF, categories=['all'],
                   excludecats=None, by_rating=False, autoskip=20,
@@ -169,6 +305,7 @@ class TriviaGame:
         self.active = True
         self.anagrams = anagrams
         self.quizbowl = quizbowl
+        await self.load_scoreboard()
         self.reset_scoreboard()
 
         if diff > 10:
@@ -180,73 +317,93 @@ class TriviaGame:
         self.questions.excludecats = excludecats
         self.questions.by_rating = by_rating
 
-        asyncio.create_task(self.questions.gen_list(n, self.bot, quizbowl=quizbowl, is_dex=is_dex, anagrams=anagrams),
-                            name='tquestions-{}'.format(self.room))
-
-        for _ in range(n):
-            await asyncio.sleep(5)
+        self.questions.start(n, self.bot, quizbowl=quizbowl, is_dex=is_dex, anagrams=anagrams)
 
-            curr_question = await self.questions.questions.get()
-            self.answers = curr_question[1]
-
-            if quizbowl:
-                asyncio.create_task(self.quizbowl_question(curr_question[0], autoskip))
-            else:
-                if autoskip:
-                    asyncio.create_task(self.autoskip(autoskip))
-
-                await self.bot.outgoing.put(f'{self.room}|{curr_question[0]}')
+        try:
+            for _ in range(n):
+                # The intermission overlaps with any generation still in progress.
+                _, curr_question = await asyncio.gather(asyncio.sleep(INTERMISSION),
+                                                        self.questions.get())
+                if curr_question is None:
+                    break
+                self.answers = curr_question[1]
 
-            self.q_active.set()
+                if quizbowl:
+                    asyncio.create_task(self.quizbowl_question(curr_question[0], autoskip))
+                else:
+                    await self.bot.outgoing.put(f'{self.room}|{curr_question[0]}', priority=HIGH)
+                    self.start_timer(autoskip)
 
-            await self.correct.wait()
-            self.correct.clear()
+                await self.correct.wait()
+                self.correct.clear()
+        except asyncio.CancelledError:
+            self.cancel_timer()
+            self.questions.stop()
+            raise
 
         await self.end()
 
     def update_scores(self, user):
-        user_pts = self.scoreboard[self.scoreboard['user'] == user]
-
-        if user_pts.empty:
-            new_user = pd.DataFrame([[user, 1]], columns=['user', 'score'])
-            self.scoreboard = self.scoreboard.append(new_user)
-        else:
-            self.scoreboard.loc[self.scoreboard['user'] == user, 'score'] += 1
+        self.scoreboard.increment(user)
 
     async def end(self):
-        self.scoreboard = self.scoreboard.sort_values('score', ascending=False)
-        self.scoreboard.to_csv('trivia/{}.txt'.format(self.room), index=False)
-
-        self.questions.ended = True
-        while not self.questions.ending_acknowledged:
-            await asyncio.sleep(0.1)
+        self.cancel_timer()
+        self.questions.stop()
+        self.questions.report()
         self.questions = QuestionList(self.room, self.bot)
 
         endtext = 'This trivia game has ended. See below for results.'
         await self.bot.outgoing.put(f'{self.room}|/adduhtml {UHTML_NAME}, {endtext}')
         await asyncio.sleep(1)
         t_title = 'Quizbowl Leaderboard' if self.quizbowl else 'Trivia Leaderboard'
-        await self.bot.outgoing.put(f"{self.room}|/adduhtml {leaderboard_uhtml(self.leaderboard(), t_title)}")
+        await self.bot.outgoing.put(f"{self.room}|/adduhtml {leaderboard_uhtml(await self.leaderboard(), t_title)}")
 
         self.active = False
 
     async def skip(self, putter):
         await putter(self.room + '|' + '/adduhtml {}, <center>Question skipped.</center>'.format(UHTML_NAME))
 
-    def leaderboard(self, n=5):
-        if n > 10:
-            n = 10
-        self.scoreboard = self.scoreboard.sort_values('score', ascending=False)
-        no_timer = self.scoreboard[self.scoreboard['user'] != const.TIMER_USER]
-        return no_timer.head(n=n).values.tolist()
-    
-    def userscore(self, user):
-        user_pts = self.scoreboard[self.scoreboard['user'] == user]
-        
-        if user_pts.empty:
-            return [None, None]
-        else:
-            return user_pts.values.tolist()[0]
+    async def leaderboard(self, n=5):
+        await self.load_scoreboard()
+        return self.scoreboard.top(min(n, 10))
+
+    async def userscore(self, user):
+        await self.load_scoreboard()
+        return self.scoreboard.get(user)
+
+
+class VGDatabase:
+    '''
+    The video game trivia database as columns indexed by rank,
+    loaded from VGTRIVIAFILE the first time a VG game starts.
+    '''
+    def __init__(self, vg_file):
+        self.vg_file = vg_file
+        self.ids = []
+        self.names = []
+        self.slugs = []
+        self.summaries = []
+        self.screenshots = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self):
+        if self.ids:
+            return
+
+        with open(self.vg_file) as f:
+            vg_database = json.load(f)
+
+        self.ids = [v['id'] for v in vg_database]
+        self.names = [v['name'] for v in vg_database]
+        self.slugs = [v['slug'] for v in vg_database]
+        self.summaries = [v['summary'] for v in vg_database]
+        self.screenshots = [tuple('https:' + s['url'].replace('t_thumb', 't_original') for s in v['screenshots'])
+                            for v in vg_database]
+
+
+VG_DATABASE = VGDatabase(const.VGTRIVIAFILE)
 
 
 class QuestionList:
@@ -258,71 +415,159 @@ class QuestionList:
         self.by_rating = False
         self.room = room
         self.bot = bot
-        self.q_bases = []
+        self.q_bases = set()
         self.num_qs = 0
         self.questions = asyncio.Queue()
         self.series_exist = True
         self.category_params = []
         self.max_rank = 0
-        self.ended = False
-        self.ending_acknowledged = True
+        self.max_rank_lock = asyncio.Lock()
+
+        self.producer = None
+        self.remaining = 0
+        self.in_flight = 0
+        self.space = asyncio.Event()
+        self.gen_times = []
+        self.stalls = 0
+
+    def start(self, n, bot, **kwargs):
+        self.producer = asyncio.create_task(self.gen_list(n, bot, **kwargs),
+                                            name='tquestions-{}'.format(self.room))
+
+    def stop(self):
+        if self.producer:
+            self.producer.cancel()
+
+    def finish(self):
+        '''
+        Stops generating questions once the source runs out. The game ends
+        after the questions already queued.
+        '''
+        self.remaining = 0
+        self.questions.put_nowait(None)
+
+    async def get(self):
+        '''
+        Takes the next question off the queue, waiting for one to be generated if needed.
+        '''
+        if self.questions.empty():
+            self.stalls += 1
+        question = await self.questions.get()
+        self.space.set()
+        return question
+
+    def report(self):
+        if not self.gen_times:
+            return
+        avg_time = sum(self.gen_times) / len(self.gen_times)
+        print(f'{self.room} trivia: {len(self.gen_times)} questions, avg generation {avg_time:.2f}s, '
+              f'max {max(self.gen_times):.2f}s, {self.stalls} stalls')
+
+    async def run_workers(self, gen, concurrency):
+        '''
+        Generates self.num_qs questions with up to concurrency generators running at once,
+        never getting more than LOOKAHEAD questions ahead of the game.
+
+        Args:
+            gen (coroutine function): generates one question and puts it on the queue.
+            concurrency (int): max number of questions generated at once.
+        '''
+        async def worker():
+            while self.remaining > 0:
+                self.remaining -= 1
+                while self.questions.qsize() + self.in_flight >= LOOKAHEAD:
+                    self.space.clear()
+                    await self.space.wait()
+
+                self.in_flight += 1
+                start = time.time()
+                try:
+                    await gen()
+                finally:
+                    self.in_flight -= 1
+                gen_time = time.time() - start
+                self.gen_times.append(gen_time)
+                print(f'{self.room} trivia: question generated in {gen_time:.2f}s, '
+                      f'{self.questions.qsize()} queued')
+
+        self.remaining = self.num_qs
+        await asyncio.gather(*[worker() for _ in range(min(concurrency, self.num_qs))])
 
     async def gen_list(self, n, bot, quizbowl=False, is_dex=False, anagrams=False):
         self.num_qs = n
+        concurrency = SOURCE_CONCURRENCY.get(self.room, 1)
         async with aiohttp.ClientSession() as session:
             if self.room == const.ANIME_ROOM:
-                for _ in range(n):
-                    if self.ended:
-                        self.ending_acknowledged = True
-                        break
-
-                    if is_dex:
-                        await self.gen_mangadex_question(session)
-                    elif quizbowl:
-                        await self.gen_am_qbowl_question(session, bot.anilist_man)
-                    else:
-                        await self.gen_am_question(session, bot.anilist_man, anagrams=anagrams)
+                if is_dex:
+                    concurrency = DEX_CONCURRENCY
+                    gen = lambda: self.gen_mangadex_question(session)
+                elif quizbowl:
+                    gen = lambda: self.gen_am_qbowl_question(session, bot.anilist_man)
+                else:
+                    gen = lambda: self.gen_am_question(session, bot.anilist_man, anagrams=anagrams)
 
             elif self.room == const.LEAGUE_ROOM:
-                for _ in range(n):
-                    await self.gen_lol_question(session)
+                if not await bot.ddragon.update():
+                    self.cancel_game()
+                    return
+                gen = self.gen_lol_question
 
             elif self.room == const.SCHOL_ROOM:
-                num_tossups = (QuestionTable.select()
-                                            .where(QuestionTable.question_type == 't')
-                                            .count())
-                num_bonuses = (QuestionTable.select()
-                                            .where(QuestionTable.question_type == 'b')
-                                            .count()) / 3
+                num_tossups = QB_INDEX.count('t')
+                num_bonuses = QB_INDEX.count('b')
 
-                q_types = random.choices(['t', 'b'], weights=[num_tossups, num_bonuses], k=n)
-                for qt in q_types:
-                    await self.gen_schol_qbowl_question(qt)
+                q_types = iter(random.choices(['t', 'b'], weights=[num_tossups, num_bonuses], k=n))
+                gen = lambda: self.gen_schol_qbowl_question(next(q_types))
 
             elif self.room == const.SPORTS_ROOM:
                 await self.gen_sports_questions(session)
+                return
 
             elif self.room == const.VG_ROOM:
-                vg_database = json.load(open('data/vg_trivia.json'))
-                for _ in range(n):
-                    if quizbowl:
-                        await self.gen_vg_qbowl_question(vg_database)
-                    else:
-                        await self.gen_vg_question(vg_database, anagrams=anagrams)
-
-    def duplicate_check(self, d):
-        for base in self.q_bases:
-            if d == base:
-                return True
-        return False
-
-    def check_for_jpg(self, url):
-        r = requests.get(url)
-        if r.status_code != 200:
-            return url[:-3] + 'jpg'
-        return url
+                VG_DATABASE.load()
+                if quizbowl:
+                    gen = self.gen_vg_qbowl_question
+                else:
+                    gen = lambda: self.gen_vg_question(anagrams=anagrams)
+
+            else:
+                return
+
+            await self.run_workers(gen, concurrency)
+
+    def reserve(self, d):
+        '''
+        Claims a question base for this game, so concurrent workers never
+        generate questions from the same base.
+
+        Args:
+            d: the question base, such as a series id
+
+        Returns:
+            bool: False if the base was already used this game
+        '''
+        if d in self.q_bases:
+            return False
+        self.q_bases.add(d)
+        return True
+
+    def cancel_game(self):
+        for task in asyncio.all_tasks():
+            if task.get_name() == 'trivia-{}'.format(self.room):
+                task.cancel()
+                return
+
+    def sample_am_rank(self):
+        diff_scale = max(1.1, math.log(self.max_rank, 10) / 1.5)
+        std_dev_scale = max(10, diff_scale ** 2)
+
+        return int(truncated_gauss(self.max_rank // ((diff_scale) ** (10 - self.diff)),
+                                   (std_dev_scale * self.diff / 2), 1, self.max_rank + 1))
 
     async def gen_am_base(self, session, anilist_man):
+        if self.bot.media_snapshot.ready:
+            return await self.gen_am_base_local()
+
         query = '''
         query ($page: Int, $perpage: Int) {
             Page (page: $page, perPage: $perpage) {
@@ -350,26 +595,7 @@ class QuestionList:
 
         if not self.category_params:
             if 'all' not in self.categories:
-                media = []
-                genres = []
-                tags = []
-                for c in self.categories:
-                    true_c = find_true_name(c)
-
-                    for m in const.ANILIST_MEDIA:
-                        if true_c == find_true_name(m):
-                            media.append(m)
-                            break
-
-                    for g in const.ANILIST_GENRES:
-                        if true_c == find_true_name(g):
-                            genres.append(g)
-                            break
-
-                    for t in const.ANILIST_TAGS:
-                        if true_c == find_true_name(t):
-                            tags.append(t)
-                            break
+                media, genres, tags = am_category_filters(self.categories)
 
                 if media:
                     self.category_params.append(f'format_in: {", ".join(media)}')
@@ -379,26 +605,7 @@ class QuestionList:
                     self.category_params.append(f'tag_in: {json.dumps(tags)}')
 
                 if self.excludecats:
-                    media = []
-                    genres = []
-                    tags = []
-                    for c in self.excludecats:
-                        true_c = find_true_name(c)
-
-                        for m in const.ANILIST_MEDIA:
-                            if true_c == find_true_name(m):
-                                media.append(m)
-                                break
-
-                        for g in const.ANILIST_GENRES:
-                            if true_c == find_true_name(g):
-                                genres.append(g)
-                                break
-
-                        for t in const.ANILIST_TAGS:
-                            if true_c == find_true_name(t):
-                                tags.append(t)
-                                break
+                    media, genres, tags = am_category_filters(self.excludecats)
 
                     if media:
                         self.category_params.append(f'format_not_in: {json.dumps(media)}')
@@ -415,36 +622,27 @@ class QuestionList:
         sort = 'SCORE_DESC' if self.by_rating else 'POPULARITY_DESC'
         query = query.replace('SORT_PLACEHOLDER', sort)
 
-        # Get max_rank
-        if not self.max_rank:
-            query_vars = {
-                'page': 1,
-                'perpage': 1
-            }
+        # Get max_rank once, even with several questions generating at once
+        async with self.max_rank_lock:
+            if not self.max_rank:
+                query_vars = {
+                    'page': 1,
+                    'perpage': 1
+                }
 
-            async with anilist_man.lock():
-                self.max_rank = await anilist_num_entries(query, query_vars, session)
+                async with anilist_man.lock():
+                    self.max_rank = await anilist_num_entries(query, query_vars, session)
 
-            if not self.max_rank:
-                for task in asyncio.all_tasks():
-                    if task.get_name() == 'trivia-{}'.format(self.room):
-                        task.cancel()
-                        return
+                if not self.max_rank:
+                    self.cancel_game()
+                    return
 
-        rank = 0
         if self.max_rank < self.num_qs:
             self.series_exist = False
-            for task in asyncio.all_tasks():
-                if task.get_name() == 'trivia-{}'.format(self.room):
-                    task.cancel()
-                    return
-
-        diff_scale = max(1.1, math.log(self.max_rank, 10) / 1.5)
-        std_dev_scale = max(10, diff_scale ** 2)
+            self.cancel_game()
+            return
 
-        while rank < 1 or rank > self.max_rank:
-            rank = int(random.gauss(self.max_rank // ((diff_scale) ** (10 - self.diff)),
-                                    (std_dev_scale * self.diff / 2)))
+        rank = self.sample_am_rank()
 
         all_series = []
         roll_query_vars = {
@@ -458,10 +656,8 @@ class QuestionList:
                     resp = await r.json()
 
                     if r.status != 200:
-                        for task in asyncio.all_tasks():
-                            if task.get_name() == 'trivia-{}'.format(self.room):
-                                task.cancel()
-                                return
+                        self.cancel_game()
+                        return
 
                     all_series = resp['data']['Page']['media']
 
@@ -485,14 +681,57 @@ class QuestionList:
             slug = slug.fromkeys(slug, None)
         return slug
 
+    async def gen_am_base_local(self):
+        '''
+        Same as gen_am_base, but samples from the local AniList snapshot.
+        '''
+        include = (frozenset(), frozenset(), frozenset())
+        exclude = include
+        if 'all' not in self.categories:
+            include = tuple(map(frozenset, am_category_filters(self.categories)))
+            if self.excludecats:
+                exclude = tuple(map(frozenset, am_category_filters(self.excludecats)))
+
+        snapshot = self.bot.media_snapshot
+        all_series = snapshot.ranked(include, exclude, by_rating=self.by_rating)
+        self.max_rank = len(all_series)
+
+        if self.max_rank < self.num_qs:
+            self.series_exist = False
+            self.cancel_game()
+            return
+
+        rank = self.sample_am_rank()
+        series_data = all_series[rank - 1]
+
+        aliases = []
+        for title in ('title_english', 'title_preferred', 'title_romaji'):
+            if series_data[title]:
+                aliases.append(series_data[title])
+
+        slug = {'img_url': series_data['cover_url'],
+                'description': series_data['description'],
+                'answers': aliases,
+                'rank': rank,
+                'id': series_data['id']}
+
+        is_nsfw = series_data['nsfw']
+        if is_nsfw is None:
+            # Only a rating MAL actually returned is stored, so a failed
+            # request is checked again the next time the series comes up.
+            is_nsfw = await self.bot.mal_man.nsfw_rating(series_data['type'].lower(), series_data['id_mal'])
+            if is_nsfw is not None:
+                await asyncio.to_thread(snapshot.set_nsfw, series_data, is_nsfw)
+        if is_nsfw is not False:
+            slug = slug.fromkeys(slug, None)
+        return slug
+
     async def gen_am_question(self, session, anilist_man, anagrams=False):
         base = await self.gen_am_base(session, anilist_man)
 
-        while self.duplicate_check(base['id']) or not base['img_url']:
+        while not base['img_url'] or not self.reserve(base['id']):
             base = await self.gen_am_base(session, anilist_man)
 
-        self.q_bases.append(base['id'])
-
         if anagrams:
             answer = random.choice(base['answers'])
             scrambled = anagram_scramble(answer)
@@ -500,18 +739,16 @@ class QuestionList:
             await self.questions.put([f'/announce Unscramble this: **{scrambled}**', [answer]])
             return
 
-        img_url = gen_uhtml_img_code(base['img_url'], dims=(140, 210))
+        img_url = await gen_uhtml_img_code(base['img_url'], dims=(140, 210))
 
         await self.questions.put(['/adduhtml {}, {}'.format(UHTML_NAME, img_url),
                                   base['answers']])
 
     async def gen_am_qbowl_question(self, session, anilist_man):
         base = await self.gen_am_base(session, anilist_man)
-        while self.duplicate_check(base['id']) or not base['description']:
+        while not base['description'] or not self.reserve(base['id']):
             base = await self.gen_am_base(session, anilist_man)
 
-        self.q_bases.append(base['id'])
-
         question = base['description']
         for title in base['answers']:
             question = censor_quizbowl(title, question)
@@ -543,7 +780,7 @@ class QuestionList:
                 if skip:
                     continue
 
-                if not self.duplicate_check(series_info['id']):
+                if self.reserve(series_info['id']):
                     series_id = series_info['id']
 
                     answers = [series_info['attributes']['title']['en']]
@@ -558,119 +795,73 @@ class QuestionList:
             cover_id = cover_info['attributes']['fileName']
 
         img_url = f'https://uploads.mangadex.org/covers/{series_id}/{cover_id}.256.jpg'
-        img_uhtml = gen_uhtml_img_code(img_url, height_resize=PIC_SIZE)
+        img_uhtml = await gen_uhtml_img_code(img_url, height_resize=PIC_SIZE)
         await self.questions.put(['/adduhtml {}, {}'.format(UHTML_NAME, img_uhtml), answers])
 
-    async def gen_lol_base(self, session, data):
-        base = {}
-
+    def gen_lol_base(self, ddragon):
         qtypes = []
         if 'all' not in self.categories:
             qtypes = [c for c in const.LEAGUE_CATS if c in self.categories]
 
         if self.excludecats:
-            qtypes = const.LEAGUE_CATS - qtypes
+            qtypes = [c for c in const.LEAGUE_CATS if c not in qtypes]
 
         if len(qtypes) == 0:
             qtypes = const.LEAGUE_CATS
-        
+
         if len(qtypes) == 3:
-            data['qtype'] = random.choices(qtypes, weights=[4, 2, 4])[0]
+            qtype = random.choices(qtypes, weights=[4, 2, 4])[0]
         else:
-            data['qtype'] = random.choice(qtypes)
+            qtype = random.choice(qtypes)
 
-        data['champ'] = random.choice(list(data['all_champs'].keys()))
-        data['item'] = random.choice(list(data['all_items'].keys()))
+        # Bases are (qtype, item) or (qtype, champ, cval) so they can be deduplicated in a set
+        if qtype == 'items':
+            return (qtype, random.choice(list(ddragon.items)))
 
-        if data['qtype'] == 'items':
-            base = {k:data[k] for k in ('qtype', 'item')}
+        champ = random.choice(list(ddragon.champs))
+        if qtype == 'skins':
+            cval = random.choice(ddragon.champs[champ]['skins'])['num']
         else:
-            async with session.get(const.DDRAGON_API + 'champion/{}.json'.format(data['champ'])) as r:
-                resp = await r.text()
-                data['champ_data'] = json.loads(resp)['data'][data['champ']]
+            cval = random.randint(0, 4)
 
-                if data['qtype'] == 'skins':
-                    skin = random.choice(data['champ_data']['skins'])
-                    data['cval'] = skin['num']
-                elif data['qtype'] == 'spells':
-                    data['cval'] = random.randint(0, 4)
+        return (qtype, champ, cval)
 
-                base = {k:data[k] for k in ('qtype', 'champ', 'cval')}
+    async def gen_lol_question(self):
+        ddragon = self.bot.ddragon
 
-        return data, base
-        
-    async def gen_lol_question(self, session):
-        data = {'all_champs': {}, 'champ': '', 'champ_data': {}, 'all_items': {}, 'item': {}}
-
-        async with session.get(const.DDRAGON_API + 'champion.json') as r:
-            resp = await r.text()
-            data['all_champs'] = json.loads(resp)['data']
-        
-        async with session.get(const.DDRAGON_API + 'item.json') as r:
-            resp = await r.text()
-            data['all_items'] = json.loads(resp)['data']
-        data, base = await self.gen_lol_base(session, data)
-        while self.duplicate_check(base):
-            data, base = await self.gen_lol_base(session, data)
-        
-        self.q_bases.append(base)
-
-        if data['qtype'] == 'items':
-            img_url = const.DDRAGON_IMG + 'item/{}.png'.format(data['item'])
-            img_url = gen_uhtml_img_code(self.check_for_jpg(img_url))
-            await self.questions.put(['/adduhtml {}, {}'.format(UHTML_NAME, img_url),
-                                      [data['all_items'][data['item']]['name']]])
-        elif data['qtype'] == 'skins':
-            skin_name = ''
-            for skin in data['champ_data']['skins']:
-                if skin['num'] == data['cval']:
-                    skin_name = skin['name'] if skin['name'] != 'default' else data['champ_data']['name']
-                    break
+        base = self.gen_lol_base(ddragon)
+        while not self.reserve(base):
+            base = self.gen_lol_base(ddragon)
 
-            img_url = const.DDRAGON_SPL + '{}_{}.png'.format(data['champ'], data['cval'])
-            img_url = gen_uhtml_img_code(self.check_for_jpg(img_url))
-            await self.questions.put(['/adduhtml {}, {}'.format(UHTML_NAME, img_url),
-                                      [skin_name]])
-        elif data['qtype'] == 'spells':
-            ability = {}
-            if data['cval'] == 0:
-                ability = data['champ_data']['passive']
-                img_url = const.DDRAGON_IMG + 'passive/{}'.format(ability['image']['full'])
-                img_url = gen_uhtml_img_code(self.check_for_jpg(img_url))
-                await self.questions.put(['/adduhtml {}, {}'.format(UHTML_NAME, img_url),
-                                          [ability['name']]])
+        if base[0] == 'items':
+            item = ddragon.items[base[1]]
+            answer = item['name']
+            img = item['img']
+        else:
+            qtype, champ, cval = base
+            champ = ddragon.champs[champ]
+            if qtype == 'skins':
+                skin = next(s for s in champ['skins'] if s['num'] == cval)
+                answer = skin['name'] if skin['name'] != 'default' else champ['name']
+                img = skin['img']
             else:
-                ability = data['champ_data']['spells'][data['cval']-1]
-                img_url = const.DDRAGON_IMG + 'spell/{}'.format(ability['image']['full'])
-                img_url = gen_uhtml_img_code(self.check_for_jpg(img_url))
-                await self.questions.put(['/adduhtml {}, {}'.format(UHTML_NAME, img_url),
-                                          [ability['name']]])
-
-    def gen_schol_base(self, q_type):
-        q_row = (QuestionTable.select()
-                              .where(QuestionTable.question_type == q_type)
-                              .order_by(fn.Random())
-                              .limit(1))[0]
-
-        while q_row.prev_b:
-            q_row = (QuestionTable.select()
-                                  .where(QuestionTable.qid == q_row.prev_b))[0]
+                ability = champ['spells'][cval]
+                answer = ability['name']
+                img = ability['img']
 
-        return q_row
+        # Images missing from Data Dragon fall back to the usual lookup
+        dims = resize_dims(img['dims']) if all(img['dims']) else None
+        img_uhtml = await gen_uhtml_img_code(img['url'], dims=dims)
+        await self.questions.put(['/adduhtml {}, {}'.format(UHTML_NAME, img_uhtml), [answer]])
 
     async def gen_schol_qbowl_question(self, q_type):
-        question = self.gen_schol_base(q_type)
+        qid = QB_INDEX.sample(q_type)
 
-        while self.duplicate_check(question.qid):
-            question = self.gen_schol_base(q_type)
+        while not self.reserve(qid):
+            qid = QB_INDEX.sample(q_type)
 
-        self.q_bases.append(question.qid)
-
-        await self.questions.put([question.question, json.loads(question.answer)])
-        while question.next_b:
-            question = (QuestionTable.select()
-                                     .where(QuestionTable.qid == question.next_b))[0]
-            await self.questions.put([question.question, json.loads(question.answer)])
+        for _, question, answer in QB_INDEX.chain(qid):
+            await self.questions.put([question, json.loads(answer)])
 
     async def gen_sports_questions(self, session):
         payload = {'amount': min(self.num_qs, 50),
@@ -685,42 +876,46 @@ class QuestionList:
             formatted = f"""/announce {q['question']}"""
             await self.questions.put([formatted, [q['correct_answer']]])
 
-    def gen_vg_base(self, vg_database):
-        rank = -1
-        while rank < 0 or rank >= len(vg_database):
-            rank = int(random.gauss(VG_DIFF_SCALE * (self.diff - 2),
-                                    (VG_DIFF_SCALE * self.diff) // 2))
-        vidya = vg_database[rank]
-
-        while vidya['id'] in self.q_bases:
-            rank = -1
-            while rank < 0 or rank >= len(vg_database):
-                rank = int(random.gauss(VG_DIFF_SCALE * (self.diff - 2),
-                                        (VG_DIFF_SCALE * self.diff) // 2))
-            vidya = vg_database[rank]
-
-        self.q_bases.append(vidya['id'])
-        return vidya
-
-    async def gen_vg_qbowl_question(self, vg_database):
-        vidya = self.gen_vg_base(vg_database)
+    def gen_vg_base(self):
+        num_games = len(VG_DATABASE)
+        for _ in range(VG_MAX_DRAWS):
+            rank = int(truncated_gauss(VG_DIFF_SCALE * (self.diff - 2),
+                                       (VG_DIFF_SCALE * self.diff) // 2, 0, num_games))
+            if self.reserve(VG_DATABASE.ids[rank]):
+                break
+        else:
+            unused = [i for i in range(num_games) if VG_DATABASE.ids[i] not in self.q_bases]
+            # Every game has been asked, so the game ends with the questions so far.
+            if not unused:
+                self.finish()
+                return None
+            rank = random.choice(unused)
+            self.reserve(VG_DATABASE.ids[rank])
+
+        return rank
+
+    async def gen_vg_qbowl_question(self):
+        rank = self.gen_vg_base()
+        if rank is None:
+            return
+        name = VG_DATABASE.names[rank]
 
-        question = vidya['summary']
-        question = censor_quizbowl(vidya['name'], question)
+        question = censor_quizbowl(name, VG_DATABASE.summaries[rank])
 
-        await self.questions.put([question, [vidya['name'], vidya['slug']]])
+        await self.questions.put([question, [name, VG_DATABASE.slugs[rank]]])
 
-    async def gen_vg_question(self, vg_database, anagrams=False):
-        vidya = self.gen_vg_base(vg_database)
+    async def gen_vg_question(self, anagrams=False):
+        rank = self.gen_vg_base()
+        if rank is None:
+            return
+        name = VG_DATABASE.names[rank]
 
         if anagrams:
-            answer = vidya['name']
-            scrambled = anagram_scramble(answer)
+            scrambled = anagram_scramble(name)
 
-            await self.questions.put([f'/announce Unscramble this: **{scrambled}**', [answer]])
+            await self.questions.put([f'/announce Unscramble this: **{scrambled}**', [name]])
             return
 
-        screenshot_url = 'https:' + random.choice(vidya['screenshots'])['url']
-        screenshot_url = screenshot_url.replace('t_thumb', 't_original')
+        screenshot_url = random.choice(VG_DATABASE.screenshots[rank])
         question = f'/adduhtml {UHTML_NAME}, <center><img src=\'{screenshot_url}\' width=266 height=150></center>'
-        await self.questions.put([question, [vidya['name'], vidya['slug']]])
\ No newline at end of file
+        await self.questions.put([question, [name, VG_DATABASE.slugs[rank]]])
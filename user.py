@@ -5,6 +5,9 @@ import os
 import pandas as pd
 import random
 import re
+import time
+
+from collections import OrderedDict
 
 from common.utils import find_true_name
 
@@ -29,3 +32,128 @@ class User:
         self.rank = rank
         if self.true_name == 'hippopotas':
             self.rank = '~'
+
+
+class UserInfoCache:
+    '''
+    Caches the group and rooms of users from /cmd userdetails responses.
+
+    Entries expire after ttl seconds, and the least recently used are dropped
+    past max_size. Entries used within the last ttl are refreshed in the
+    background before they expire, while idle ones age out. Concurrent lookups
+    of the same user share one query, and lookups whose response never comes
+    back fall back after timeout seconds.
+
+    Args:
+        request (coroutine function): sends the userdetails query for a userid,
+            given whether it is a background refresh
+        ttl (int): seconds before cached info is queried again
+        max_size (int): max number of users kept
+        timeout (int): seconds to wait for a response
+    '''
+    DEFAULT_INFO = {'group': ' ', 'rooms': {}}
+
+    def __init__(self, request, ttl=3*60*60, max_size=2000, timeout=10):
+        self.request = request
+        self.ttl = ttl
+        self.max_size = max_size
+        self.timeout = timeout
+
+        # userid -> (info, time fetched, time last used), least recently used first
+        self.users = OrderedDict()
+        self.pending = {}
+        # Users whose pending query is a background refresh
+        self.refreshing = set()
+
+    def __len__(self):
+        return len(self.users)
+
+    async def get(self, true_user):
+        now = time.time()
+        entry = self.users.get(true_user)
+        if entry and now - entry[1] < self.ttl:
+            self.users[true_user] = (entry[0], entry[1], now)
+            self.users.move_to_end(true_user)
+            return entry[0]
+
+        return await self.fetch(true_user)
+
+    async def fetch(self, true_user, background=False):
+        '''
+        Queries a user's info, sharing any query already in flight.
+        On timeout, returns the last known info or the defaults.
+
+        Args:
+            true_user (str): userid to look up
+            background (bool): whether this is a refresh rather than a use of the info
+        '''
+        future = self.pending.get(true_user)
+        if not background:
+            self.refreshing.discard(true_user)
+        if not future:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[true_user] = future
+            if background:
+                self.refreshing.add(true_user)
+            await self.request(true_user, background)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            if self.pending.get(true_user) is future:
+                del self.pending[true_user]
+                self.refreshing.discard(true_user)
+            print(f'userdetails for {true_user} timed out.')
+
+            entry = self.users.get(true_user)
+            return entry[0] if entry else dict(self.DEFAULT_INFO)
+
+    def resolve(self, userinfo):
+        '''
+        Stores a userdetails response and wakes up anyone waiting on it.
+
+        Args:
+            userinfo (dict): the parsed queryresponse JSON
+        '''
+        true_user = userinfo['id']
+        info = {'group': userinfo.get('group') or self.DEFAULT_INFO['group'],
+                'rooms': userinfo.get('rooms') or {}}
+
+        now = time.time()
+        entry = self.users.get(true_user)
+        if true_user in self.refreshing:
+            # A refresh is not a use, so it keeps the entry's last use and LRU position.
+            self.refreshing.discard(true_user)
+            if entry:
+                self.users[true_user] = (info, now, entry[2])
+        else:
+            self.users[true_user] = (info, now, now)
+            self.users.move_to_end(true_user)
+            while len(self.users) > self.max_size:
+                self.users.popitem(last=False)
+
+        future = self.pending.pop(true_user, None)
+        if future and not future.done():
+            future.set_result(info)
+
+    async def refresh(self, per_second=2):
+        '''
+        Drops users who have not been looked up within the TTL, then re-queries
+        the rest whose info is past half its TTL, spaced out so the refresh
+        does not flood the outgoing queue.
+
+        Args:
+            per_second (int): max queries sent per second
+        '''
+        now = time.time()
+        idle = [u for u, (_, _, used) in self.users.items() if now - used > self.ttl]
+        for true_user in idle:
+            del self.users[true_user]
+
+        stale = [u for u, (_, fetched, _) in self.users.items() if now - fetched > self.ttl / 2]
+        for true_user in stale:
+            if true_user in self.users and true_user not in self.pending:
+                asyncio.create_task(self.fetch(true_user, background=True))
+            await asyncio.sleep(1 / per_second)
+
+        return len(stale)